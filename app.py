@@ -1,68 +1,111 @@
-import dash 
-from dash import dcc
-from dash import html
-import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
-import plotly.express as px
-import pandas as pd
-import numpy as np
-from whitenoise import WhiteNoise
-import codes.dataset as dataset
-import codes.callbacks as callbacks
+import functools
+import glob
+import logging
+import os
+import threading
+import codes.metrics as metrics
+
+# the imports and the loading of the data are timed for the startup report. 
+# plotly express is only imported once the first figure is built.
+with metrics.startup_phase('import dash'):
+    import dash 
+    from dash import dcc
+    from dash import html
+    from dash import dash_table
+    import dash_bootstrap_components as dbc
+    from dash.dependencies import Input, Output, State
+    from whitenoise import WhiteNoise
+    from flask_compress import Compress
+    import flask
+with metrics.startup_phase('import codes'):
+    import pandas as pd
+    import codes.dataset as dataset
+    import codes.derived as derived
+    import codes.callbacks as callbacks
+    import codes.cache as cache
+    import codes.commodities as commodities
+    import codes.compact as compact
+    import codes.forecast as forecast
+    import codes.jobs as jobs
+    import codes.snapshot as snapshot
+    import codes.warmup as warmup
+    import codes.watcher as watcher
+    import codes.settings as settings
 
 
 external_stylesheets = [dbc.themes.SPACELAB]
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 server = app.server
+# status messages (startup report, data refreshes) are logged at the info level
+server.logger.setLevel(logging.INFO)
+# compress the responses, with Brotli for the browsers that accept it
+server.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+Compress(server)
 server.wsgi_app = WhiteNoise(server.wsgi_app, root='static/')
 
-filename = 'static/UNdata_Export_20211018_063214641.csv'
-energyData = dataset.EnergyData(filename)
-
-# PRODUCTION - data
-df_gen = callbacks.build_production_dataset(energyData=energyData, 
-                                            year=2018, 
-                                            transactions=['EP', 'SP', 
-                                                          '015C', '016C',
-                                                          '015HY', '016HY',
-                                                          '015N', '016N',
-                                                          '015W', '016W',
-                                                          '015S', '016S',
-                                                          '015H', '016H',
-                                                          ], 
-                                            codes=True)
+def load_commodities(filenames):
+    # shared between the workers like the data set of the other panels
+    if settings.SHARED_DATA_DIR:
+        return commodities.CommodityData.shared(filenames, settings.SHARED_DATA_DIR)
+    return commodities.CommodityData(filenames)
+
+
+with metrics.startup_phase('load data'):
+    filename = settings.DATA_FILE
+    if settings.DATA_DIR:
+        filename = watcher.latest_export(settings.DATA_DIR) or filename
+    if settings.SHARED_DATA_DIR:
+        energyData = dataset.EnergyData.shared(filename, settings.SHARED_DATA_DIR, **settings.DATA_OPTIONS)
+    else:
+        energyData = dataset.EnergyData(filename, **settings.DATA_OPTIONS)
+    # all the commodities of the commodity explorer (the export of the other panels by default)
+    commodityData = load_commodities(settings.COMMODITY_FILES or [filename])
+
+# figures returned by the callbacks are cached per input values. 
+# Set FIGURE_CACHE_DIR to share the cache between gunicorn workers.
+# The entries stored on disk are tied to the data file and options, and to the code of the figures
+figure_version = None
+if settings.FIGURE_CACHE_DIR:
+    sources = [__file__] + glob.glob(os.path.join(os.path.dirname(dataset.__file__), '*.py'))
+    figure_version = '%s-%s' % (snapshot.file_hash(filename, settings.DATA_OPTIONS or None)[:12], 
+                                snapshot.code_hash(sorted(sources)))
+figure_cache = cache.FigureCache(max_entries=4096, directory=settings.FIGURE_CACHE_DIR, version=figure_version)
+
+# figures that are not cached are rendered in background threads: the callbacks return 
+# placeholders if they take longer than JOB_WAIT and poll for them (see poll)
+executor = jobs.JobExecutor(figure_cache, max_workers=settings.JOB_WORKERS, wait=settings.JOB_WAIT)
+
+# time between two polls of the callbacks waiting for their figures, in ms
+POLL_INTERVAL = 500
+
+# years the trends can be projected to
+FORECAST_YEARS = list(range(2020, 2041))
+
+# FIGURES
+# the layout only holds the base map: the other figures are rendered by the callbacks 
+# when the page loads (and in the background at start, see DEFERRED START)
+@functools.lru_cache(maxsize=None)
+def base_map():
+    import plotly.express as px
+    # the values are replaced in the browser by the first update of the world explorer
+    df_world = callbacks.build_world_data(energyData, 2018, '12')
+    return compact.compact_figure(px.choropleth(data_frame=df_world, locations='ISO-3', locationmode='ISO-3', 
+                                                color='Quantity (1e6 kW/h)', color_continuous_scale='jet'))
+
+
+@functools.lru_cache(maxsize=None)
+def base_region_figures():
+    import plotly.express as px
+    # like the world map, the values are replaced in the browser by the updates of the regional explorer
+    values = callbacks.build_region_values(energyData, 2018, '12', 'Continent')
+    df_map = pd.DataFrame({'ISO-3': values['locations'], 'Region': values['text'], 
+                           'Quantity (1e6 kW/h)': values['z']})
+    df_bar = pd.DataFrame({'Region': values['regions'], 'Quantity (1e6 kW/h)': values['totals']})
+    fig_map = px.choropleth(data_frame=df_map, locations='ISO-3', locationmode='ISO-3', hover_name='Region',
+                            color='Quantity (1e6 kW/h)', color_continuous_scale='jet')
+    fig_bar = px.bar(df_bar, x='Region', y='Quantity (1e6 kW/h)')
+    return compact.compact_figure(fig_map), compact.compact_figure(fig_bar)
 
-# PRODUCTION - figures
-fig_prod_bar = px.bar(df_gen[(df_gen['Purpose']!='Other') & (df_gen['Fuel']!='Total')], 
-                      x='Fuel', y = 'Quantity (1e6 kW/h)', color='Purpose')
-fig_prod_pie1 = px.pie(df_gen[(df_gen['Purpose']!='Other') & (df_gen['Fuel']!='Total')], 
-             values = 'Quantity (1e6 kW/h)', names = 'Fuel', title = 'Total')
-fig_prod_pie2 = px.pie(df_gen[(df_gen['Purpose'] == 'Main activity') & (df_gen['Fuel']!='Total')], 
-             values = 'Quantity (1e6 kW/h)', names = 'Fuel', title = 'Main activity')
-fig_prod_pie3 = px.pie(df_gen[(df_gen['Purpose'] == 'Autoproducer') & (df_gen['Fuel']!='Total')], 
-             values = 'Quantity (1e6 kW/h)', names = 'Fuel', title = 'Autoproducer')
-
-
-# CONSUMPTION - data
-df_cons = callbacks.build_consumption_dataset(energyData=energyData,
-                                              years = list(range(2008,2019)))
-
-# CONSUMPTION - figures
-fig_cons_line = px.line(df_cons, x='Year', y='Quantity (1e6 kW/h)', color='Consumer')
-fig_cons_bar = px.bar(df_cons, x='Consumer', y = 'Quantity (1e6 kW/h)', color='Year', color_continuous_scale='oryel')
-
-# create a dict of years and labels for the slider marks
-year_map = {}
-for year in energyData.data['Year'].unique():
-    year_map[year] = str(year)
-    
-print(year_map)
-    
-# WORLD EXPLORER - data
-df_world = callbacks.build_world_data(energyData, 2018, '12')
-# WORLD EXPLORER - figures
-fig_world = px.choropleth(data_frame=df_world, locations='ISO-3', locationmode='ISO-3', 
-                          color='Quantity (1e6 kW/h)', color_continuous_scale='jet')
 
 # APP LAYOUT
 # ---------
@@ -74,197 +117,442 @@ fig_world = px.choropleth(data_frame=df_world, locations='ISO-3', locationmode='
 # consumption graphs: line plot (x-year, y-consumption), bar chart with sum for all years
 # callbacks: choose range of years
  
-app.layout = dbc.Container([
+# the layout is built on every page load, so that the options list the years and transactions 
+# of the current data set after a refresh
+def serve_layout():
+    return dbc.Container([
     
-    # header
-    dbc.Container([
-        html.H2('Electricity Generation and Consumption'),
-        html.P('Exploration of data on total electricity from the UNDATA Energy Statistics Database (http://data.un.org/Explorer.aspx)')
-    ], style={'margin': '0em', 'marginBottom': '1em', 'paddingBottom': '2em', 'paddingTop': '2em', 'backgroundColor': '#ffffff'}),
+        # header
+        dbc.Container([
+            html.H2('Electricity Generation and Consumption'),
+            html.P('Exploration of data on total electricity from the UNDATA Energy Statistics Database (http://data.un.org/Explorer.aspx)')
+        ], style={'margin': '0em', 'marginBottom': '1em', 'paddingBottom': '2em', 'paddingTop': '2em', 'backgroundColor': '#ffffff'}),
     
-    # generation
-    dbc.Container([
-        dbc.Row([
-            dbc.Col([
-                html.H4(children='World Electricity Generation by Fuel'),
-                html.P(children='Electricity generation by combustible fuels (coal, oil, natural gas),\
-                         nuclear, solar, wind, hydro and chemical heat (biofuels).')
-            ])
-        ]),
+        # generation
+        dbc.Container([
+            dbc.Row([
+                dbc.Col([
+                    html.H4(children='World Electricity Generation by Fuel'),
+                    html.P(children='Electricity generation by combustible fuels (coal, oil, natural gas),\
+                             nuclear, solar, wind, hydro and chemical heat (biofuels).')
+                ])
+            ]),
+        
+            dbc.Row(
+                dbc.Col([
+                    dcc.RadioItems(
+                    id='production-year',
+                    options=[{'label': i, 'value': i} for i in reversed(energyData.years.tolist())],
+                    value=2018,
+                    labelStyle={'display': 'inline-block', 'margin': '5px'}
+                ),
+                dcc.Interval(id='production-poll', interval=POLL_INTERVAL, disabled=True)
+                ])
+            ),
+        
+            dbc.Row([
+                dbc.Col([
+                    dcc.Graph(
+                    id='production-bar'
+                    )
+                    ])
+            ]),
         
-        dbc.Row(
-            dbc.Col([
-                dcc.RadioItems(
-                id='production-year',
-                options=[{'label': i, 'value': i} for i in energyData.data['Year'].unique()],
-                value=2018,
-                labelStyle={'display': 'inline-block', 'margin': '5px'}
-            )    
+            dbc.Row([
+                dbc.Col([
+                    dcc.Graph(
+                    id='production-pie1'
+                    )]),
+                dbc.Col([
+                    dcc.Graph(
+                    id='production-pie2'
+                    )]),
+                dbc.Col([
+                    dcc.Graph(
+                    id='production-pie3'
+                    )])
             ])
-        ),
         
-        dbc.Row([
-            dbc.Col([
-                dcc.Graph(
-                id='production-bar',
-                figure=fig_prod_bar
-                )
-                ])
         ]),
+    
+        # consumption
+        dbc.Container([
+            dbc.Row([
+                dbc.Col([
+                    html.H4(children='World Electricity Consumption by Sectors'),
+                    html.P(children='Electricity consumption by households, industry, transport, agriculture, \
+                             and commercial / public services')
+                ])
+            ]),
         
-        dbc.Row([
-            dbc.Col([
-                dcc.Graph(
-                id='production-pie1',
-                figure=fig_prod_pie1
-                )]),
-            dbc.Col([
-                dcc.Graph(
-                id='production-pie2',
-                figure=fig_prod_pie2
-                )]),
-            dbc.Col([
-                dcc.Graph(
-                id='production-pie3',
-                figure=fig_prod_pie3
-                )])
-        ])
+            dbc.Row([
+                dbc.Col([
+                    dcc.RangeSlider(
+                        id='consumption-year-range',
+                        min=int(energyData.years.min()),
+                        max=int(energyData.years.max()),
+                        step=None,
+                        # numpy years are not valid keys of the marks, hence the conversion
+                        marks={int(year): str(year) for year in energyData.years}, 
+                        value=[2008, 2018],
+                    
+                    ),
+                    dcc.Interval(id='consumption-poll', interval=POLL_INTERVAL, disabled=True)
+                ])
+            ]),
         
-    ]),
+            dbc.Row([
+                dbc.Col([
+                    dcc.Graph(
+                    id='consumption-line'
+                    )
+                    ]),
+                dbc.Col([
+                    dcc.Graph(
+                    id='consumption-bar'
+                    )
+                    ])
+            ]),
+                
+        ]),
+    
     
-    # consumption
-    dbc.Container([
-        dbc.Row([
-            dbc.Col([
-                html.H4(children='World Electricity Consumption by Sectors'),
-                html.P(children='Electricity consumption by households, industry, transport, agriculture, \
-                         and commercial / public services')
+        # world explorer
+        dbc.Container([
+            dbc.Row([
+                dbc.Col([
+                    html.H4(children='World Data Explorer'),
+                    html.P(children='Plot the energy per-country for a given year and transaction.')
+                ])
+            ]),
+        
+            dbc.Row([
+                dbc.Col([
+                    html.Div(children='Year'),
+                    dcc.Dropdown(
+                        id='world-data-year',
+                        options=[{'label': i, 'value': i} for i in reversed(energyData.years.tolist())],
+                        value = 2018
+                    ),
+                ]),
+                dbc.Col([
+                    html.Div(children='Transaction'),
+                    dcc.Dropdown(
+                        id='world-data-transaction',
+                        # the transactions, then the metrics derived from them
+                        options=[{'label': i, 'value': i} for i in energyData.transaction_map] + 
+                                [{'label': i, 'value': i} for i in derived.METRICS],
+                        value = 'Final energy consumption'
+                    ),                
+                ])
+                ]),
+        
+            dbc.Row([
+                dbc.Col([
+                    dcc.Graph(
+                    id='world-data',
+                    # the layout is also built once at start to validate it, without a request
+                    figure=base_map() if flask.has_request_context() else None
+                    ),
+                    dcc.Store(id='world-values')
+                    ])
+            ]),
+        
+            # country drilldown
+            dbc.Row([
+                dbc.Col([
+                    html.P(children='Click on a country in the map to see its history of electricity generation and consumption.'),
+                    dcc.Interval(id='country-poll', interval=POLL_INTERVAL, disabled=True)
+                ])
+            ]),
+        
+            dbc.Row([
+                dbc.Col([
+                    dcc.Graph(
+                    id='country-generation'
+                    )
+                    ]),
+                dbc.Col([
+                    dcc.Graph(
+                    id='country-consumption'
+                    )
+                    ])
+            ]),
+        
+            dbc.Row([
+                html.H5('Examples of questions we can answer with the World Explorer'),
+                html.P('Which country was the highest producer of electricity via combustible fuels in 2018 vs 2008? '),
+                html.P('Which countries were the top 3 consumers of electricity in 2018? How about 2005?'),
+                html.P('Which countries import instead of produce most of their electricity? ')]),
+            dbc.Row([
+                html.H5('Questions we can answer from the dataset'),
+                html.P('Are any countries likely to decrease their electricity production via combustible fuels \
+                    by at least 10% by 2028? '),
+                html.P('Which country has seen the biggest rise in exported electricity in the decade of 2008-2018?')
+            
+            
             ])
+        
         ]),
         
-        dbc.Row([
-            dbc.Col([
-                dcc.RangeSlider(
-                    id='consumption-year-range',
-                    min=energyData.data['Year'].min(),
-                    max=energyData.data['Year'].max(),
-                    step=None,
-                    #TODO: debug why passing year_map fails
-                    marks = { 
-                             2018: '2018', 
-                             2017: '2017', 
-                             2016: '2016', 
-                             2015: '2015', 
-                             2014: '2014', 
-                             2013: '2013', 
-                             2012: '2012', 
-                             2011: '2011', 
-                             2010: '2010', 
-                             2009: '2009', 
-                             2008: '2008', 
-                             2007: '2007', 
-                             2006: '2006', 
-                             2005: '2005', 
-                             2004: '2004'}, 
-                    value=[2008, 2018],
-                    
-                ),
+        # regional explorer
+        dbc.Container([
+            dbc.Row([
+                dbc.Col([
+                    html.H4(children='Regional Explorer'),
+                    html.P(children='Plot the energy per region (continent, UN region or OECD membership) \
+                             for a given year and transaction.')
+                ])
+            ]),
+            
+            dbc.Row([
+                dbc.Col([
+                    html.Div(children='Regions'),
+                    dcc.Dropdown(
+                        id='region-grouping',
+                        options=[{'label': i, 'value': i} for i in dataset.REGION_GROUPINGS],
+                        value='Continent'
+                    ),
+                ]),
+                dbc.Col([
+                    html.Div(children='Year'),
+                    dcc.Dropdown(
+                        id='region-year',
+                        options=[{'label': i, 'value': i} for i in reversed(energyData.years.tolist())],
+                        value=2018
+                    ),
+                ]),
+                dbc.Col([
+                    html.Div(children='Transaction'),
+                    dcc.Dropdown(
+                        id='region-transaction',
+                        options=[{'label': i, 'value': i} for i in energyData.transaction_map],
+                        value='Final energy consumption'
+                    ),
+                ])
+            ]),
+            
+            dbc.Row([
+                dbc.Col([
+                    dcc.Graph(
+                    id='region-map',
+                    figure=base_region_figures()[0] if flask.has_request_context() else None
+                    ),
+                    dcc.Store(id='region-values')
+                ]),
+                dbc.Col([
+                    dcc.Graph(
+                    id='region-bar',
+                    figure=base_region_figures()[1] if flask.has_request_context() else None
+                    )
+                ])
             ])
+        
         ]),
         
-        dbc.Row([
-            dbc.Col([
-                dcc.Graph(
-                id='consumption-line',
-                figure=fig_cons_line
-                )
+        # trends and forecasts
+        dbc.Container([
+            dbc.Row([
+                dbc.Col([
+                    html.H4(children='Projected Change by Country'),
+                    html.P(children='Countries with the largest projected decrease and increase of a transaction \
+                             between their last year of data and a target year, following the trend of all years.')
+                ])
+            ]),
+            
+            dbc.Row([
+                dbc.Col([
+                    html.Div(children='Transaction'),
+                    dcc.Dropdown(
+                        id='forecast-transaction',
+                        options=[{'label': i, 'value': i} for i in energyData.transaction_map],
+                        value='Combustible fuels'
+                    ),
+                ]),
+                dbc.Col([
+                    html.Div(children='Target year'),
+                    dcc.Dropdown(
+                        id='forecast-year',
+                        options=[{'label': i, 'value': i} for i in FORECAST_YEARS],
+                        value=2028
+                    ),
                 ]),
-            dbc.Col([
-                dcc.Graph(
-                id='consumption-bar',
-                figure=fig_cons_bar
-                )
+                dbc.Col([
+                    html.Div(children='Trend'),
+                    dcc.RadioItems(
+                        id='forecast-method',
+                        options=[{'label': i, 'value': i} for i in forecast.METHODS],
+                        value='linear',
+                        labelStyle={'display': 'inline-block', 'margin': '5px'}
+                    ),
                 ])
-        ]),
-                
-    ]),
-    
-    
-    # world explorer
-    dbc.Container([
-        dbc.Row([
-            dbc.Col([
-                html.H4(children='World Data Explorer'),
-                html.P(children='Plot the energy per-country for a given year and transaction.')
+            ]),
+            
+            dbc.Row([
+                dbc.Col([
+                    dcc.Graph(
+                    id='forecast-ranking'
+                    ),
+                    dcc.Interval(id='forecast-poll', interval=POLL_INTERVAL, disabled=True)
+                    ])
             ])
+        
         ]),
         
-        dbc.Row([
-            dbc.Col([
-                html.Div(children='Year'),
-                dcc.Dropdown(
-                    id='world-data-year',
-                    options=[{'label': i, 'value': i} for i in energyData.data['Year'].unique()],
-                    value = 2018
-                ),
+        # rankings
+        dbc.Container([
+            dbc.Row([
+                dbc.Col([
+                    html.H4(children='Country Rankings'),
+                    html.P(children='Countries with the largest values of a transaction in a year, \
+                             and with the largest rises and falls between two years.')
+                ])
             ]),
-            dbc.Col([
-                html.Div(children='Transaction'),
-                dcc.Dropdown(
-                    id='world-data-transaction',
-                    options=[{'label': i, 'value': i} for i in energyData.data['Transaction'].unique()],
-                    value = 'Final energy consumption'
-                ),                
-            ])
+            
+            dbc.Row([
+                dbc.Col([
+                    html.Div(children='Transaction'),
+                    dcc.Dropdown(
+                        id='ranking-transaction',
+                        options=[{'label': i, 'value': i} for i in energyData.transaction_map],
+                        value='Exports'
+                    ),
+                ]),
+                dbc.Col([
+                    html.Div(children='Year'),
+                    dcc.Dropdown(
+                        id='ranking-year',
+                        options=[{'label': i, 'value': i} for i in reversed(energyData.years.tolist())],
+                        value=2018
+                    ),
+                ]),
+                dbc.Col([
+                    html.Div(children='Change between'),
+                    dcc.RangeSlider(
+                        id='ranking-year-range',
+                        min=int(energyData.years.min()),
+                        max=int(energyData.years.max()),
+                        value=[2008, 2018],
+                        marks={int(year): str(year) for year in energyData.years}, 
+                        step=None
+                    ),
+                ])
             ]),
-        
-        dbc.Row([
-            dbc.Col([
-                dcc.Graph(
-                id='world-data',
-                figure=fig_world
-                )
+            
+            dbc.Row([
+                dbc.Col([
+                    html.H5(children='Top countries'),
+                    dash_table.DataTable(id='ranking-top', page_action='none')
+                ]),
+                dbc.Col([
+                    html.H5(children='Largest rises'),
+                    dash_table.DataTable(id='ranking-rises', page_action='none')
+                ]),
+                dbc.Col([
+                    html.H5(children='Largest falls'),
+                    dash_table.DataTable(id='ranking-falls', page_action='none')
                 ])
+            ])
+        
         ]),
         
-        dbc.Row([
-            html.H5('Examples of questions we can answer with the World Explorer'),
-            html.P('Which country was the highest producer of electricity via combustible fuels in 2018 vs 2008? '),
-            html.P('Which countries were the top 3 consumers of electricity in 2018? How about 2005?'),
-            html.P('Which countries import instead of produce most of their electricity? ')]),
-        dbc.Row([
-            html.H5('Questions we can answer from the dataset'),
-            html.P('Are any countries likely to decrease their electricity production via combustible fuels \
-                by at least 10% by 2028? '),
-            html.P('Which country has seen the biggest rise in exported electricity in the decade of 2008-2018?')
+        # commodity explorer
+        dbc.Container([
+            dbc.Row([
+                dbc.Col([
+                    html.H4(children='Commodity Explorer'),
+                    html.P(children='World total of a transaction of any commodity of the data set over the years, \
+                             and the countries with the largest values in a year.')
+                ])
+            ]),
             
+            dbc.Row([
+                dbc.Col([
+                    html.Div(children='Commodity'),
+                    dcc.Dropdown(
+                        id='commodity-name',
+                        options=[{'label': i, 'value': i} for i in commodityData.commodities],
+                        value=commodityData.commodities[0]
+                    ),
+                ]),
+                dbc.Col([
+                    html.Div(children='Transaction'),
+                    dcc.Dropdown(
+                        id='commodity-transaction'
+                    ),
+                ]),
+                dbc.Col([
+                    html.Div(children='Year'),
+                    dcc.Dropdown(
+                        id='commodity-year',
+                        options=[{'label': i, 'value': i} for i in reversed(commodityData.years.tolist())],
+                        value=int(commodityData.years.max())
+                    ),
+                    dcc.Interval(id='commodity-poll', interval=POLL_INTERVAL, disabled=True)
+                ])
+            ]),
             
-        ])
+            dbc.Row([
+                dbc.Col([
+                    dcc.Graph(
+                    id='commodity-trend'
+                    )
+                    ]),
+                dbc.Col([
+                    dcc.Graph(
+                    id='commodity-countries'
+                    )
+                    ])
+            ])
         
-    ])
+        ])
     
-])
+    ])
+
+
+app.layout = serve_layout
 
 # APP CALLBACKS
+# the figures are rendered by memoized functions run through the executor. Until they are 
+# ready, the callbacks return placeholders and enable an interval that calls them again.
+def poll(func, args, outputs):
+    '''
+    Returns the figures of a rendering function followed by the disabled flag of the interval 
+    polling for them: placeholders and False while they are being rendered. If the render 
+    fails, an error placeholder is returned and the polling stops, instead of every poll 
+    starting the failing render again.
+    '''
+    try:
+        figures = executor.run(func, args)
+    except Exception:
+        server.logger.exception('Rendering %s%r failed', func.__name__, tuple(args))
+        return (jobs.placeholder('The figures could not be rendered'),) * outputs + (True,)
+    if figures is None:
+        return (jobs.placeholder(),) * outputs + (False,)
+    return (figures if outputs > 1 else (figures,)) + (True,)
+
 
 @app.callback(
     Output('production-bar', 'figure'),
     Output('production-pie1', 'figure'),
     Output('production-pie2', 'figure'),
     Output('production-pie3', 'figure'),
-    [Input('production-year', 'value')]
+    Output('production-poll', 'disabled'),
+    [Input('production-year', 'value'),
+     Input('production-poll', 'n_intervals')]
 )
-def update_production_data(year):
+@metrics.instrument
+def update_production_data(year, n_intervals):
+    return poll(production_figures, (year,), 4)
+
+
+@figure_cache.memoize
+@metrics.timed('figure')
+def production_figures(year):
+    import plotly.express as px
     df_gen = callbacks.build_production_dataset(energyData=energyData, 
                                             year=year, 
-                                            transactions=['EP', 'SP', 
-                                                          '015C', '016C',
-                                                          '015HY', '016HY',
-                                                          '015N', '016N',
-                                                          '015W', '016W',
-                                                          '015S', '016S',
-                                                          '015H', '016H',
-                                                          ], 
+                                            transactions=callbacks.PRODUCTION_TRANSACTIONS, 
                                             codes=True)
     
     fig_prod_bar = px.bar(df_gen[(df_gen['Purpose']!='Other') & (df_gen['Fuel']!='Total')], 
@@ -282,29 +570,336 @@ def update_production_data(year):
 @app.callback(
     Output('consumption-line', 'figure'),
     Output('consumption-bar', 'figure'),
-    [Input('consumption-year-range', 'value')]
+    Output('consumption-poll', 'disabled'),
+    [Input('consumption-year-range', 'value'),
+     Input('consumption-poll', 'n_intervals')]
 )
-def update_consumption_data(year_range):
+@metrics.instrument
+def update_consumption_data(year_range, n_intervals):
+    return poll(consumption_figures, (year_range,), 2)
+
+
+@figure_cache.memoize
+@metrics.timed('figure')
+def consumption_figures(year_range):
+    import plotly.express as px
     df_cons = callbacks.build_consumption_dataset(energyData=energyData,
-                                              years = list(range(year_range[0],year_range[1]+1)))
+                                              years = list(range(year_range[0],year_range[1]+1)),
+                                              budget=settings.POINT_BUDGET)
+    # long ranges are drawn per period of years (see callbacks.choose_resolution)
+    hover_data = ['Period'] if 'Period' in df_cons else None
+    df_bar = df_cons
+    if 'Period' in df_cons:
+        # the bars add up the consumption of the years: mean yearly consumption times years of each period
+        df_bar = df_cons.assign(**{dataset.QUANTITY: df_cons[dataset.QUANTITY] * df_cons['Years']})
 
     # CONSUMPTION - figures
-    fig_cons_line = px.line(df_cons, x='Year', y='Quantity (1e6 kW/h)', color='Consumer')
-    fig_cons_bar = px.bar(df_cons, x='Consumer', y = 'Quantity (1e6 kW/h)', color='Year', color_continuous_scale='oryel')
+    fig_cons_line = px.line(df_cons, x='Year', y='Quantity (1e6 kW/h)', color='Consumer', hover_data=hover_data)
+    fig_cons_bar = px.bar(df_bar, x='Consumer', y = 'Quantity (1e6 kW/h)', color='Year', color_continuous_scale='oryel',
+                          hover_data=hover_data)
     return fig_cons_line, fig_cons_bar
     
     
 @app.callback(
-    Output('world-data', 'figure'),
+    Output('world-values', 'data'),
     [Input('world-data-year', 'value'),
      Input('world-data-transaction', 'value'),
      ]
 )
+@metrics.instrument
 def update_world_data(year, transaction):
-    df_world = callbacks.build_world_data(energyData, year, energyData.transaction_map[transaction])
-    return px.choropleth(data_frame=df_world, locations='ISO-3', locationmode='ISO-3', 
-                         color='Quantity (1e6 kW/h)', color_continuous_scale='jet')
+    # only the values of the countries are sent, the map itself is sent once with the page
+    if transaction in derived.METRICS:
+        values = callbacks.build_world_values(energyData, year, derived.METRICS[transaction], derived=True)
+        return dict(values, title=transaction)
+    values = callbacks.build_world_values(energyData, year, energyData.transaction_map[transaction])
+    return dict(values, title=dataset.QUANTITY)
+
+
+# recolors the world map in the browser with the values sent by update_world_data
+app.clientside_callback(
+    '''
+    function(values, figure) {
+        if (!values || !figure) {
+            return window.dash_clientside.no_update;
+        }
+        var trace = Object.assign({}, figure.data[0], {locations: values.locations, z: values.z});
+        var layout = figure.layout;
+        if (values.title && layout.coloraxis) {
+            var colorbar = Object.assign({}, layout.coloraxis.colorbar, {title: {text: values.title}});
+            layout = Object.assign({}, layout, {coloraxis: Object.assign({}, layout.coloraxis, {colorbar: colorbar})});
+        }
+        return Object.assign({}, figure, {data: [trace], layout: layout});
+    }
+    ''',
+    Output('world-data', 'figure'),
+    [Input('world-values', 'data')],
+    [State('world-data', 'figure')]
+)
+    
+
+@app.callback(
+    Output('region-values', 'data'),
+    [Input('region-year', 'value'),
+     Input('region-transaction', 'value'),
+     Input('region-grouping', 'value')]
+)
+@metrics.instrument
+def update_region_data(year, transaction, grouping):
+    # as for the world map, only the values are sent
+    return callbacks.build_region_values(energyData, year, energyData.transaction_map[transaction], grouping)
+
+
+# recolors the regional map and redraws the bars in the browser with the values sent by update_region_data
+app.clientside_callback(
+    '''
+    function(values, map, bar) {
+        if (!values || !map || !bar) {
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+        }
+        var area = Object.assign({}, map.data[0], {locations: values.locations, z: values.z, 
+                                                   hovertext: values.text});
+        var bars = Object.assign({}, bar.data[0], {x: values.regions, y: values.totals});
+        return [Object.assign({}, map, {data: [area]}), Object.assign({}, bar, {data: [bars]})];
+    }
+    ''',
+    Output('region-map', 'figure'),
+    Output('region-bar', 'figure'),
+    [Input('region-values', 'data')],
+    [State('region-map', 'figure'),
+     State('region-bar', 'figure')]
+)
+
+
+@app.callback(
+    Output('country-generation', 'figure'),
+    Output('country-consumption', 'figure'),
+    Output('country-poll', 'disabled'),
+    [Input('world-data', 'clickData'),
+     Input('country-poll', 'n_intervals')]
+)
+@metrics.instrument
+def update_country_data(click_data, n_intervals):
+    # the map identifies countries by their ISO-3 codes
+    country = click_data['points'][0]['location'] if click_data else None
+    return poll(country_figures, (country,), 2)
+
+
+@figure_cache.memoize
+@metrics.timed('figure')
+def country_figures(country):
+    import plotly.express as px
+    if country is None:
+        return px.line(title='Generation'), px.line(title='Consumption')
     
+    df_gen, df_cons = callbacks.build_country_data(energyData, country, budget=settings.POINT_BUDGET)
+    hover_data = ['Period'] if 'Period' in df_gen else None
+    fig_country_gen = px.line(df_gen, x='Year', y='Quantity (1e6 kW/h)', color='Fuel', 
+                              title='Generation - {}'.format(country), hover_data=hover_data)
+    fig_country_cons = px.line(df_cons, x='Year', y='Quantity (1e6 kW/h)', color='Consumer', 
+                               title='Consumption - {}'.format(country), hover_data=hover_data)
+    return fig_country_gen, fig_country_cons
+    
+
+@app.callback(
+    Output('forecast-ranking', 'figure'),
+    Output('forecast-poll', 'disabled'),
+    [Input('forecast-transaction', 'value'),
+     Input('forecast-year', 'value'),
+     Input('forecast-method', 'value'),
+     Input('forecast-poll', 'n_intervals')]
+)
+@metrics.instrument
+def update_forecast_data(transaction, year, method, n_intervals):
+    return poll(forecast_figure, (transaction, year, method), 1)
+
+
+@figure_cache.memoize
+@metrics.timed('figure')
+def forecast_figure(transaction, year, method):
+    import plotly.express as px
+    df_forecast = callbacks.build_forecast_ranking(energyData, energyData.transaction_map[transaction], 
+                                                   year, method)
+    fig = px.bar(df_forecast, x='Change (%)', y='Country or Area', orientation='h', 
+                 color='Change (%)', color_continuous_scale='RdYlGn', color_continuous_midpoint=0,
+                 hover_data=['Last year', 'Last value', 'Projected'], 
+                 title='{} by {}'.format(transaction, year))
+    return fig.update_layout(height=max(400, 25 * len(df_forecast)))
+
+
+@app.callback(
+    [Output('ranking-top', 'data'),
+     Output('ranking-top', 'columns'),
+     Output('ranking-rises', 'data'),
+     Output('ranking-rises', 'columns'),
+     Output('ranking-falls', 'data'),
+     Output('ranking-falls', 'columns')],
+    [Input('ranking-transaction', 'value'),
+     Input('ranking-year', 'value'),
+     Input('ranking-year-range', 'value')]
+)
+@metrics.instrument
+def update_rankings(transaction, year, year_range):
+    # the rankings are slices of the indexes of the dataset, they are not worth caching
+    tables = callbacks.build_rankings(energyData, energyData.transaction_map[transaction], 
+                                      year, year_range[0], year_range[1])
+    outputs = []
+    for df in tables:
+        outputs += [df.to_dict('records'), [{'name': column, 'id': column} for column in df.columns]]
+    return outputs
+
+
+@app.callback(
+    Output('commodity-transaction', 'options'),
+    Output('commodity-transaction', 'value'),
+    [Input('commodity-name', 'value')]
+)
+@metrics.instrument
+def update_commodity_transactions(commodity):
+    names = commodityData.transaction_names[commodity]
+    options = [{'label': names[code], 'value': code} for code in commodityData.transaction_codes[commodity]]
+    return options, options[0]['value']
+
+
+@app.callback(
+    Output('commodity-trend', 'figure'),
+    Output('commodity-countries', 'figure'),
+    Output('commodity-poll', 'disabled'),
+    [Input('commodity-name', 'value'),
+     Input('commodity-transaction', 'value'),
+     Input('commodity-year', 'value'),
+     Input('commodity-poll', 'n_intervals')]
+)
+@metrics.instrument
+def update_commodity_data(commodity, transaction, year, n_intervals):
+    return poll(commodity_figures, (commodity, transaction, year), 2)
+
+
+@figure_cache.memoize
+@metrics.timed('figure')
+def commodity_figures(commodity, transaction, year):
+    import plotly.express as px
+    df_trend, df_countries = callbacks.build_commodity_data(commodityData, commodity, transaction, year)
+    name = commodityData.transaction_names[commodity].get(transaction, transaction)
+    unit = commodityData.units[commodity] or 'Quantity'
+    fig_trend = px.line(df_trend, x='Year', y='Quantity', labels={'Quantity': unit}, 
+                        title='{} - {}'.format(commodity, name))
+    fig_countries = px.bar(df_countries, x='Country or Area', y='Quantity', labels={'Quantity': unit}, 
+                           title='Largest in {}'.format(year))
+    return fig_trend, fig_countries
+
+
+# METRICS
+# timings of the callback stages, figure cache and memory in the Prometheus text format
+def collect_metrics():
+    stats = figure_cache.stats()
+    job_stats = executor.stats()
+    return (metrics.format_metric('dashboard_figure_cache_lookups_total', 'counter', 
+                                  'Lookups of the figure cache, by result.', 
+                                  [('', {'result': result}, stats[key]) 
+                                   for result, key in [('hit', 'hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses')]]) + 
+            metrics.format_metric('dashboard_figure_cache_bytes', 'gauge', 
+                                  'Size of the figures held in the memory of the figure cache.', 
+                                  [('', {}, stats['bytes'])]) + 
+            metrics.format_metric('dashboard_figure_cache_entries', 'gauge', 
+                                  'Number of entries held in the memory of the figure cache.', 
+                                  [('', {}, stats['entries'])]) + 
+            metrics.format_metric('dashboard_jobs_total', 'counter', 
+                                  'Figure renders requested from the executor, by outcome.', 
+                                  [('', {'outcome': 'submitted'}, job_stats['submitted']), 
+                                   ('', {'outcome': 'deduplicated'}, job_stats['deduplicated'])]) + 
+            metrics.format_metric('dashboard_jobs_running', 'gauge', 
+                                  'Figure renders running or queued in the executor.', 
+                                  [('', {}, job_stats['running'])]) + 
+            metrics.format_metric('dashboard_data_bytes', 'gauge', 
+                                  'Memory held by the data set, by attribute.', 
+                                  [('', {'attribute': name}, size) 
+                                   for name, size in energyData.memory_usage().items()]))
+
+
+metrics.serve(server, collect_metrics)
+if settings.PROFILE_DIR:
+    metrics.profile_requests(server, settings.PROFILE_DIR)
+
+
+# DATA REFRESH
+# set DATA_DIR to pick up new exports without restarting: the callbacks switch to the new 
+# data set at once and only the cached figures depending on changed values are dropped
+def invalidate_figures(delta):
+    years = {int(year) for year in delta['Year']}
+    codes = pd.Index(delta['Transaction Code'].unique(), dtype=object)
+    all_years = [int(year) for year in energyData.years]
+    
+    if codes.str.contains(dataset.GENERATION_PATTERN).any():
+        figure_cache.invalidate(production_figures, [(year,) for year in years])
+    if codes.str.contains(dataset.CONSUMPTION_PATTERN).any():
+        figure_cache.invalidate(consumption_figures, 
+                                [([start, end],) for start in all_years for end in all_years 
+                                 if start <= end and any(start <= year <= end for year in years)])
+    figure_cache.invalidate(country_figures, [(iso3,) for iso3 in delta['ISO-3'].dropna().unique()])
+    # trends are fitted on all years
+    figure_cache.invalidate(forecast_figure, 
+                            [(transaction, year, method) for transaction, code in energyData.transaction_map.items() 
+                             if code in codes for year in FORECAST_YEARS for method in forecast.METHODS])
+
+
+def reload_data(path):
+    global energyData
+    if not settings.COMMODITY_FILES:
+        reload_commodities([path])
+    refreshed, delta = energyData.refresh(path, directory=settings.SHARED_DATA_DIR, **settings.DATA_OPTIONS)
+    if refreshed is energyData:
+        return
+    # swap first: figures computed from here on use the new data and are not dropped again
+    energyData = refreshed
+    invalidate_figures(delta)
+    server.logger.info('Data refreshed from %s: %d values changed', path, len(delta))
+
+
+def reload_commodities(paths):
+    global commodityData
+    refreshed, delta = commodityData.refresh(paths, directory=settings.SHARED_DATA_DIR)
+    if refreshed is commodityData:
+        return
+    commodityData = refreshed
+    # the trends of the commodity explorer cover all years
+    changed = set(zip(delta['Commodity'], delta['Transaction Code']))
+    figure_cache.invalidate(commodity_figures, [(commodity, code, year) for commodity, code in sorted(changed) 
+                                                for year in commodityData.years.tolist()])
+    server.logger.info('Commodities refreshed from %s: %d values changed', ', '.join(paths), len(delta))
+
+
+# WARM-UP
+# set WARM_UP=1 to pre-render the production figures for every year in the background.
+# The warm-up processes are forked before the watcher and the job threads start
+if settings.WARM_UP:
+    years = [int(year) for year in energyData.years]
+    warmup.warm_up(figure_cache, [(production_figures, (year,)) for year in years])
+
+
+if settings.DATA_DIR:
+    watcher.watch(settings.DATA_DIR, reload_data, interval=settings.RELOAD_INTERVAL)
+if settings.COMMODITY_FILES:
+    watcher.watch_files(settings.COMMODITY_FILES, reload_commodities, interval=settings.RELOAD_INTERVAL)
+
+
+
+# DEFERRED START
+# the figures of the first page are rendered in the background (after the warm-up pool 
+# is forked), so that the worker serves requests right away and the first page is cached
+def render_initial_figures():
+    with metrics.startup_phase('initial figures'):
+        base_map()
+        base_region_figures()
+        production_figures(2018)
+        consumption_figures([2008, 2018])
+        country_figures(None)
+    server.logger.info(metrics.startup_report())
+
+
+server.logger.info(metrics.startup_report())
+threading.Thread(target=render_initial_figures, name='initial-figures', daemon=True).start()
+
 
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
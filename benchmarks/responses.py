@@ -0,0 +1,93 @@
+'''
+Measures the size in bytes of the responses of the dashboard callbacks on the bundled data set.
+
+Run from the root of the repository with
+
+    python -m benchmarks.responses
+
+For each callback, the figures are serialized as plotly does by default ("plain") and in
+compact form ("compact", see codes.compact), and the responses of the server are requested
+without compression and with gzip and Brotli.
+'''
+import argparse
+import gzip
+import inspect
+import json
+import logging
+import warnings
+
+import brotli
+import plotly.io as pio
+
+# the callbacks to measure, as (output, inputs) of their requests
+REQUESTS = [
+    ([('production-bar', 'figure'), ('production-pie1', 'figure'),
+      ('production-pie2', 'figure'), ('production-pie3', 'figure'), ('production-poll', 'disabled')],
+     [('production-year', 'value', 2018), ('production-poll', 'n_intervals', None)]),
+    ([('consumption-line', 'figure'), ('consumption-bar', 'figure'), ('consumption-poll', 'disabled')],
+     [('consumption-year-range', 'value', [2008, 2018]), ('consumption-poll', 'n_intervals', None)]),
+    ([('world-values', 'data')],
+     [('world-data-year', 'value', 2018), ('world-data-transaction', 'value', 'Final energy consumption')]),
+    ([('country-generation', 'figure'), ('country-consumption', 'figure'), ('country-poll', 'disabled')],
+     [('world-data', 'clickData', {'points': [{'location': 'FRA'}]}), ('country-poll', 'n_intervals', None)]),
+]
+
+
+def request_body(outputs, inputs):
+    '''
+    Returns the body of the request Dash sends to update outputs after a change of inputs.
+    '''
+    specs = [{'id': i, 'property': p} for i, p in outputs]
+    if len(outputs) == 1:
+        output, specs = '%s.%s' % outputs[0], specs[0]
+    else:
+        output = '..%s..' % '...'.join('%s.%s' % output for output in outputs)
+    return {'output': output,
+            'outputs': specs,
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+            'changedPropIds': ['%s.%s' % inputs[0][:2]]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--output', help='path of the JSON results (printed only if not given)')
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    warnings.filterwarnings('ignore')
+    import app
+
+    client = app.server.test_client()
+    functions = {app.production_figures: (2018,),
+                 app.consumption_figures: ([2008, 2018],),
+                 app.update_world_data: (2018, 'Final energy consumption'),
+                 app.country_figures: ('FRA',)}
+    results = []
+    for (outputs, inputs), (func, func_args) in zip(REQUESTS, functions.items()):
+        value = inspect.unwrap(func)(*func_args)
+        figures = value if isinstance(value, tuple) else (value,)
+        plain = '[%s]' % ', '.join(pio.to_json(fig, validate=False) for fig in figures)
+        result = {'callback': func.__name__,
+                  'plain': len(plain),
+                  'plain_gzip': len(gzip.compress(plain.encode())),
+                  'plain_br': len(brotli.compress(plain.encode()))}
+
+        # the figures are rendered before the request, which then does not return placeholders
+        func(*func_args)
+        body = request_body(outputs, inputs)
+        for encoding in ['identity', 'gzip', 'br']:
+            response = client.post('/_dash-update-component', json=body,
+                                   headers={'Accept-Encoding': encoding})
+            result['response_%s' % encoding] = len(response.data)
+        results.append(result)
+        print('%-24s plain %8d B (gzip %7d, br %7d)   response %8d B (gzip %7d, br %7d)' % (
+            result['callback'], result['plain'], result['plain_gzip'], result['plain_br'],
+            result['response_identity'], result['response_gzip'], result['response_br']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+'''
+Benchmarks of the data layer and the callbacks of the dashboard on synthetic data sets.
+
+Run from the root of the repository with
+
+    python -m benchmarks.run --scales 1 10 100
+
+Results are written as JSON (one record per scale and benchmark, with timings in seconds
+and peak memory in MB), so that runs on different commits can be compared.
+'''
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+
+from codes import callbacks, commodities, dataset, forecast
+from . import synthetic
+
+YEAR = 2018
+
+
+def measure(func, repeat):
+    '''
+    Times a function and records the peak memory it allocates.
+
+    Parameters
+    ----------
+    func: callable
+        The function to benchmark, called without arguments.
+    repeat: int
+        Number of timed calls.
+
+    Returns
+    -------
+    dict
+        The minimum and median time of the calls (in s) and the peak memory
+        allocated during an additional, untimed call (in MB).
+    '''
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'min_s': min(times),
+            'median_s': statistics.median(times),
+            'repeat': repeat,
+            'peak_mb': peak / 2**20}
+
+
+def run_scale(scale, directory, repeat):
+    '''
+    Runs all benchmarks on a synthetic data set of the given scale.
+
+    Returns
+    -------
+    list
+        One record per benchmark.
+    '''
+    filename = os.path.join(directory, 'synthetic_%d.csv' % scale)
+    rows = synthetic.write_synthetic_csv(filename, scale)
+    energyData = dataset.EnergyData(filename)
+    commodityData = commodities.CommodityData(filename)
+
+    df_gen = callbacks.build_production_dataset(energyData, YEAR, callbacks.PRODUCTION_TRANSACTIONS, True)
+    df_gen = df_gen[(df_gen['Purpose'] != 'Other') & (df_gen['Fuel'] != 'Total')]
+    df_cons = callbacks.build_consumption_dataset(energyData, list(range(2008, YEAR + 1)))
+    df_world = callbacks.build_world_data(energyData, YEAR, '12')
+    fig_prod = px.bar(df_gen, x='Fuel', y=dataset.QUANTITY, color='Purpose')
+    fig_cons = px.line(df_cons, x='Year', y=dataset.QUANTITY, color='Consumer')
+    fig_world = px.choropleth(data_frame=df_world, locations='ISO-3', locationmode='ISO-3',
+                              color=dataset.QUANTITY, color_continuous_scale='jet')
+
+    benchmarks = {
+        # loading (the csv once per repeat is slow, so loads are repeated less)
+        'load_csv': (lambda: dataset.EnergyData(filename, snapshot=False), max(1, repeat // 10)),
+        'load_csv_streaming': (lambda: dataset.EnergyData(filename, snapshot=False, chunksize=10**5),
+                               max(1, repeat // 10)),
+        'load_snapshot': (lambda: dataset.EnergyData(filename), max(1, repeat // 10)),
+        # data layer
+        'extract_generation_data': (lambda: energyData.extract_generation_data(
+            years=YEAR, transactions=callbacks.PRODUCTION_TRANSACTIONS, codes=True), repeat),
+        'extract_consumption_data': (lambda: energyData.extract_consumption_data(
+            years=list(range(2008, YEAR + 1)), transactions=['121', '1231', '1235', '1232', '122'],
+            codes=True), repeat),
+        'fit_trends': (lambda: forecast.fit_trends(energyData.years, 
+                                                   energyData.cube.reshape(len(energyData.years), -1)), repeat),
+        'query': (lambda: commodityData.query('Electricity', transactions='12', years=YEAR, 
+                                              by='Country or Area'), repeat),
+        'query_all_years': (lambda: commodityData.query(by=['Commodity', 'Year']), repeat),
+        # evaluated on every repeat, not from the per-expression cache
+        'derived_metric': (lambda: (energyData._derived.clear(), energyData.derived("100 * '03' / '01'")), 
+                           repeat),
+        'top_n': (lambda: energyData.top_n(YEAR, '12', 10), repeat),
+        'top_movers': (lambda: energyData.top_movers('12', 2008, YEAR, 10), repeat),
+        'extract_region_values': (lambda: energyData.extract_region_values(YEAR, '12', 'UN region'), repeat),
+        'extract_consumption_periods': (lambda: energyData.extract_consumption_hierarchy(
+            level=[1, 2], resolution=5), repeat),
+        # callbacks
+        'build_production_dataset': (lambda: callbacks.build_production_dataset(
+            energyData, YEAR, callbacks.PRODUCTION_TRANSACTIONS, True), repeat),
+        'build_consumption_dataset': (lambda: callbacks.build_consumption_dataset(
+            energyData, list(range(2008, YEAR + 1))), repeat),
+        'build_consumption_dataset_budget': (lambda: callbacks.build_consumption_dataset(
+            energyData, list(energyData.years), level=[1, 2], budget=200), repeat),
+        'build_world_data': (lambda: callbacks.build_world_data(energyData, YEAR, '12'), repeat),
+        'build_world_values': (lambda: callbacks.build_world_values(energyData, YEAR, '12'), repeat),
+        'build_region_values': (lambda: callbacks.build_region_values(energyData, YEAR, '12', 'UN region'), 
+                                repeat),
+        'build_world_metric_values': (lambda: callbacks.build_world_values(energyData, YEAR, "'03' - '04'", 
+                                                                           derived=True), repeat),
+        'build_forecast_ranking': (lambda: callbacks.build_forecast_ranking(energyData, '015C', 2028), repeat),
+        'build_rankings': (lambda: callbacks.build_rankings(energyData, '12', YEAR, 2008, YEAR), repeat),
+        # figures
+        'figure_production_bar': (lambda: px.bar(df_gen, x='Fuel', y=dataset.QUANTITY,
+                                                  color='Purpose'), repeat),
+        'figure_world_choropleth': (lambda: px.choropleth(
+            data_frame=df_world, locations='ISO-3', locationmode='ISO-3',
+            color=dataset.QUANTITY, color_continuous_scale='jet'), repeat),
+        'serialize_production_bar': (lambda: pio.to_json(fig_prod, validate=False), repeat),
+        'serialize_consumption_line': (lambda: pio.to_json(fig_cons, validate=False), repeat),
+        'serialize_world_choropleth': (lambda: pio.to_json(fig_world, validate=False), repeat),
+    }
+
+    results = []
+    for name, (func, n) in benchmarks.items():
+        result = measure(func, n)
+        result.update({'scale': scale, 'rows': rows, 'benchmark': name})
+        results.append(result)
+        print('%4dx %-28s median %10.3f ms   peak %8.1f MB' % (scale, name, result['median_s'] * 1e3,
+                                                               result['peak_mb']))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scales', type=int, nargs='+', default=sorted(synthetic.SCALES),
+                        choices=sorted(synthetic.SCALES))
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of timed calls of each benchmark')
+    parser.add_argument('--output', help='path of the JSON results '
+                                         '(default: benchmarks/results/<commit>.json)')
+    args = parser.parse_args()
+
+    # the synthetic country names that cannot be resolved to ISO-3 codes are expected
+    logging.getLogger('country_converter').setLevel(logging.ERROR)
+
+    commit = git_commit()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            results += run_scale(scale, directory, args.repeat)
+
+    output = args.output or os.path.join(os.path.dirname(__file__), 'results',
+                                         '%s.json' % (commit or 'unknown')[:10])
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'commit': commit,
+                   'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'pandas': pd.__version__,
+                   'results': results}, f, indent=2)
+    print('Results written to %s' % output)
+
+
+if __name__ == '__main__':
+    main()
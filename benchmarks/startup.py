@@ -0,0 +1,75 @@
+'''
+Reports the startup time of the dashboard, with a breakdown of the time spent importing modules.
+
+Run from the root of the repository with
+
+    python -m benchmarks.startup
+
+The app is imported in a fresh interpreter (as a gunicorn worker does) with -X importtime.
+The import time is attributed to the top-level packages, in the order they are first imported,
+so that the cost of each dependency on boot time can be tracked across commits.
+'''
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def import_times(stderr):
+    '''
+    Parses the output of -X importtime (on stderr) of the import of app.
+
+    Returns
+    -------
+    OrderedDict
+        The cumulative import time (in s) of each top-level package imported by app, in import order.
+    '''
+    times = collections.OrderedDict()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented by two spaces per level: only the modules imported 
+        # by app itself are kept, their cumulative time includes their own imports
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth != 1:
+            continue
+        package = name.strip().split('.')[0]
+        times[package] = times.get(package, 0) + int(cumulative) / 1e6
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--top', type=int, default=15, help='number of packages to report')
+    parser.add_argument('--output', help='path of the JSON results (printed only if not given)')
+    args = parser.parse_args()
+
+    # the figures rendered in the background at start are not part of the boot time
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                             capture_output=True, text=True, cwd=os.getcwd())
+    total = time.perf_counter() - start
+    if process.returncode != 0:
+        sys.exit(process.stderr)
+
+    times = import_times(process.stderr)
+    report = [line for line in process.stdout.splitlines() if line.startswith('Startup:')]
+    print('Interpreter start and import of app: %.2f s' % total)
+    if report:
+        print(report[0])
+    print('Import time by top-level package (cumulative):')
+    for package, seconds in sorted(times.items(), key=lambda item: -item[1])[:args.top]:
+        print('  %-30s %6.3f s' % (package, seconds))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'total_s': total, 'startup': report[0] if report else None,
+                       'imports_s': times}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+# Transaction codes and names of the "Total Electricity" table
+TRANSACTIONS = {'01': 'Gross production',
+                '019': 'Net production',
+                'EP': 'Total production, main activity',
+                'SP': 'Total production, autoproducer',
+                '015C': 'Main activity - Combustible fuels',
+                '016C': 'Autoproducer - Combustible fuels',
+                '015HY': 'Main activity - Hydro',
+                '016HY': 'Autoproducer - Hydro',
+                '015N': 'Main activity - Nuclear',
+                '016N': 'Autoproducer - Nuclear',
+                '015W': 'Main activity - Wind',
+                '016W': 'Autoproducer - Wind',
+                '015S': 'Main activity - Solar',
+                '016S': 'Autoproducer - Solar',
+                '015H': 'Main activity - Chemical heat',
+                '016H': 'Autoproducer - Chemical heat',
+                '015G': 'Main activity - Geothermal',
+                '03': 'Imports',
+                '04': 'Exports',
+                '07': 'Losses',
+                '10': 'Energy industries own use',
+                '12': 'Final energy consumption',
+                '121': 'Consumption by manufacturing, construction and non-fuel industry',
+                '1211': 'Consumption by iron and steel',
+                '1214': 'Consumption by chemical and petrochemical industry',
+                '122': 'Consumption in transport',
+                '1221': 'Consumption by rail',
+                '123': 'Consumption by other consumers',
+                '1231': 'Consumption by households',
+                '1232': 'Consumption by agriculture, forestry and fishing',
+                '1235': 'Consumption by commerce and public services'}
+
+COMMODITIES = ['Electricity', 'Hard coal', 'Natural gas', 'Crude oil', 'Biogases',
+               'Wind', 'Solar', 'Hydro']
+
+# multipliers of (countries, years, commodities) for each scale of the benchmarks
+SCALES = {1: (1, 1, 1),
+          10: (2, 2.5, 2),
+          100: (5, 2.5, 8)}
+
+BASE_YEARS = 16
+LAST_YEAR = 2019
+
+
+def country_names(n):
+    '''
+    Returns n country names: real names first (so that ISO-3 resolution does real work),
+    followed by synthetic ones.
+    '''
+    import country_converter as coco
+
+    names = list(coco.CountryConverter().data['name_short'])
+    return (names + ['Territory %d' % i for i in range(max(0, n - len(names)))])[:n]
+
+
+def synthetic_data(scale=1, density=0.6, seed=0):
+    '''
+    Generates a data set in the format of the UN energy statistics export.
+
+    Parameters
+    ----------
+    scale: int
+        One of the keys of SCALES. Scale 1 has about the size of the "Total Electricity" table
+        the dashboard uses; larger scales have more countries, years and commodities.
+    density: float
+        Fraction of the (country, commodity, transaction, year) combinations that have a value.
+    seed: int
+        Seed of the random generator.
+
+    Returns
+    -------
+    pandas DataFrame
+        The rows of the export, without the footnotes.
+    '''
+    country_factor, year_factor, n_commodities = SCALES[scale]
+    countries = country_names(250 * country_factor)
+    years = np.arange(LAST_YEAR - int(BASE_YEARS * year_factor) + 1, LAST_YEAR + 1)
+    codes = np.array(list(TRANSACTIONS))
+    labels = np.array(['%s - %s' % (commodity, TRANSACTIONS[code])
+                       for commodity in COMMODITIES[:n_commodities] for code in codes])
+
+    rng = np.random.default_rng(seed)
+    shape = (len(countries), n_commodities * len(codes), len(years))
+    country, transaction, year = [i.ravel() for i in np.indices(shape)]
+    keep = rng.random(country.size) < density
+    country, transaction, year = country[keep], transaction[keep], year[keep]
+    n = country.size
+
+    return pd.DataFrame({'Country or Area Code': 4 * (country + 1),
+                         'Country or Area': np.array(countries, dtype=object)[country],
+                         'Transaction Code': codes[transaction % len(codes)],
+                         'Commodity - Transaction': labels[transaction],
+                         'Year': years[year],
+                         'Quantity': rng.gamma(0.5, 20000, n).round(1),
+                         'Quantity Footnotes': np.where(rng.random(n) < 0.1, 1, np.nan)})
+
+
+def write_synthetic_csv(filename, scale=1, density=0.6, seed=0):
+    '''
+    Writes a synthetic data set (see synthetic_data) as a csv file in the format of
+    the UN energy statistics export, including the footnotes at the end of the file.
+
+    Returns
+    -------
+    int
+        The number of data rows written.
+    '''
+    df = synthetic_data(scale, density, seed)
+    df.to_csv(filename, index=False, float_format='%.1f')
+    with open(filename, 'a') as f:
+        f.write('"fnSeqID","Footnote"\n1,"Estimate"\n')
+    return len(df)
@@ -0,0 +1,270 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from . import compact
+from .metrics import timed
+
+# Bump whenever the serialized form of the entries changes, so that stored entries are not read
+CACHE_VERSION = 1
+
+
+class FigureCache:
+
+    def __init__(self, max_entries=512, max_bytes=64 * 2**20, directory=None, version=None):
+        '''
+        A least-recently-used cache of serialized plotly figures, keyed on callback inputs.
+
+        Parameters
+        ----------
+        max_entries: int
+            Maximum number of entries kept in memory.
+        max_bytes: int
+            Maximum total size of the serialized entries kept in memory.
+        directory: str, optional
+            If given, entries are also written to this directory, so that they are shared
+            between processes (e.g. gunicorn workers) and survive restarts.
+        version: str, optional
+            Version of the data and code the figures are computed from (e.g. a fingerprint of 
+            the data file). The entries are stored on disk in a subdirectory of this version 
+            and of CACHE_VERSION, so that figures of other data or code are not served after a restart.
+
+        Attributes
+        ----------
+        hits: int
+            Number of lookups answered from memory.
+        disk_hits: int
+            Number of lookups answered from the on-disk store.
+        misses: int
+            Number of lookups that had to compute the figures.
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if directory is not None:
+            directory = os.path.join(directory, '-'.join(['v%d' % CACHE_VERSION] + ([version] if version else [])))
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+
+    @timed('cache')
+    def get(self, key):
+        '''
+        Returns the serialized entry stored for a key, or None if there is none.
+        '''
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.directory is not None:
+            try:
+                with open(self._path(key)) as f:
+                    value = f.read()
+            except OSError:
+                value = None
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+
+    def set(self, key, value):
+        '''
+        Stores a serialized entry in memory and, if enabled, on disk.
+        '''
+        self._store(key, value)
+        if self.directory is not None:
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    f.write(value)
+                os.replace(tmp_path, self._path(key))
+            except OSError:
+                # the on-disk store is best effort, the entry is still cached in memory
+                pass
+
+
+    def _store(self, key, value):
+        '''
+        Inserts an entry in memory, evicting the least recently used entries to stay
+        within the entry and memory limits.
+        '''
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+
+    def clear(self):
+        '''
+        Drops all entries held in memory (the on-disk store is left untouched).
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+    def invalidate(self, func, inputs):
+        '''
+        Drops the entries of a callback for a list of inputs, in memory and on disk, 
+        e.g. the figures depending on data that changed. Other entries are kept.
+        '''
+        keys = [self.key(func, args) for args in inputs]
+        with self._lock:
+            for key in keys:
+                value = self._entries.pop(key, None)
+                if value is not None:
+                    self._bytes -= len(value)
+        if self.directory is not None:
+            for key in keys:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+    
+    
+    def stats(self):
+        '''
+        Returns the hit/miss counters and the current size of the cache.
+        '''
+        with self._lock:
+            return {'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes}
+
+
+    def contains(self, key):
+        '''
+        Checks whether an entry is stored for a key, without counting it as a lookup.
+        '''
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.directory is not None and os.path.exists(self._path(key))
+
+
+    def claim(self, key, timeout=120):
+        '''
+        Claims the computation of an entry for this process, so that the other processes
+        sharing the on-disk store wait for it instead of computing it too. Claims older than
+        the timeout (in s) are considered abandoned. Without on-disk store, claims always succeed.
+
+        Returns
+        -------
+        bool
+            True if the entry was claimed, False if another process is computing it.
+        '''
+        if self.directory is None:
+            return True
+        path = self._path(key) + '.lock'
+        try:
+            if time.time() - os.path.getmtime(path) > timeout:
+                os.remove(path)
+        except OSError:
+            pass
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        except OSError:
+            # the on-disk store is best effort, the entry is computed here
+            return True
+        return True
+
+
+    def release(self, key):
+        '''
+        Releases the claim on an entry (see claim).
+        '''
+        if self.directory is not None:
+            try:
+                os.remove(self._path(key) + '.lock')
+            except OSError:
+                pass
+
+
+    @staticmethod
+    def key(func, args):
+        '''
+        Returns the cache key of a callback called with the given inputs.
+        '''
+        return json.dumps([func.__name__, list(args)], default=str)
+
+
+    @staticmethod
+    @timed('serialize')
+    def serialize(figures):
+        '''
+        Serializes the figure, or tuple of figures, returned by a callback, in compact form 
+        (see compact.compact_figure).
+        '''
+        multiple = isinstance(figures, tuple)
+        if not multiple:
+            figures = (figures,)
+        return '{"multiple": %s, "figures": [%s]}' % (
+            json.dumps(multiple), ', '.join(compact.to_json(fig) for fig in figures))
+
+
+    @staticmethod
+    @timed('serialize')
+    def deserialize(value):
+        '''
+        Restores the figures of a serialized entry as plain dicts, which Dash serializes 
+        like the original figures.
+        '''
+        entry = json.loads(value)
+        if entry['multiple']:
+            return tuple(entry['figures'])
+        return entry['figures'][0]
+
+
+    def memoize(self, func):
+        '''
+        Decorator caching the figures returned by a Dash callback, keyed on its name and inputs.
+        The callback may return a single figure or a tuple of figures. The undecorated 
+        callback remains available as the __wrapped__ attribute of the decorated one.
+        '''
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = self.key(func, args)
+            value = self.get(key)
+            if value is None:
+                value = self.serialize(func(*args))
+                self.set(key, value)
+            return self.deserialize(value)
+
+        return wrapper
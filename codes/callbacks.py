@@ -1,6 +1,19 @@
+import numpy as np
+import pandas as pd
 from . import dataset
-import country_converter as coco
+from .metrics import timed
 
+# Transaction codes of the generation figures: totals by purpose, and each fuel by purpose
+PRODUCTION_TRANSACTIONS = ['EP', 'SP', 
+                           '015C', '016C',
+                           '015HY', '016HY',
+                           '015N', '016N',
+                           '015W', '016W',
+                           '015S', '016S',
+                           '015H', '016H',
+                           ]
+
+@timed('transform')
 def build_production_dataset(energyData, year, transactions, codes):
     '''
     Filters the dataset to extract data on electricty generation and transforms 
@@ -10,8 +23,8 @@ def build_production_dataset(energyData, year, transactions, codes):
     ----------
     energyData: dataset.EnergyData object
         The full dataset on electricity
-    year: int
-        A year to filter the data set on. 
+    year: int, list
+        A year or list of years to filter the data set on. 
     transactions: str, list
         A transaction or list of transactions to filter the data set on.
     codes: bool
@@ -21,39 +34,86 @@ def build_production_dataset(energyData, year, transactions, codes):
     Returns
     -------
     df_plot: pandas.DataFrame
-        The cleaned and transformed dataset, containing columns on % of total production,
-        named fuels and generation purpose tags for main activity vs autoproducer.
+        The cleaned and transformed dataset in long format (one row per year and transaction), 
+        containing columns on % of total production, named fuels and generation purpose tags 
+        for main activity vs autoproducer.
     '''
-    df_production = energyData.extract_generation_data(years=year, 
+    df_production = energyData.extract_generation_data(years=year if np.ndim(year) else [year], 
                                                        transactions=transactions,
-                                                       codes=codes)
+                                                       codes=codes,
+                                                       classes=True)
 
     # clean and transform data set with features needed for plotting
     df_plot = df_production.reset_index()
     
-    # add rows for 'Other' main activity and autoproducers (to sum to 100% in pie chart)
-    total_EP_fuels = df_plot['Quantity (1e6 kW/h)'][df_plot['Transaction Code'].str.contains("^015.*?")].sum()
-    total_SP_fuels = df_plot['Quantity (1e6 kW/h)'][df_plot['Transaction Code'].str.contains("^016.*?")].sum()
-    df_plot = df_plot.append({'Year': year, 
-                'Transaction Code': '015O', 
-                'Quantity (1e6 kW/h)': (df_production['Quantity (1e6 kW/h)'].loc[:,'EP'].values - total_EP_fuels)[0]},
-              ignore_index=True)
-    df_plot = df_plot.append({'Year': year, 
-                    'Transaction Code': '016O', 
-                    'Quantity (1e6 kW/h)': (df_production['Quantity (1e6 kW/h)'].loc[:,'SP'].values - total_SP_fuels)[0]},
-                ignore_index=True)
-
-    # add columns for fuel and generation purposes
-    fuel_map = dataset.EnergyData.map_code_to_fuel(df_plot['Transaction Code'])
-    purpose_map = dataset.EnergyData.map_code_to_purpose(df_plot['Transaction Code'])
-
-    df_plot['Fuel'] = df_plot['Transaction Code'].map(fuel_map)
-    df_plot['Purpose'] = df_plot['Transaction Code'].map(purpose_map)
+    # add rows for 'Other' main activity and autoproducers (to sum to 100% in pie chart):
+    # the totals (EP, SP) minus the sum of the main activity (015*) and autoproducer (016*) fuels, 
+    # computed for all years at once
+    prefix = df_plot['Transaction Code'].str[:3].rename('Prefix')
+    sums = df_plot.groupby(['Year', prefix])[dataset.QUANTITY].sum().unstack()
+    sums = sums.reindex(columns=['EP', 'SP', '015', '016'])
+    df_other = pd.DataFrame({'015O': sums['EP'] - sums['015'].fillna(0), 
+                             '016O': sums['SP'] - sums['016'].fillna(0)})
+    df_other.columns.name = 'Transaction Code'
+    df_other = df_other.stack(dropna=False).rename(dataset.QUANTITY).reset_index()
+    # the fuel and purpose of the other rows, the others come with the extracted data
+    df_other['Fuel'] = 'Other'
+    df_other['Purpose'] = np.where(df_other['Transaction Code'] == '015O', 'Main activity', 'Autoproducer')
+    
+    df_plot = pd.concat([df_plot, df_other], ignore_index=True)
     
     return df_plot
 
 
-def build_consumption_dataset(energyData, years):
+# short labels for the consumers shown in the dashboard, other consumers are labelled
+# from their transaction name
+CONSUMER_LABELS = {'1231': 'Households', 
+                   '121': 'Industry', 
+                   '122': 'Transport', 
+                   '1232': 'Agriculture', 
+                   '1235': 'Services'}
+
+
+def consumer_label(code, transaction):
+    '''
+    Returns the label of a consumer for plotting, e.g. 'Consumption by households' -> 'Households'.
+    '''
+    if code in CONSUMER_LABELS:
+        return CONSUMER_LABELS[code]
+    if transaction is None:
+        return code
+    for prefix in ['Consumption by ', 'Consumption in ']:
+        if transaction.startswith(prefix):
+            transaction = transaction[len(prefix):]
+    return transaction[:1].upper() + transaction[1:]
+
+
+def choose_resolution(years, series, budget=None):
+    '''
+    Returns the shortest length of periods of dataset.RESOLUTIONS for which a history of 
+    several series over a range of years fits within a budget of points.
+    
+    Parameters
+    ----------
+    years: list
+        The years of the history, whose range is split into periods (see EnergyData.periods).
+    series: int
+        Number of series (e.g. lines) of the history.
+    budget: int, optional
+        Maximum number of points, if None the history is kept per year.
+    '''
+    if budget is None or len(years) == 0:
+        return 1
+    years = np.asarray(years)
+    for resolution in dataset.RESOLUTIONS:
+        periods = years.max() // resolution - years.min() // resolution + 1
+        if series * periods <= budget:
+            return resolution
+    return dataset.RESOLUTIONS[-1]
+
+
+@timed('transform')
+def build_consumption_dataset(energyData, years, transactions=None, level=None, budget=None):
     '''
     Filters the dataset to extract data on electricty consumption and transforms 
     it for plotting.
@@ -65,34 +125,45 @@ def build_consumption_dataset(energyData, years):
     years: int, list
         A year or list of years to filter the data set on. 
     transactions: str, list
-        A transaction or list of transactions to filter the data set on.
-    codes: bool
-        If True, the transactions will be filtered and indexed by their codes instead of strings.
-        Use codes=True if passing codes in the transactions parameter.
+        A transaction code or list of transaction codes to filter the data set on. 
+        Defaults to the consumers in CONSUMER_LABELS if no level is given either.
+    level: int, list
+        A level or list of levels of the consumption hierarchy to filter the data set on
+        (1 for sectors, 2 for subsectors, ...).
+    budget: int, optional
+        Maximum number of points. If the yearly consumption exceeds it, the mean yearly 
+        consumption of periods of years is returned instead (see choose_resolution).
     
     Returns
     -------
     df_plot: pandas.DataFrame
         The cleaned and transformed dataset, with transaction codes mapped to consumer tags.
+        For periods of several years, the Period and Years columns tell the years aggregated.
     '''
+    if transactions is None and level is None:
+        transactions = ['121', '1231', '1235', '1232', '122']
     
-    # TODO: generalize to entire set (the implementation below only focuces on case study)
-    consumer_map = {'1231': 'Households', 
-                    '121': 'Industry', 
-                    '122': 'Transport', 
-                    '1232': 'Agriculture', 
-                    '1235': 'Services'}
-    transactions=['121', '1231', '1235', '1232', '122']
-    
-    df_consumption = energyData.extract_consumption_data(years=years, 
-                                                       transactions=transactions,
-                                                       codes=True)
+    df_consumption = energyData.extract_consumption_hierarchy(years=years, 
+                                                              transactions=transactions,
+                                                              level=level)
+    if budget is not None and len(df_consumption) > budget:
+        resolution = choose_resolution(df_consumption['Year'].values, 
+                                       df_consumption['Transaction Code'].nunique(), budget)
+        df_consumption = energyData.extract_consumption_hierarchy(years=years, 
+                                                                  transactions=transactions,
+                                                                  level=level,
+                                                                  resolution=resolution)
 
-    df_plot = df_consumption.reset_index()
-    df_plot['Consumer'] = df_plot['Transaction Code'].map(consumer_map)
+    columns = [column for column in ['Year', 'Period', 'Years', 'Transaction Code', dataset.QUANTITY]
+               if column in df_consumption]
+    df_plot = df_consumption[columns].copy()
+    labels = {code: consumer_label(code, transaction) for code, transaction 
+              in zip(df_consumption['Transaction Code'], df_consumption['Transaction'])}
+    df_plot['Consumer'] = df_plot['Transaction Code'].map(labels)
     return df_plot
     
     
+@timed('transform')
 def build_world_data(energyData, year, transaction):
     '''
     Filters the dataset to extract per-country data for a given year and transaction.
@@ -115,10 +186,225 @@ def build_world_data(energyData, year, transaction):
         The cleaned and filtered dataset for plotting.
     '''
 
-    df_plot = energyData.data[(energyData.data['Year'] == year) & (energyData.data['Transaction Code'] == transaction)]
-    df_plot['ISO-3'] = coco.convert(df_plot['Country or Area'], to='ISO3')
+    # ISO-3 codes are resolved once when the data set is loaded (see dataset.resolve_iso3)
+    data = energyData.data
+    df_plot = data[(data['Year'] == year) & (data['Transaction Code'] == transaction)]
     
     return df_plot
     
     
-        
\ No newline at end of file
+@timed('transform')
+def build_world_values(energyData, year, transaction, derived=False):
+    '''
+    Extracts the per-country values for a given year and transaction, in the compact form 
+    used to recolor the world map in the browser (instead of sending a whole new figure).
+    
+    energyData: dataset.EnergyData object
+        The full dataset on electricity
+    year: int
+        A year to filter the data set on. 
+    transaction: str
+        A transaction code to filter the data set on, or the expression of a derived metric.
+    derived: bool
+        If True, transaction is the expression of a derived metric (see dataset.EnergyData.derived).
+        
+    Returns
+    -------
+    dict
+        The ISO-3 codes of the countries that have a value ('locations') and their values ('z').
+    '''
+    if derived:
+        values = energyData.extract_world_metric(year, transaction)
+    else:
+        values = energyData.extract_world_values(year, transaction)
+    keep = ~np.isnan(values)
+    # rounding drops the noise of float32 quantities (streamed data sets) from the payload
+    return {'locations': energyData.world_locations[keep].tolist(),
+            'z': np.round(values[keep].astype(np.float64), 3).tolist()}
+    
+    
+@timed('transform')
+def build_region_values(energyData, year, transaction, grouping):
+    '''
+    Extracts the totals of the regions of a grouping for a given year and transaction, in the 
+    compact form used to recolor the regional map and bars in the browser (see build_world_values).
+    
+    energyData: dataset.EnergyData object
+        The full dataset on electricity
+    year: int
+        A year to filter the data set on. 
+    transaction: str
+        A transaction code to filter the data set on.
+    grouping: str
+        One of dataset.REGION_GROUPINGS, e.g. 'Continent'.
+        
+    Returns
+    -------
+    dict
+        The regions that have a value ('regions') and their totals ('totals'), and for the map 
+        the ISO-3 codes of their countries ('locations'), the total of the region of each 
+        country ('z') and the name of the region ('text').
+    '''
+    df_regions = energyData.extract_region_values(year, transaction, grouping)
+    totals = dict(zip(df_regions['Region'], np.round(df_regions[dataset.QUANTITY].astype(np.float64), 3).tolist()))
+    regions = energyData.region_locations(grouping)
+    keep = np.array([region in totals for region in regions], dtype=bool)
+    return {'regions': list(totals),
+            'totals': list(totals.values()),
+            'locations': energyData.world_locations[keep].tolist(),
+            'z': [totals[region] for region in regions[keep]],
+            'text': regions[keep].tolist()}
+    
+    
+@timed('transform')
+def build_country_data(energyData, country, budget=None):
+    '''
+    Extracts the history of a single country and transforms it for plotting.
+    
+    Parameters
+    ----------
+    energyData: dataset.EnergyData object
+        The full dataset on electricity
+    country: str
+        The name or ISO-3 code of the country.
+    budget: int, optional
+        Maximum number of points of each figure. If the yearly history exceeds it, the mean 
+        yearly values of periods of years are returned instead (see choose_resolution).
+        
+    Returns
+    -------
+    df_gen: pandas.DataFrame
+        The electricity generation of the country per year and fuel 
+        (main activity and autoproducers combined), or the mean yearly generation 
+        per period of years and fuel, over the years with a value.
+    df_cons: pandas.DataFrame
+        The electricity consumption of the country per year and consumer, or the mean 
+        yearly consumption per period of years and consumer, over the years with a value.
+    '''
+    def fuel_rows(df):
+        # the fuels of main activity and autoproducers, not their totals
+        return df['Purpose'].isin(['Main activity', 'Autoproducer']) & (df['Fuel'] != 'Total')
+    
+    df_country = energyData.extract_country_data(country, classes=True)
+    resolution = 1
+    if budget is not None:
+        # the figures have a line per fuel and per consumer
+        series = max(df_country.loc[fuel_rows(df_country), 'Fuel'].nunique(),
+                     len(set(df_country['Transaction Code']) & set(CONSUMER_LABELS)))
+        resolution = choose_resolution(df_country['Year'].values, series, budget)
+    
+    codes = df_country['Transaction Code']
+    df_gen = df_country[fuel_rows(df_country)].groupby(['Year', 'Fuel'], as_index=False)[dataset.QUANTITY].sum()
+    df_cons = df_country[codes.isin(list(CONSUMER_LABELS))].drop(columns=['Fuel', 'Purpose'])
+    if resolution > 1:
+        # both figures average over the years of a period with a value: the consumption from the 
+        # cumulative sums, and the generation of a fuel from its yearly totals over its series
+        df_cons = energyData.extract_country_data(country, df_cons['Transaction Code'].unique(), resolution)
+        first, last, _, _ = energyData.periods(None, resolution)
+        periods = np.searchsorted(first, df_gen['Year'].values, side='right') - 1
+        df_gen = df_gen.assign(Year=first[periods], Period=energyData.period_labels(first[periods], last[periods]))
+        df_gen = (df_gen.groupby(['Year', 'Period', 'Fuel'])[dataset.QUANTITY]
+                        .agg(['count', 'mean'])
+                        .rename(columns={'count': 'Years', 'mean': dataset.QUANTITY})
+                        .reset_index())
+    df_cons['Consumer'] = df_cons['Transaction Code'].map(CONSUMER_LABELS)
+    
+    return df_gen, df_cons
+
+
+@timed('transform')
+def build_forecast_ranking(energyData, transaction, year, method='linear', n=15):
+    '''
+    Ranks the countries by the projected change of a transaction, from their last year of data
+    to a target year, following the trend fitted on all years.
+    
+    Parameters
+    ----------
+    energyData: dataset.EnergyData object
+        The full dataset on electricity
+    transaction: str
+        A transaction code.
+    year: int
+        The year to project to.
+    method: str
+        'linear' or 'log-linear' trend (see dataset.EnergyData.trends).
+    n: int
+        Number of countries kept at each end of the ranking (largest decreases and increases).
+        
+    Returns
+    -------
+    df_plot: pandas.DataFrame
+        The countries with the n largest projected decreases and increases, sorted by change, 
+        with the change in percent.
+    '''
+    df = energyData.forecast(transaction, year, method).dropna(subset=['Change'])
+    df = df.sort_values('Change', kind='stable')
+    if len(df) > 2 * n:
+        df = pd.concat([df.head(n), df.tail(n)])
+    return df.assign(**{'Change (%)': (100 * df['Change']).round(1)}).reset_index(drop=True)
+
+
+@timed('transform')
+def build_rankings(energyData, transaction, year, start, end, n=10):
+    '''
+    Builds the tables of the countries with the largest values of a transaction in a year, 
+    and with the largest rises and falls between two years. The rankings are slices of 
+    the sorted indexes of the dataset (see dataset.EnergyData.top_n and top_movers).
+    
+    Parameters
+    ----------
+    energyData: dataset.EnergyData object
+        The full dataset on electricity
+    transaction: str
+        A transaction code.
+    year: int
+        The year of the top countries.
+    start, end: int
+        The years the changes are computed between.
+    n: int
+        Number of countries in each table.
+        
+    Returns
+    -------
+    df_top, df_rises, df_falls: pandas.DataFrame
+        The tables, with string column names and rounded values for display.
+    '''
+    df_top = energyData.top_n(year, transaction, n)
+    df_rises = energyData.top_movers(transaction, start, end, n)
+    df_falls = energyData.top_movers(transaction, start, end, n, largest=False)
+    
+    # the change between the years is held in the quantity column of the movers
+    df_rises, df_falls = [df.rename(columns={dataset.QUANTITY: 'Change (1e6 kW/h)'}) 
+                          for df in [df_rises, df_falls]]
+    return tuple(df.rename(columns=str).round(1) for df in [df_top, df_rises, df_falls])
+
+
+@timed('transform')
+def build_commodity_data(commodityData, commodity, transaction, year, n=15):
+    '''
+    Builds the data of the commodity explorer: the world total of a transaction of a commodity 
+    over the years, and the countries with the largest values in a year.
+    
+    Parameters
+    ----------
+    commodityData: commodities.CommodityData object
+        The data set of all commodities.
+    commodity: str
+        A commodity (e.g. 'Electricity').
+    transaction: str
+        A transaction code (or name) of the commodity.
+    year: int
+        The year of the countries.
+    n: int
+        Number of countries kept.
+        
+    Returns
+    -------
+    df_trend: pandas.DataFrame
+        The world total by year.
+    df_countries: pandas.DataFrame
+        The n countries with the largest values in the year, largest first.
+    '''
+    df_trend = commodityData.query(commodity, transactions=transaction, by='Year')
+    df_countries = commodityData.query(commodity, transactions=transaction, years=year, by='Country or Area')
+    return df_trend, df_countries.nlargest(n, 'Quantity')
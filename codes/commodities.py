@@ -0,0 +1,373 @@
+import functools
+import hashlib
+import io
+import os
+import numpy as np
+import pandas as pd
+from .dataset import _aggregate, _data_size, resolve_iso3
+from .metrics import timed
+from .snapshot import (SNAPSHOT_VERSION, code_hash, file_hash, load_shared, load_snapshot, prune_shared, 
+                       save_shared, save_snapshot, snapshot_path)
+
+# Dimensions of the data set, which query results can be grouped by
+DIMENSIONS = ['Commodity', 'Transaction Code', 'Country or Area', 'Year']
+
+# Axes of the arrays of each commodity
+AXES = {'Year': 0, 'Transaction Code': 1, 'Country or Area': 2}
+
+AGGREGATIONS = ['sum', 'mean', 'min', 'max', 'count']
+
+# Units of the commodities of exports without a unit column (like the "Total Electricity" table)
+DEFAULT_UNITS = {'Electricity': 'Kilowatt-hours, million'}
+
+
+def _read_export(filename):
+    '''
+    Parses and cleans a csv export of the UN energy statistics, of one or several commodities.
+    The exports of the "Total Electricity" table have transaction codes; the other tables
+    only have transaction names (which are then used as codes) and a unit column.
+
+    Returns
+    -------
+    df: pandas DataFrame
+        The values by commodity, transaction code, country and year, with the transaction
+        names, the units and the ISO-3 codes of the countries.
+    '''
+    with open(filename, 'rb') as f:
+        body = f.read(_data_size(f))
+    df = pd.read_csv(io.BytesIO(body), dtype={'Country or Area': 'category',
+                                               'Transaction Code': 'category',
+                                               'Commodity - Transaction': 'category',
+                                               'Unit': 'category'})
+
+    # split commodity - transaction once per distinct value
+    commodity_transaction = df['Commodity - Transaction'].cat
+    split = [c.split(' - ') for c in commodity_transaction.categories]
+    commodities = np.array([s[0] for s in split], dtype=object)
+    transactions = np.array([s[-1] for s in split], dtype=object)
+    codes = commodity_transaction.codes
+
+    df = pd.DataFrame({'Commodity': pd.Categorical(commodities[codes]),
+                       'Transaction Code': df['Transaction Code'] if 'Transaction Code' in df
+                                           else pd.Categorical(transactions[codes]),
+                       'Transaction': pd.Categorical(transactions[codes]),
+                       'Country or Area': df['Country or Area'],
+                       'Year': df['Year'].astype(np.int32),
+                       'Unit': df['Unit'] if 'Unit' in df
+                               else pd.Categorical(pd.Series(commodities[codes]).map(DEFAULT_UNITS)),
+                       'Quantity': df['Quantity'].astype(np.float64)})
+    # drop values for 2019 because incomplete
+    df = df[df['Year'] != 2019].reset_index(drop=True)
+
+    df['ISO-3'] = resolve_iso3(df['Country or Area'])
+    return df
+
+
+@functools.lru_cache(maxsize=None)
+def _code_version():
+    '''
+    Returns a fingerprint of the code that builds the data set, so that processes do not 
+    attach to shared data sets stored by another version of it (see dataset._code_version).
+    '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return code_hash([os.path.join(directory, name) for name in ['commodities.py', 'dataset.py', 'snapshot.py']])
+
+
+class CommodityData:
+
+    def __init__(self, filenames, snapshot=True):
+        '''
+        Initializes a data set of several commodities of the UN energy statistics
+        (e.g. electricity, coal, natural gas, oil), arranged as commodity x transaction x
+        country x year and queried with query. The indexes of every dimension are built once
+        at load, so queries are lookups and slices of dense arrays, whatever the commodity.
+
+        Parameters
+        ----------
+        filenames: str, list
+            Path(s) to csv exports, each of one or several commodities. A value present in
+            several exports is taken from the last one.
+        snapshot: bool
+            If True, each cleaned export is cached in a binary snapshot next to the file
+            (see dataset.EnergyData), and reloaded from it as long as the file has not changed.
+
+        Attributes
+        ----------
+        commodities: numpy array
+            Sorted commodities in the data set.
+        years: numpy array
+            Sorted years in the data set, for all commodities.
+        countries: numpy array
+            Sorted country names in the data set, for all commodities.
+        transaction_codes: dict
+            Sorted transaction codes of each commodity.
+        transaction_names: dict
+            Transaction name of each code, by commodity.
+        units: dict
+            Unit of the quantities of each commodity.
+        '''
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        frames = [self._load(filename, snapshot) for filename in filenames]
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        if len(frames) > 1:
+            keys = ['Commodity', 'Transaction Code', 'Country or Area', 'Year']
+            df = df.drop_duplicates(keys, keep='last').reset_index(drop=True)
+        self._build_index(df)
+
+
+    @staticmethod
+    def _load(filename, snapshot=True):
+        '''
+        Returns the cleaned data of an export, from its snapshot if there is a valid one.
+        '''
+        df = None
+        if snapshot:
+            # the snapshot of the electricity data set of the same file holds other columns
+            path = os.path.splitext(snapshot_path(filename))[0] + '.commodities.npz'
+            source_hash = file_hash(filename, 'commodities')
+            df = load_snapshot(path, source_hash)
+        if df is None:
+            df = _read_export(filename)
+            if snapshot:
+                try:
+                    save_snapshot(df, path, source_hash)
+                except OSError:
+                    pass
+        return df
+
+
+    @classmethod
+    def shared(cls, filenames, directory, snapshot=True):
+        '''
+        Loads the data set from memory shared between processes, e.g. gunicorn workers, like 
+        dataset.EnergyData.shared: the first call for given exports stores the data set in the 
+        directory, later calls attach to it, so its arrays are held in memory only once.
+
+        Parameters
+        ----------
+        filenames: str, list
+            Path(s) to csv exports, see the constructor.
+        directory: str
+            Directory holding the shared data sets. A directory in /dev/shm keeps them in memory.
+        snapshot: bool
+            See the constructor.
+
+        Returns
+        -------
+        CommodityData object
+            The data set, with its arrays memory-mapped read-only.
+        '''
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        # the state depends on the files (and their order) and the code that built it
+        sources = hashlib.sha1(' '.join(file_hash(filename, 'commodities') for filename in filenames).encode())
+        path = os.path.join(directory, 'commodities-%s-v%d-%s' % (sources.hexdigest(), SNAPSHOT_VERSION, 
+                                                                  _code_version()))
+        if not os.path.exists(path):
+            save_shared(cls(filenames, snapshot).__dict__, path)
+        commodityData = cls.__new__(cls)
+        commodityData.__dict__.update(load_shared(path))
+        prune_shared(directory, path, r'^commodities-[0-9a-f]{40}-v\d+-[0-9a-f]+$')
+        return commodityData
+
+
+    def refresh(self, filenames, directory=None, snapshot=True):
+        '''
+        Loads new versions of the exports and compares them with this data set, like 
+        dataset.EnergyData.refresh: callers swap their reference to the returned object.
+
+        Parameters
+        ----------
+        filenames: str, list
+            Path(s) to csv exports, see the constructor.
+        directory: str, optional
+            If given, the new data set is loaded from memory shared between processes (see shared).
+        snapshot: bool
+            See the constructor.
+
+        Returns
+        -------
+        commodityData: CommodityData object
+            The new data set, or this object if no value changed.
+        delta: pandas DataFrame
+            The (commodity, transaction code, country, year) values that were added, changed 
+            or removed.
+        '''
+        if directory is not None:
+            commodityData = self.shared(filenames, directory, snapshot)
+        else:
+            commodityData = type(self)(filenames, snapshot)
+        delta = self._delta(self, commodityData)
+        if delta.empty:
+            return self, delta
+        return commodityData, delta
+
+
+    @staticmethod
+    def _delta(old, new):
+        '''
+        Returns the (commodity, transaction code, country, year) values that differ between 
+        two data sets.
+        '''
+        def values(commodityData):
+            df = commodityData.query(agg=None)
+            index = pd.MultiIndex.from_arrays([np.asarray(df[key]) for key in DIMENSIONS], names=DIMENSIONS)
+            return pd.Series(df['Quantity'].values, index=index)
+
+        before, after = values(old).align(values(new), join='outer')
+        changed = ~np.isclose(before.values, after.values, equal_nan=True)
+        return before.index[changed].to_frame(index=False)
+
+
+    def _build_index(self, df):
+        '''
+        Builds the indexes of the dimensions and the dense year x transaction code x country
+        array of each commodity, in a single pass over the rows.
+        '''
+        commodities = pd.Categorical(df['Commodity'])
+        years = pd.Categorical(df['Year'])
+        countries = pd.Categorical(df['Country or Area'])
+        quantity = np.asarray(df['Quantity'], dtype=np.float64)
+
+        self.commodities = np.asarray(commodities.categories, dtype=object)
+        self.years = np.asarray(years.categories)
+        self.countries = np.asarray(countries.categories, dtype=object)
+        self._year_index = {year: i for i, year in enumerate(self.years)}
+        self._country_index = {country: i for i, country in enumerate(self.countries)}
+
+        # countries are also looked up by their ISO-3 codes
+        first = df.drop_duplicates('Country or Area').dropna(subset=['ISO-3'])
+        self._country_index.update((iso3, self._country_index[country])
+                                   for iso3, country in zip(first['ISO-3'], first['Country or Area']))
+
+        # rows grouped by commodity: each commodity is a contiguous block of the order
+        order = np.argsort(commodities.codes, kind='stable')
+        bounds = np.searchsorted(commodities.codes[order], np.arange(len(self.commodities) + 1))
+
+        self.transaction_codes, self.transaction_names, self.units = {}, {}, {}
+        self._values, self._code_index = {}, {}
+        for i, commodity in enumerate(self.commodities):
+            rows = order[bounds[i]:bounds[i + 1]]
+            block = df.iloc[rows]
+            codes = pd.Categorical(np.asarray(block['Transaction Code'], dtype=object))
+            shape = (len(self.years), len(codes.categories), len(self.countries))
+            values, present = _aggregate((years.codes[rows], codes.codes, countries.codes[rows]),
+                                         shape, quantity[rows])
+
+            self.transaction_codes[commodity] = np.asarray(codes.categories, dtype=object)
+            first = block.drop_duplicates('Transaction Code')
+            names = dict(zip(np.asarray(first['Transaction Code']), np.asarray(first['Transaction'])))
+            self.transaction_names[commodity] = names
+            units = block['Unit'].dropna().unique()
+            self.units[commodity] = units[0] if len(units) else None
+            self._values[commodity] = np.where(present, values, np.nan)
+            # transactions are looked up by code or by name
+            index = {names[code]: i for i, code in enumerate(codes.categories)}
+            index.update((code, i) for i, code in enumerate(codes.categories))
+            self._code_index[commodity] = index
+
+
+    @staticmethod
+    def _positions(index, labels, size):
+        '''
+        Returns the positions of labels in an index (all positions if labels is None),
+        skipping the labels missing from it.
+        '''
+        if labels is None:
+            return np.arange(size)
+        return np.array([index[label] for label in np.atleast_1d(labels) if label in index], dtype=int)
+
+
+    @timed('extract')
+    def query(self, commodity=None, transactions=None, years=None, countries=None, agg='sum', by=None):
+        '''
+        Returns the values of commodities, optionally filtered on transactions, years and
+        countries, and aggregated over the dimensions that are not kept. The values are sliced
+        from the arrays of the commodities: the cost does not depend on the size of the data set.
+
+        Parameters
+        ----------
+        commodity: str, list, optional
+            A commodity or list of commodities, defaults to all.
+        transactions: str, list, optional
+            Transaction codes or names to filter on, defaults to all.
+        years: int, list, optional
+            Years to filter on, defaults to all.
+        countries: str, list, optional
+            Country names or ISO-3 codes to filter on, defaults to all.
+        agg: str, optional
+            One of AGGREGATIONS. If None, the values are returned without aggregation.
+        by: str, list, optional
+            The dimensions (see DIMENSIONS) kept in the result, the values being aggregated
+            over the others. Defaults to all the dimensions.
+
+        Returns
+        -------
+        pandas.DataFrame object
+            The columns of the kept dimensions and a Quantity column, with a row for each
+            combination of the kept dimensions that has at least one value.
+        '''
+        if agg is not None and agg not in AGGREGATIONS:
+            raise ValueError('Unknown aggregation {}, expected one of {}'.format(agg, AGGREGATIONS))
+        by = DIMENSIONS if by is None or agg is None else list(np.atleast_1d(by))
+        unknown = [dimension for dimension in by if dimension not in DIMENSIONS]
+        if unknown:
+            raise ValueError('Unknown dimensions {}, expected some of {}'.format(unknown, DIMENSIONS))
+
+        selected = list(self.commodities) if commodity is None else \
+                   [c for c in np.atleast_1d(commodity) if c in self._values]
+        if 'Commodity' not in by and agg in ['sum', 'mean', 'min', 'max'] and \
+                len({self.units[c] for c in selected}) > 1:
+            raise ValueError('Cannot aggregate commodities with different units {}, keep the Commodity '
+                             'dimension'.format(sorted({str(self.units[c]) for c in selected})))
+
+        year_idx = self._positions(self._year_index, years, len(self.years))
+        country_idx = self._positions(self._country_index, countries, len(self.countries))
+        # the kept dimensions, in the order of by, and the dimensions aggregated over
+        kept = [dimension for dimension in by if dimension in AXES]
+        reduced = tuple(axis for dimension, axis in AXES.items() if dimension not in kept)
+
+        parts = []
+        for c in selected:
+            code_idx = self._positions(self._code_index[c], transactions, len(self.transaction_codes[c]))
+            values = self._values[c][np.ix_(year_idx, code_idx, country_idx)]
+            labels = {'Year': self.years[year_idx],
+                      'Transaction Code': self.transaction_codes[c][code_idx],
+                      'Country or Area': self.countries[country_idx]}
+
+            present = ~np.isnan(values)
+            stats = {'count': present.sum(axis=reduced)}
+            if agg is None or agg in ['sum', 'mean']:
+                stats['sum'] = np.nansum(values, axis=reduced) if agg else values
+            if agg in ['min', 'max']:
+                fill = np.inf if agg == 'min' else -np.inf
+                stats[agg] = getattr(np.where(present, values, fill), agg)(axis=reduced)
+
+            # the remaining axes are moved to the order of the kept dimensions
+            order = tuple(np.argsort(np.argsort([AXES[dimension] for dimension in kept])))
+            keep = (stats['count'] > 0).transpose(order).ravel()
+            grid = np.meshgrid(*[labels[dimension] for dimension in kept], indexing='ij')
+            part = pd.DataFrame({'Commodity': np.full(keep.sum(), c, dtype=object)})
+            for dimension, value in zip(kept, grid):
+                part[dimension] = value.ravel()[keep]
+            for name, value in stats.items():
+                part[name] = np.asarray(value).transpose(order).ravel()[keep]
+            parts.append(part)
+
+        if not parts:
+            return pd.DataFrame(columns=by + ['Quantity'])
+        df = pd.concat(parts, ignore_index=True)
+        if 'Commodity' not in by and len(parts) > 1:
+            # combines the aggregates of the commodities: only the result is grouped, not the data
+            combine = {name: 'min' if name == 'min' else 'max' if name == 'max' else 'sum' for name in stats}
+            df = df.groupby(kept, as_index=False, sort=True).agg(combine) if kept else \
+                 df.agg(combine).to_frame().T
+
+        if agg is None:
+            quantity = df['sum']
+        elif agg == 'mean':
+            quantity = df['sum'] / df['count']
+        else:
+            quantity = df[agg]
+        return df[by].assign(Quantity=np.asarray(quantity, dtype=np.float64))
@@ -0,0 +1,80 @@
+import json
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+# Trace types drawn on x and y axes
+CARTESIAN_TRACES = ['scatter', 'scattergl', 'bar', 'histogram', 'histogram2d', 'histogram2dcontour',
+                    'box', 'violin', 'heatmap', 'contour', 'funnel', 'waterfall', 'ohlc', 'candlestick']
+
+# Layout entries of the templates that only apply to one kind of subplot, with the trace types
+# drawn on it. The entries for subplots a figure does not have are dropped from its template.
+SUBPLOT_TRACES = {'xaxis': CARTESIAN_TRACES,
+                  'yaxis': CARTESIAN_TRACES,
+                  'polar': ['scatterpolar', 'scatterpolargl', 'barpolar'],
+                  'ternary': ['scatterternary'],
+                  'scene': ['scatter3d', 'surface', 'mesh3d', 'cone', 'streamtube', 'isosurface', 'volume'],
+                  'geo': ['choropleth', 'scattergeo'],
+                  'mapbox': ['scattermapbox', 'choroplethmapbox', 'densitymapbox']}
+
+# Decimals kept in numeric arrays. The quantities of the data set have one decimal,
+# the extra ones only carry the noise of float32 data and of sums.
+DECIMALS = 3
+
+
+def _round(value, decimals):
+    '''
+    Rounds the float arrays in a (nested) trace, leaving other values unchanged.
+    '''
+    if isinstance(value, np.ndarray) and value.dtype.kind == 'f':
+        return np.round(value.astype(np.float64), decimals)
+    if isinstance(value, dict):
+        return {key: _round(item, decimals) for key, item in value.items()}
+    return value
+
+
+def compact_figure(fig, decimals=DECIMALS):
+    '''
+    Returns a plotly figure as a dict that serializes to much less JSON, but renders the same:
+    the template only keeps the defaults of the trace types and subplots the figure uses,
+    and float arrays are rounded.
+
+    Parameters
+    ----------
+    fig: plotly Figure or dict
+        The figure to compact.
+    decimals: int
+        Decimals kept in the float arrays of the traces.
+
+    Returns
+    -------
+    dict
+        The compacted figure, with 'data' and 'layout' keys.
+    '''
+    if not isinstance(fig, dict):
+        fig = fig.to_plotly_json()
+    data = [_round(trace, decimals) for trace in fig.get('data', [])]
+    layout = dict(fig.get('layout', {}))
+
+    template = layout.get('template')
+    if template:
+        if not isinstance(template, dict):
+            template = template.to_plotly_json()
+        types = {trace.get('type', 'scatter') for trace in data}
+        template_data = {key: value for key, value in template.get('data', {}).items() if key in types}
+        template_layout = {key: value for key, value in template.get('layout', {}).items()
+                           if key not in SUBPLOT_TRACES or types & set(SUBPLOT_TRACES[key])}
+        # the default colorscales are only used by color axes that do not set their own
+        if layout.get('coloraxis', {}).get('colorscale') is not None or 'coloraxis' not in layout:
+            template_layout.pop('colorscale', None)
+        layout['template'] = {'data': template_data, 'layout': template_layout}
+
+    return {'data': data, 'layout': layout}
+
+
+def to_json(fig, decimals=DECIMALS):
+    '''
+    Serializes a plotly figure to compact JSON (see compact_figure).
+    '''
+    return json.dumps(compact_figure(fig, decimals), cls=PlotlyJSONEncoder, separators=(',', ':'))
+
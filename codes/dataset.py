@@ -1,9 +1,249 @@
+import ast
+import functools
+import io
+import os
 import numpy as np 
 import pandas as pd 
+from .derived import evaluate, parse
+from .forecast import fit_trends, predict
+from .metrics import timed
+from .snapshot import (SNAPSHOT_VERSION, code_hash, file_hash, load_shared, load_snapshot, prune_shared, 
+                       save_shared, save_snapshot, snapshot_path)
+
+# The production data have transaction codes starting with 01.
+# The transaction code for total production - main activity is EP
+# The Transaction code for total production - autoproducer is SP
+GENERATION_PATTERN = "^01.*?|EP|SP"
+# The consumption data have transaction codes starting with 12.
+CONSUMPTION_PATTERN = "^12.*?"
+
+QUANTITY = 'Quantity (1e6 kW/h)'
+
+# The commodity of the data set, kept when streaming exports of several commodities
+COMMODITY = 'Electricity'
+
+# Lengths in years of the periods the histories can be aggregated to (see EnergyData.periods)
+RESOLUTIONS = [1, 5, 10]
+
+# Names in the UN data that are regional totals or no longer existing countries. 
+# They have no ISO-3 code of their own and are left out of the maps.
+UNRESOLVED_COUNTRIES = ['Other Asia',
+                        'Commonwealth of Independent States',
+                        'Czechoslovakia (former)',
+                        'German Dem. R. (former)',
+                        'Germany, Fed. R. (former)',
+                        'Netherlands Antilles',
+                        'Pacific Islands (former)',
+                        'Serbia and Montenegro',
+                        'USSR (former)',
+                        'Yemen Arab Rep. (former)',
+                        'Yemen, Dem. (former)',
+                        'Yugoslavia, SFR']
+
+# Groupings of the countries into regions, and the country_converter classification each 
+# is resolved from (see resolve_regions). The OECD classification gives the members and the others.
+REGION_GROUPINGS = {'Continent': 'continent', 
+                    'UN region': 'UNregion', 
+                    'OECD': 'OECD'}
+
+
+# Rules to classify electricity production codes, as (regular expression, label) pairs. 
+# A rule matches when the expression matches the whole code; the first matching rule wins.
+FUEL_RULES = [('EP|SP', 'Total'),
+              ('01', 'Gross'),
+              ('019', 'Net'),
+              ('.*C', 'Combustible Fuels'),
+              ('.*S', 'Solar'),
+              ('.*N', 'Nuclear'),
+              ('.*H', 'Chemical Heat'),
+              ('.*W', 'Wind'),
+              ('.*Y', 'Hydro'),
+              ('.*', 'Other')]
+
+PURPOSE_RULES = [('.15.*|EP', 'Main activity'),
+                 ('.16.*|SP', 'Autoproducer'),
+                 ('.*', 'Other')]
+
+
+def classify_codes(codes, rules):
+    '''
+    Classifies transaction codes with a rule table. The rules are only evaluated on the 
+    distinct codes, so the cost does not depend on the number of rows.
+    
+    Parameters
+    ----------
+    codes: list, pandas Series, array
+        The transaction codes to classify.
+    rules: list
+        The (regular expression, label) pairs, e.g. FUEL_RULES or PURPOSE_RULES.
+        
+    Returns
+    -------
+    pandas Categorical
+        The label of each code, NaN for codes that match no rule.
+    '''
+    codes = pd.Categorical(codes)
+    categories = pd.Index(codes.categories.astype(str))
+    labels = list(dict.fromkeys(label for _, label in rules))
+    matches = [categories.str.fullmatch(pattern) for pattern, _ in rules]
+    label_codes = np.select(matches, [labels.index(label) for _, label in rules], default=-1)
+    # codes missing from the input (-1) stay missing
+    label_codes = np.append(label_codes, -1)
+    return pd.Categorical.from_codes(label_codes[codes.codes], labels)
+
+
+def _aggregate(indices, shape, values):
+    '''
+    Sums values into a dense array of the given shape in a single pass.
+    
+    Parameters
+    ----------
+    indices: tuple of arrays
+        Integer positions of each value along every dimension of the output.
+    shape: tuple
+        Shape of the dense output array.
+    values: array
+        Values to sum. NaNs are treated as zeros, like pandas groupby sums.
+        
+    Returns
+    -------
+    sums: numpy array
+        The summed values, zero where no value was present.
+    present: numpy array
+        Boolean mask of the cells that received at least one value.
+    '''
+    size = int(np.prod(shape))
+    flat = np.ravel_multi_index(indices, shape)
+    sums = np.bincount(flat, weights=np.nan_to_num(values), minlength=size).reshape(shape)
+    present = np.bincount(flat, minlength=size).reshape(shape) > 0
+    return sums, present
+
+
+def resolve_iso3(countries):
+    '''
+    Resolves country names to ISO-3 codes, converting each distinct name only once.
+    
+    Parameters
+    ----------
+    countries: list, pandas Series, array
+        The country names to resolve.
+        
+    Returns
+    -------
+    pandas Categorical
+        The ISO-3 code of each name, NaN for the names in UNRESOLVED_COUNTRIES 
+        and the names country_converter cannot match.
+    '''
+    # country_converter is slow to import and only needed when the data are parsed
+    import country_converter as coco
+    
+    names = pd.Categorical(countries)
+    resolvable = [name for name in names.categories if name not in UNRESOLVED_COUNTRIES]
+    converted = coco.convert(resolvable, to='ISO3', not_found=None) if resolvable else []
+    if isinstance(converted, str):
+        converted = [converted]
+    # names that are not found are returned unchanged by country_converter
+    iso3 = {name: code for name, code in zip(resolvable, converted) if code != name}
+    codes = np.array([iso3.get(name) for name in names.categories], dtype=object)
+    return pd.Categorical(codes[names.codes])
+
+
+def resolve_regions(iso3):
+    '''
+    Resolves ISO-3 codes to the regions of each grouping of REGION_GROUPINGS, converting 
+    each distinct code only once.
+    
+    Parameters
+    ----------
+    iso3: list, pandas Series, array
+        The ISO-3 codes to resolve.
+        
+    Returns
+    -------
+    dict
+        The region of each code (pandas Categorical) by grouping, NaN for missing codes 
+        and the codes country_converter cannot match.
+    '''
+    import country_converter as coco
+    
+    codes = pd.Categorical(iso3)
+    categories = list(codes.categories)
+    regions = {}
+    for grouping, classification in REGION_GROUPINGS.items():
+        converted = coco.convert(categories, src='ISO3', to=classification, not_found=None) if categories else []
+        if not isinstance(converted, list):
+            converted = [converted]
+        # codes that are not found are returned unchanged by country_converter
+        found = [value != code for code, value in zip(categories, converted)]
+        if classification == 'OECD':
+            # the classification gives the year the members joined, NaN for the other countries
+            converted = ['OECD' if pd.notna(value) else 'Non-OECD' for value in converted]
+        # the missing codes (-1) pick the trailing None
+        labels = np.array([value if ok else None for value, ok in zip(converted, found)] + [None], dtype=object)
+        regions[grouping] = pd.Categorical(labels[codes.codes], categories=sorted(set(labels) - {None}))
+    return regions
+
+
+class _Truncated(io.RawIOBase):
+    '''
+    Read-only view of the first bytes of a binary file.
+    '''
+    
+    def __init__(self, f, size):
+        self._f = f
+        self._left = size
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        n = self._f.readinto(memoryview(b)[:self._left]) if self._left > 0 else 0
+        self._left -= n
+        return n
+
+
+def _data_size(f):
+    '''
+    Returns the size in bytes of an export without the two lines of footnotes at its end, 
+    reading only the end of the file.
+    '''
+    f.seek(0, os.SEEK_END)
+    tail_start = max(0, f.tell() - 2**16)
+    f.seek(tail_start)
+    tail = f.read().rstrip()
+    f.seek(0)
+    return tail_start + len(tail.rsplit(b'\n', 2)[0]) + 1
+
+
+def _single_commodity(commodities):
+    '''
+    Returns the commodity to keep while reading an export. The data set holds a single 
+    commodity: the commodities share transaction codes, so their values would be summed.
+    '''
+    if commodities is None:
+        return COMMODITY
+    selected = list(np.atleast_1d(commodities))
+    if len(selected) != 1:
+        raise ValueError('The data set holds a single commodity, got {} '
+                         '(see commodities.CommodityData for several)'.format(selected))
+    return selected[0]
+
+
+@functools.lru_cache(maxsize=None)
+def _code_version():
+    '''
+    Returns a fingerprint of the code that builds the data set and its indexes, so that 
+    processes do not attach to shared data sets stored by another version of the code 
+    (with other or missing attributes), e.g. in a persistent /dev/shm after an upgrade.
+    '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return code_hash([os.path.join(directory, name) 
+                      for name in ['dataset.py', 'derived.py', 'forecast.py', 'snapshot.py']])
+
 
 class EnergyData:
     
-    def __init__(self, filename):
+    def __init__(self, filename, snapshot=True, chunksize=None, commodities=None, years=None):
         '''
         Initializes the "Total Electricity" data set downloaded from http://data.un.org/Data.aspx?d=EDATA&f=cmID%3aEL
         
@@ -11,47 +251,691 @@ class EnergyData:
         ----------
         filename: str
             Path to the file containing data.
+        snapshot: bool, str
+            If True, the cleaned data are cached in a binary snapshot next to the file 
+            and reloaded from it on the next start, as long as the file has not changed. 
+            A path can be passed to store the snapshot elsewhere, or False to always parse the file.
+        chunksize: int, optional
+            If given, the file is streamed in chunks of this many rows and only compact, aggregated 
+            data are kept (categorical labels, float32 quantities), so that files much larger 
+            than memory can be loaded. Implied when filtering on commodities or years.
+        commodities: str, optional
+            The commodity whose rows are loaded, COMMODITY by default, so that exports of 
+            several commodities can be loaded. Implies streaming when given.
+        years: int, list, optional
+            Only load the rows of these years, while streaming.
             
         Attributes
         ----------
         data: pandas DataFrame
+        years: numpy array
+            Sorted years in the data set.
+        transaction_codes: numpy array
+            Sorted transaction codes in the data set.
+        countries: numpy array
+            Sorted country names in the data set.
+        cube: numpy array
+            Quantities arranged as year x transaction code x country, NaN where missing.
+        world_locations: numpy array
+            Sorted ISO-3 codes of the countries that can be drawn on maps.
         
         Methods
         -------
         transform_generation_data
         transform_consumption_data
         '''
-        df = pd.read_csv(filename, dtype={
+        self._set_data(self._load(filename, snapshot, chunksize, commodities, years))
+    
+    
+    @classmethod
+    def _load(cls, filename, snapshot=True, chunksize=None, commodities=None, years=None):
+        '''
+        Returns the cleaned data set of a file, from its snapshot if there is a valid one 
+        (see the constructor for the parameters).
+        '''
+        streaming = chunksize is not None or commodities is not None or years is not None
+        if streaming:
+            commodities = _single_commodity(commodities)
+        
+        df = None
+        if snapshot:
+            path = snapshot_path(filename) if snapshot is True else snapshot
+            source_hash = file_hash(filename, cls._options(chunksize, commodities, years))
+            df = load_snapshot(path, source_hash)
+        if df is None:
+            if streaming:
+                df = cls._read_csv_chunks(filename, chunksize or 10**6, commodities, years)
+            else:
+                df = cls._read_csv(filename, commodities)
+            if snapshot:
+                try:
+                    save_snapshot(df, path, source_hash)
+                except OSError:
+                    # a read-only deployment still works, it just parses the csv on every start
+                    pass
+        return df
+    
+    
+    def _set_data(self, df):
+        '''
+        Sets the cleaned data set and builds the lookup tables derived from it.
+        '''
+        # create a map of transactions and transaction codes (first code seen for each transaction)
+        first = df.drop_duplicates('Transaction')
+        transaction_map = dict(zip(first['Transaction'], first['Transaction Code']))
+        
+        # fuel and purpose of each transaction, classified once per distinct code
+        df['Fuel'] = classify_codes(df['Transaction Code'], FUEL_RULES)
+        df['Purpose'] = classify_codes(df['Transaction Code'], PURPOSE_RULES)
+        
+        self.data = df
+        self.transaction_map = transaction_map
+        
+        self._build_cube()
+
+        
+    @staticmethod
+    def _options(chunksize=None, commodities=None, years=None):
+        '''
+        Returns the loading options that change the data set, to fingerprint snapshots with.
+        '''
+        if chunksize is None and commodities is None and years is None:
+            return None
+        return (chunksize is not None, _single_commodity(commodities), years)
+    
+    
+    @classmethod
+    def shared(cls, filename, directory, **kwargs):
+        '''
+        Loads the data set from memory shared between processes, e.g. gunicorn workers.
+        The first call for a given file (ideally in the gunicorn master, see gunicorn.conf.py) 
+        loads the data set and stores it in the directory; later calls attach to it, so the 
+        arrays are held in memory only once however many processes use them.
+        
+        Parameters
+        ----------
+        filename: str
+            Path to the file containing data.
+        directory: str
+            Directory holding the shared data sets. A directory in /dev/shm keeps them in memory.
+        kwargs:
+            Options of the constructor (snapshot, chunksize, commodities, years).
+            
+        Returns
+        -------
+        EnergyData object
+            The data set, with its arrays memory-mapped read-only.
+        '''
+        options = cls._options(kwargs.get('chunksize'), kwargs.get('commodities'), kwargs.get('years'))
+        # the state depends on the file, the loading options and the code that built it
+        path = os.path.join(directory, '%s-v%d-%s' % (file_hash(filename, options), SNAPSHOT_VERSION, 
+                                                      _code_version()))
+        if not os.path.exists(path):
+            cls(filename, **kwargs).share(path)
+        energyData = cls.attach(path)
+        # data sets stored by shared, not the temporary directories of states being written
+        prune_shared(directory, path, r'^[0-9a-f]{40}-v\d+(-[0-9a-f]+)?$')
+        return energyData
+    
+    
+    def refresh(self, filename, directory=None, **kwargs):
+        '''
+        Loads a new export of the data set (e.g. a newer download) and compares it with this one.
+        Only the data set is replaced, not this object: callers swap their reference to the 
+        returned object, so that calls in progress finish on consistent tables.
+        
+        Parameters
+        ----------
+        filename: str
+            Path to the new file.
+        directory: str, optional
+            If given, the new data set is loaded from memory shared between processes (see shared).
+        kwargs:
+            Options of the constructor (snapshot, chunksize, commodities, years).
+            
+        Returns
+        -------
+        energyData: EnergyData object
+            The new data set, or this object if no value changed.
+        delta: pandas DataFrame
+            The (country, transaction code, year) values that were added, changed or removed, 
+            with the ISO-3 code of the country.
+        '''
+        options = {key: kwargs[key] for key in ['snapshot', 'chunksize', 'commodities', 'years'] if key in kwargs}
+        df = self._load(filename, **options)
+        delta = self._delta(self.data, df)
+        if delta.empty:
+            return self, delta
+        
+        if directory is not None:
+            return self.shared(filename, directory, **kwargs), delta
+        energyData = type(self).__new__(type(self))
+        energyData._set_data(df)
+        return energyData, delta
+    
+    
+    @staticmethod
+    def _delta(old, new):
+        '''
+        Returns the (country, transaction code, year) values that differ between two data sets.
+        '''
+        keys = ['Country or Area', 'Transaction Code', 'Year']
+        
+        def values(df):
+            # plain arrays, so that categorical and object columns compare equal
+            index = pd.MultiIndex.from_arrays([np.asarray(df[key]) for key in keys], names=keys)
+            return pd.Series(np.asarray(df[QUANTITY], dtype=np.float64), index=index).groupby(level=keys).sum()
+        
+        before, after = values(old).align(values(new), join='outer')
+        # streamed data sets hold float32 quantities, so values are compared with a tolerance
+        changed = ~np.isclose(before.values, after.values, rtol=1e-6, equal_nan=True)
+        delta = before.index[changed].to_frame(index=False)
+        
+        iso3 = {}
+        for df in [old, new]:
+            first = df.drop_duplicates('Country or Area')
+            iso3.update(zip(np.asarray(first['Country or Area']), np.asarray(first['ISO-3'])))
+        delta['ISO-3'] = delta['Country or Area'].map(iso3)
+        return delta
+    
+    
+    def share(self, directory):
+        '''
+        Stores the data set in a directory for other processes to attach to (see attach).
+        '''
+        save_shared(self.__dict__, directory)
+    
+    
+    @classmethod
+    def attach(cls, directory):
+        '''
+        Attaches to a data set stored with share. Its numeric arrays are memory-mapped read-only
+        and string columns of the data are restored as categoricals.
+        '''
+        energyData = cls.__new__(cls)
+        energyData.__dict__.update(load_shared(directory))
+        return energyData
+    
+    
+    @staticmethod
+    def _read_csv(filename, commodities=None):
+        '''
+        Parses and cleans the raw csv export.
+        
+        Parameters
+        ----------
+        filename: str
+            Path to the csv file.
+        commodities: str, optional
+            The commodity whose rows are kept, COMMODITY by default (see _single_commodity).
+            
+        Returns
+        -------
+        df: pandas DataFrame
+            The cleaned data set.
+        '''
+        # the last two lines of the export are footnotes. Cutting them off here instead of 
+        # passing skipfooter=2 lets pandas use its fast C parser
+        with open(filename, 'rb') as f:
+            body = f.read(_data_size(f))
+        df = pd.read_csv(io.BytesIO(body), dtype={
                                         'Country or Area Code': np.int32,
                                         'Country or Area': 'str', 
                                         'Transaction Code': 'str', 
                                         'Commodity - Transaction': 'str',
                                         'Year': np.int32,
                                         'Quantity': np.float64,
-                                        'Quantity Footnotes': np.float64},
-                         skipfooter=2)
+                                        'Quantity Footnotes': np.float64})
         # clean up the data:
-        # substitute commodity - transaction with transaction only
+        # substitute commodity - transaction with transaction only (split once per distinct value)
         # quantity footnotes indicate estimates and we're not using them here, so will drop them as well
-        df['Transaction'] = df['Commodity - Transaction'].apply(lambda x: x.split(' - ')[-1])
-        df = df.rename(columns={'Quantity': 'Quantity (1e6 kW/h)'})
+        transactions = pd.Categorical(df['Commodity - Transaction'])
+        split = [c.split(' - ') for c in transactions.categories]
+        df['Transaction'] = np.asarray([s[-1] for s in split] + [None], dtype=object)[transactions.codes]
+        # keep a single commodity, the commodities share transaction codes
+        commodity = _single_commodity(commodities)
+        keep = np.asarray([s[0] == commodity for s in split] + [False])[transactions.codes]
+        df = df.rename(columns={'Quantity': QUANTITY})
         df.drop(columns = ['Commodity - Transaction', 'Quantity Footnotes'], 
                 inplace=True)
         
         # drop values for 2019 because incomplete
-        df = df[df['Year']!=2019]
+        df = df[keep & (df['Year']!=2019).values].reset_index(drop=True)
+        
+        # ISO-3 codes for plotting maps, and the regions of the countries
+        df['ISO-3'] = resolve_iso3(df['Country or Area'])
+        for grouping, regions in resolve_regions(df['ISO-3']).items():
+            df[grouping] = regions
+        return df
+    
+    
+    @staticmethod
+    def _read_csv_chunks(filename, chunksize, commodities=None, years=None):
+        '''
+        Streams the raw csv export in chunks and folds them into a compact data set.
+        Each chunk is filtered, its labels are encoded as integers shared by all chunks and 
+        its quantities are summed per (year, transaction code, country) in float32, so the 
+        memory used is bounded by the size of a chunk plus the aggregated data.
+        
+        Parameters
+        ----------
+        filename: str
+            Path to the csv file.
+        chunksize: int
+            Number of rows per chunk.
+        commodities: str, list, optional
+            Only keep the rows of these commodities. The values of different commodities 
+            with the same transaction code are summed, so a single commodity is expected.
+        years: int, list, optional
+            Only keep the rows of these years.
+            
+        Returns
+        -------
+        df: pandas DataFrame
+            The cleaned data set, with categorical labels and float32 quantities.
+        '''
+        labels = {'Country or Area': {}, 'Transaction Code': {}, 'Transaction': {}}
         
-        # create a map of transactions and transaction codes
-        transaction_map = {}
-        for t in df['Transaction'].unique():
-            transaction_map[t] = df['Transaction Code'][df['Transaction']==t].unique()[0]
+        def encode(categories, codes, column):
+            # integer codes of categorical values, in a dictionary shared by all chunks
+            index = labels[column]
+            shared = np.array([index.setdefault(c, len(index)) for c in categories], dtype=np.int32)
+            return shared[codes]
         
-        self.data = df
-        self.transaction_map = transaction_map
-
+        parts = []
+        with open(filename, 'rb') as f:
+            # the last two lines of the export are footnotes
+            reader = pd.read_csv(io.BufferedReader(_Truncated(f, _data_size(f))), 
+                                 chunksize=chunksize,
+                                 usecols=['Country or Area Code', 'Country or Area', 'Transaction Code', 
+                                          'Commodity - Transaction', 'Year', 'Quantity'],
+                                 dtype={'Country or Area Code': np.int16,
+                                        'Country or Area': 'category', 
+                                        'Transaction Code': 'category', 
+                                        'Commodity - Transaction': 'category',
+                                        'Year': np.int16,
+                                        'Quantity': np.float32})
+            for chunk in reader:
+                # split commodity - transaction once per distinct value
+                commodity_transaction = chunk['Commodity - Transaction'].cat
+                split = [c.split(' - ') for c in commodity_transaction.categories]
+                
+                # drop values for 2019 because incomplete
+                keep = (chunk['Year'] != 2019).values
+                if years is not None:
+                    keep &= chunk['Year'].isin(np.atleast_1d(years)).values
+                if commodities is not None:
+                    selected = np.isin([s[0] for s in split], np.atleast_1d(commodities))
+                    keep &= selected[commodity_transaction.codes]
+                chunk = chunk[keep]
+                
+                columns = {}
+                for column in ['Transaction Code', 'Country or Area']:
+                    columns[column] = encode(chunk[column].cat.categories, chunk[column].cat.codes, column)
+                columns['Transaction'] = encode([s[-1] for s in split], 
+                                                chunk['Commodity - Transaction'].cat.codes, 'Transaction')
+                part = pd.DataFrame({'Year': chunk['Year'].values,
+                                     'Transaction Code': columns['Transaction Code'],
+                                     'Country or Area': columns['Country or Area'],
+                                     'Country or Area Code': chunk['Country or Area Code'].values,
+                                     'Transaction': columns['Transaction'],
+                                     'Quantity': chunk['Quantity'].values})
+                keys = ['Year', 'Transaction Code', 'Country or Area']
+                parts.append(part.groupby(keys, as_index=False, sort=False).agg(
+                    {'Country or Area Code': 'first', 'Transaction': 'first', 'Quantity': 'sum'}))
+        
+        # fold the chunks together (a key only spans chunks if it appears in several of them)
+        df = pd.concat(parts, ignore_index=True)
+        del parts
+        df = df.groupby(keys, as_index=False, sort=True).agg(
+            {'Country or Area Code': 'first', 'Transaction': 'first', 'Quantity': 'sum'})
+        
+        for column, index in labels.items():
+            categories = np.array(list(index), dtype=object)
+            df[column] = pd.Categorical(categories[df[column].values], categories=sorted(index))
+            df[column] = df[column].cat.remove_unused_categories()
+        df['Quantity'] = df['Quantity'].astype(np.float32)
+        df = df.rename(columns={'Quantity': QUANTITY})
+        df = df[['Country or Area Code', 'Country or Area', 'Transaction Code', 'Year', QUANTITY, 'Transaction']]
+        
+        # ISO-3 codes for plotting maps, and the regions of the countries
+        df['ISO-3'] = resolve_iso3(df['Country or Area'])
+        for grouping, regions in resolve_regions(df['ISO-3']).items():
+            df[grouping] = regions
+        return df
+    
+    
+    def _build_cube(self):
+        '''
+        Pre-aggregates the data set into dense arrays indexed by the categorical codes 
+        of year, transaction and country, so that the extract methods only need 
+        integer lookups instead of filtering and grouping the full table on every call.
+        '''
+        df = self.data
+        years = pd.Categorical(df['Year'])
+        codes = pd.Categorical(df['Transaction Code'])
+        names = pd.Categorical(df['Transaction'])
+        countries = pd.Categorical(df['Country or Area'])
+        quantity = df[QUANTITY].values
+        
+        self.years = np.asarray(years.categories)
+        self.transaction_codes = np.asarray(codes.categories)
+        self.countries = np.asarray(countries.categories)
+        
+        shape = (len(self.years), len(self.transaction_codes), len(self.countries))
+        cube, present = _aggregate((years.codes, codes.codes, countries.codes), shape, quantity)
+        self.cube = np.where(present, cube, np.nan)
+        
+        self._year_index = {year: i for i, year in enumerate(self.years)}
+        self._country_index = {country: i for i, country in enumerate(self.countries)}
+        first = df.drop_duplicates('Transaction Code')
+        self._code_names = dict(zip(first['Transaction Code'], first['Transaction']))
+        # fuel and purpose of each transaction code, from the categories attached to the data at load
+        self._code_classes = {column: pd.Series(np.asarray(first[column], dtype=object), 
+                                                index=np.asarray(first['Transaction Code'], dtype=object))
+                                        .reindex(self.transaction_codes).values
+                              for column in ['Fuel', 'Purpose']}
+        
+        # year x transaction totals, both by code and by name, for each subset of transactions
+        totals, present = _aggregate((years.codes, codes.codes), shape[:2], quantity)
+        self._tables = {}
+        for subset, pattern in [('generation', GENERATION_PATTERN), 
+                                ('consumption', CONSUMPTION_PATTERN)]:
+            code_mask = pd.Index(self.transaction_codes).str.contains(pattern)
+            self._tables[subset, True] = self._make_table(self.transaction_codes[code_mask], 
+                                                          self.transaction_codes[code_mask],
+                                                          totals[:, code_mask], 
+                                                          present[:, code_mask])
+            
+            rows = code_mask[codes.codes]
+            shape_names = (len(self.years), len(names.categories))
+            totals_names, present_names = _aggregate((years.codes[rows], names.codes[rows]), 
+                                                     shape_names, quantity[rows])
+            name_mask = present_names.any(axis=0)
+            name_labels = np.asarray(names.categories)[name_mask]
+            self._tables[subset, False] = self._make_table(name_labels,
+                                                           [self.transaction_map[n] for n in name_labels],
+                                                           totals_names[:, name_mask], 
+                                                           present_names[:, name_mask])
+        
+        self._build_consumption_tree()
+        self._build_country_index()
+        self._build_world_index()
+        self._build_region_index()
+        self._build_rank_index()
+        self._build_period_index()
+    
+    
+    def _build_country_index(self):
+        '''
+        Sorts the data by country, transaction code and year once, and indexes the contiguous 
+        block of each (country, transaction code) pair, so that the history of a country is 
+        a dictionary lookup and a slice.
+        '''
+        df = self.data
+        countries = pd.Categorical(df['Country or Area'], categories=self.countries)
+        codes = pd.Categorical(df['Transaction Code'], categories=self.transaction_codes)
+        years = df['Year'].values
+        
+        order = np.lexsort((years, codes.codes, countries.codes))
+        country_codes, code_codes = countries.codes[order], codes.codes[order]
+        self._series_years = years[order]
+        self._series_values = df[QUANTITY].values[order]
+        
+        # start of each block of rows sharing a country and a transaction code
+        changes = np.r_[True, (np.diff(country_codes) != 0) | (np.diff(code_codes) != 0)]
+        starts = np.flatnonzero(changes[:len(order)])
+        stops = np.r_[starts[1:], len(order)]
+        self._series_index = {}
+        self._country_transactions = {}
+        for start, stop in zip(starts, stops):
+            country = self.countries[country_codes[start]]
+            code = self.transaction_codes[code_codes[start]]
+            self._series_index[country, code] = (start, stop)
+            self._country_transactions.setdefault(country, []).append(code)
+        
+        # clicks on maps identify countries by their ISO-3 codes
+        first = df.drop_duplicates('ISO-3').dropna(subset=['ISO-3'])
+        self._iso3_countries = dict(zip(first['ISO-3'], first['Country or Area']))
+    
+    
+    def _build_world_index(self):
+        '''
+        Packs the values of the countries that can be drawn on maps (those with an ISO-3 code) 
+        into a year x transaction code x location array, so that the values of a map are 
+        a single lookup for any year and transaction.
+        '''
+        self.world_locations = np.array(sorted(self._iso3_countries), dtype=object)
+        self._world_columns = np.array([self._country_index[self._iso3_countries[iso3]] 
+                                        for iso3 in self.world_locations], dtype=int)
+        self._world_values = self.cube[:, :, self._world_columns]
+        self._code_index = {code: i for i, code in enumerate(self.transaction_codes)}
+        # trends are fitted and derived metrics evaluated on first use, see trends and derived
+        self._trends = {}
+        self._derived = {}
+    
+    
+    def _build_region_index(self):
+        '''
+        Builds a country x region membership matrix for every grouping of REGION_GROUPINGS, 
+        so that the totals of the regions for a year and transaction are a single 
+        matrix-vector product over the values of the countries. The countries without 
+        a region (regional totals of the UN data such as 'Other Asia', former countries) 
+        belong to none, so they are not counted twice.
+        '''
+        first = self.data.drop_duplicates('Country or Area')
+        self._regions = {}
+        for grouping in REGION_GROUPINGS:
+            regions = pd.Series(np.asarray(first[grouping], dtype=object), 
+                                index=np.asarray(first['Country or Area'], dtype=object))
+            labels = pd.Categorical(regions.reindex(self.countries).values)
+            members = np.flatnonzero(labels.codes >= 0)
+            membership = np.zeros((len(self.countries), len(labels.categories)))
+            membership[members, labels.codes[members]] = 1
+            self._regions[grouping] = {'names': np.asarray(labels.categories, dtype=object),
+                                       'membership': membership,
+                                       # region of each map location, -1 for none
+                                       'locations': labels.codes[self._world_columns]}
+    
+    
+    def _build_rank_index(self):
+        '''
+        Sorts the countries by value for every year and transaction code once, so that rankings 
+        are slices of the sorted index. The changes between two years are sorted on first use 
+        of the pair of years (see top_movers). Only the countries with an ISO-3 code are ranked, 
+        not the regional totals and former countries of UNRESOLVED_COUNTRIES.
+        '''
+        # largest values first, missing values last, as indices in countries
+        order = np.argsort(-self._world_values, axis=2, kind='stable')
+        self._rank_order = self._world_columns[order].astype(np.int32)
+        self._rank_counts = (~np.isnan(self._world_values)).sum(axis=2)
+        self._mover_index = {}
+    
+    
+    def _build_period_index(self):
+        '''
+        Accumulates the values of the cube and of the consumption tree over the years once,
+        so that the total of any period of years is the difference of two cumulative sums
+        instead of a sum over the years of the period (see periods).
+        '''
+        def cumulative(values, present):
+            zeros = np.zeros((1,) + values.shape[1:])
+            return (np.concatenate([zeros, np.cumsum(np.where(present, values, 0), axis=0)]),
+                    np.concatenate([zeros.astype(np.int32), np.cumsum(present, axis=0, dtype=np.int32)]))
+        
+        tree = self._consumption_tree
+        self._cumulative = {'cube': cumulative(self.cube, ~np.isnan(self.cube)),
+                            'consumption': cumulative(tree['values'], tree['present'])}
+    
+    
+    def periods(self, years=None, resolution=1):
+        '''
+        Splits the range of years of the data set covered by some years into periods of 
+        a given length, aligned on its multiples (e.g. 2005-2009 for 5 years) and clipped 
+        to the range.
+        
+        Parameters
+        ----------
+        years: int, list
+            A year or list of years, whose range is split. Defaults to all years.
+        resolution: int
+            The length of the periods in years, e.g. one of RESOLUTIONS.
+            
+        Returns
+        -------
+        first, last: numpy array
+            The first and last year of data of each period.
+        starts, stops: numpy array
+            The positions in years of the first year of each period and after its last year.
+        '''
+        start, stop = 0, len(self.years)
+        if years is not None:
+            years = np.atleast_1d(years)
+            start = np.searchsorted(self.years, years.min(), side='left')
+            stop = np.searchsorted(self.years, years.max(), side='right')
+        buckets = self.years[start:stop] // resolution
+        starts = start + np.flatnonzero(np.r_[True, np.diff(buckets) != 0][:len(buckets)])
+        stops = np.r_[starts[1:], stop].astype(int)
+        return self.years[starts], self.years[stops - 1], starts, stops
+    
+    
+    def _period_values(self, name, years, resolution):
+        '''
+        Returns the mean yearly values of the periods covering some years (see periods), over 
+        the years with a value, from the cumulative sums of the cube or of the consumption tree, 
+        with the number of years with a value (0 where there is none).
+        '''
+        first, last, starts, stops = self.periods(years, resolution)
+        totals, counts = self._cumulative[name]
+        counts = counts[stops] - counts[starts]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (totals[stops] - totals[starts]) / counts
+        return first, last, means, counts
+    
+    
+    @staticmethod
+    def period_labels(first, last):
+        '''
+        Returns the labels of periods of years from their first and last years (see periods), 
+        e.g. 2005-2009, or 2019 for a single year.
+        '''
+        return np.array([str(a) if a == b else '{}-{}'.format(a, b) for a, b in zip(first, last)], dtype=object)
+    
+    
+    def _build_consumption_tree(self):
+        '''
+        Derives the hierarchy of the consumption codes from their prefixes (e.g. 12 -> 123 -> 1231) 
+        and precomputes the value of every node for all years. A node takes its reported value 
+        where there is one, and the sum of its children otherwise. The rollup is done for each 
+        country, then summed over the countries: a sector reported by some countries and only 
+        broken down into subsectors by others is the total of both.
+        '''
+        table = self._tables['consumption', True]
+        codes = list(table['labels'])
+        index = {code: i for i, code in enumerate(codes)}
+        
+        # the parent of a code is the longest other code it starts with
+        parent = np.full(len(codes), -1)
+        for i, code in enumerate(codes):
+            for end in range(len(code) - 1, 0, -1):
+                if code[:end] in index:
+                    parent[i] = index[code[:end]]
+                    break
+        depth = np.zeros(len(codes), dtype=int)
+        for i in range(len(codes)):
+            p = parent[i]
+            while p >= 0:
+                depth[i] += 1
+                p = parent[p]
+        
+        # year x code x country values of the consumption codes
+        reported = self.cube[:, np.searchsorted(self.transaction_codes, np.asarray(codes, dtype=object)), :]
+        present = ~np.isnan(reported)
+        values = np.zeros(reported.shape)
+        has_value = np.zeros(reported.shape, dtype=bool)
+        children_sum = np.zeros(reported.shape)
+        children_present = np.zeros(reported.shape, dtype=bool)
+        # children are deeper than their parent, so they are all done before it
+        for i in np.argsort(-depth, kind='stable'):
+            values[:, i] = np.where(present[:, i], reported[:, i], children_sum[:, i])
+            has_value[:, i] = present[:, i] | children_present[:, i]
+            if parent[i] >= 0:
+                children_sum[:, parent[i]] += np.where(has_value[:, i], values[:, i], 0)
+                children_present[:, parent[i]] |= has_value[:, i]
+        
+        names = self._code_names
+        self._consumption_tree = {'codes': table['labels'],
+                                  'names': np.array([names.get(code) for code in codes], dtype=object),
+                                  'parent': np.array([codes[p] if p >= 0 else None for p in parent], dtype=object),
+                                  'level': depth,
+                                  'values': np.where(has_value, values, 0).sum(axis=2),
+                                  'present': has_value.any(axis=2)}
+            
+            
+    def _make_table(self, labels, codes, totals, present):
+        '''
+        Bundles a year x transaction table with a lookup from transaction labels to columns
+        and the fuel and purpose of each transaction (those of its code).
+        '''
+        positions = np.searchsorted(self.transaction_codes, np.asarray(codes, dtype=object))
+        return {'labels': labels, 
+                'index': {label: i for i, label in enumerate(labels)},
+                'fuel': self._code_classes['Fuel'][positions],
+                'purpose': self._code_classes['Purpose'][positions],
+                'totals': totals, 
+                'present': present}
+    
+    
+    def _extract(self, table, years, transactions, codes, fuels=None, purposes=None, classes=False):
+        '''
+        Looks up the pre-aggregated totals for the requested years and transactions, with the 
+        fuel and purpose of the transactions if classes is True.
+        Mirrors the .loc indexing of the former groupby result: requested labels keep their 
+        order, labels missing from the data are skipped and a level is dropped when a single 
+        year (or transaction) is requested on its own.
+        '''
+        table = self._tables[table, codes]
+        key = 'Transaction Code' if codes else 'Transaction'
+        
+        if years is None:
+            year_idx = np.arange(len(self.years))
+        else:
+            year_idx = np.array([self._year_index[y] for y in np.atleast_1d(years) 
+                                 if y in self._year_index], dtype=int)
+        if transactions is None:
+            key_idx = np.arange(len(table['labels']))
+        else:
+            key_idx = np.array([table['index'][t] for t in np.atleast_1d(transactions) 
+                                if t in table['index']], dtype=int)
+        if fuels is not None:
+            key_idx = key_idx[np.isin(table['fuel'][key_idx], np.atleast_1d(fuels))]
+        if purposes is not None:
+            key_idx = key_idx[np.isin(table['purpose'][key_idx], np.atleast_1d(purposes))]
+        
+        yy, kk = np.meshgrid(year_idx, key_idx, indexing='ij')
+        if years is None and transactions is not None:
+            # all years for a list of transactions are grouped by transaction
+            yy, kk = yy.T, kk.T
+        yy, kk = yy.ravel(), kk.ravel()
+        keep = table['present'][yy, kk]
+        yy, kk = yy[keep], kk[keep]
         
+        index = pd.MultiIndex.from_arrays([self.years[yy], table['labels'][kk]], names=['Year', key])
+        df = pd.DataFrame({QUANTITY: table['totals'][yy, kk]}, index=index)
+        if classes:
+            df['Fuel'] = table['fuel'][kk]
+            df['Purpose'] = table['purpose'][kk]
         
-    def extract_generation_data(self, years=None, transactions=None, codes=False):
+        if transactions is None and years is not None and np.ndim(years) == 0:
+            return df.droplevel('Year')
+        if years is None and transactions is not None and np.ndim(transactions) == 0:
+            return df.droplevel(key)
+        return df
+        
+        
+    @timed('extract')
+    def extract_generation_data(self, years=None, transactions=None, codes=False, fuels=None, purposes=None, 
+                                classes=False):
         '''
         Extracts the data pertaining to production of electricity.
         Can be further filtered on specific years and transactions within the data set.
@@ -65,6 +949,12 @@ class EnergyData:
         codes: bool
             If True, the transactions will be filtered and indexed by their codes instead of strings.
             Use codes=True if passing codes in the transactions parameter.
+        fuels: str, list
+            A fuel or list of fuels (see FUEL_RULES) to filter the transactions on.
+        purposes: str, list
+            A purpose or list of purposes (see PURPOSE_RULES) to filter the transactions on.
+        classes: bool
+            If True, the Fuel and Purpose columns of the transactions (classified at load) are added.
             
         Returns
         -------
@@ -72,30 +962,10 @@ class EnergyData:
             Filtered data set on production data (for specified years and transactions, if provided)
         '''
         
-        if codes:
-            columns = ['Year', 'Transaction Code']
-        else:
-            columns = ['Year', 'Transaction']
-        
-        # The production data have transaction codes starting with 01.
-        # The transaction code for total production - main activity is EP
-        # The Transaction code for total production - autoproducer is SP
-        df_production = self.data[self.data['Transaction Code'].str.contains("^01.*?|EP|SP")].groupby(
-                by=columns, as_index=True).sum().drop(
-                columns=['Country or Area Code'])
-        
-        if years is not None:
-            if transactions is not None:
-                return df_production.loc[years, transactions, :]
-            else:
-                return df_production.loc[years,:, :]
-        else:
-            if transactions is not None:
-                return df_production.loc[:, transactions, :]
-            else:
-                return df_production
+        return self._extract('generation', years, transactions, codes, fuels, purposes, classes)
                 
         
+    @timed('extract')
     def extract_consumption_data(self, years=None, transactions=None, codes=False):
         '''
         Extracts the data pertaining to consumption of electricity.
@@ -117,28 +987,469 @@ class EnergyData:
             Filtered data set on consumption data (for specified years and transactions, if provided)
         '''
         
-        if codes:
-                columns = ['Year', 'Transaction Code']
+        return self._extract('consumption', years, transactions, codes)
+
+    
+    @timed('extract')
+    def extract_consumption_hierarchy(self, years=None, transactions=None, level=None, parent=None,
+                                      resolution=1):
+        '''
+        Extracts consumption data from the hierarchy of consumption codes, where every sector 
+        (e.g. 123, other consumption) is rolled up from its subsectors (1231, households, ...) 
+        when it is not reported itself.
+        
+        Parameters
+        ----------
+        years: int, list
+            A year or list of years to filter the data set on. 
+        transactions: str, list
+            A transaction code or list of transaction codes to filter the data set on.
+        level: int, list
+            A level or list of levels of the hierarchy to filter the data set on: 
+            0 for the total final consumption, 1 for sectors, 2 for subsectors, ...
+        parent: str
+            Only keep the direct children of this transaction code.
+        resolution: int
+            Length of the periods of years the consumption is aggregated to (see periods), 
+            e.g. 5 for the mean yearly consumption of 5-year periods over the range of years.
+            
+        Returns
+        -------
+        pandas.DataFrame object
+            The consumption in long format, with columns for the year, transaction code, 
+            transaction, parent code, level and quantity. With periods of several years,
+            the year is the first year of the period, and the columns Period (e.g. 2005-2009) 
+            and Years (the number of years with a value) are added.
+        '''
+        tree = self._consumption_tree
+        
+        if resolution > 1:
+            first, last, values, counts = self._period_values('consumption', years, resolution)
+            year_idx = np.arange(len(first))
+        elif years is None:
+            year_idx = np.arange(len(self.years))
+        else:
+            year_idx = np.array([self._year_index[y] for y in np.atleast_1d(years) 
+                                 if y in self._year_index], dtype=int)
+        if transactions is None:
+            node_idx = np.arange(len(tree['codes']))
         else:
-            columns = ['Year', 'Transaction']
+            index = {code: i for i, code in enumerate(tree['codes'])}
+            node_idx = np.array([index[t] for t in np.atleast_1d(transactions) if t in index], dtype=int)
+        if level is not None:
+            node_idx = node_idx[np.isin(tree['level'][node_idx], np.atleast_1d(level))]
+        if parent is not None:
+            node_idx = node_idx[tree['parent'][node_idx] == parent]
         
-        # The consumption data have transaction codes starting with 12.
-
-        df_consumption = self.data[self.data['Transaction Code'].str.contains("^12.*?")].groupby(
-                by=columns, as_index=True).sum().drop(
-                columns=['Country or Area Code'])
+        yy, nn = np.meshgrid(year_idx, node_idx, indexing='ij')
+        yy, nn = yy.ravel(), nn.ravel()
+        if resolution > 1:
+            keep = counts[yy, nn] > 0
+        else:
+            keep = tree['present'][yy, nn]
+        yy, nn = yy[keep], nn[keep]
         
-        if years is not None:
-            if transactions is not None:
-                return df_consumption.loc[years, transactions, :]
-            else:
-                return df_consumption.loc[years,:, :]
+        df = pd.DataFrame({'Year': first[yy] if resolution > 1 else self.years[yy],
+                           'Transaction Code': tree['codes'][nn],
+                           'Transaction': tree['names'][nn],
+                           'Parent': tree['parent'][nn],
+                           'Level': tree['level'][nn],
+                           QUANTITY: values[yy, nn] if resolution > 1 else tree['values'][yy, nn]})
+        if resolution > 1:
+            df.insert(1, 'Period', self.period_labels(first[yy], last[yy]))
+            df.insert(2, 'Years', counts[yy, nn])
+        return df
+    
+    
+    @timed('extract')
+    def extract_country_data(self, country, transactions=None, resolution=1, classes=False):
+        '''
+        Extracts the history of a single country.
+        
+        Parameters
+        ----------
+        country: str
+            The name or ISO-3 code of the country.
+        transactions: str, list
+            A transaction code or list of transaction codes to filter the data set on.
+        resolution: int
+            Length of the periods of years the history is aggregated to (see periods), 
+            e.g. 5 for the mean yearly values of 5-year periods.
+        classes: bool
+            If True, the Fuel and Purpose columns of the transactions (classified at load) are added.
+            
+        Returns
+        -------
+        pandas.DataFrame object
+            The data of the country in long format, with columns for the year, transaction code, 
+            transaction and quantity, sorted by transaction code and year. With periods of 
+            several years, the year is the first year of the period, and the columns Period 
+            (e.g. 2005-2009) and Years (the number of years with a value) are added.
+        '''
+        country = self._iso3_countries.get(country, country)
+        if transactions is None:
+            transactions = self._country_transactions.get(country, [])
+        if resolution > 1:
+            df = self._country_periods(country, transactions, resolution)
         else:
-            if transactions is not None:
-                return df_consumption.loc[:, transactions, :]
-            else:
-                return df_consumption
-
+            blocks = [(code, self._series_index[country, code]) for code in np.atleast_1d(transactions) 
+                      if (country, code) in self._series_index]
+            slices = [slice(start, stop) for _, (start, stop) in blocks]
+            codes = np.repeat([code for code, _ in blocks], [s.stop - s.start for s in slices])
+            names = self._code_names
+            
+            df = pd.DataFrame({'Year': np.concatenate([self._series_years[s] for s in slices] or [[]]).astype(int),
+                               'Transaction Code': codes.astype(object),
+                               'Transaction': [names.get(code) for code in codes],
+                               QUANTITY: np.concatenate([self._series_values[s] for s in slices] or [[]])})
+        if classes:
+            positions = np.searchsorted(self.transaction_codes, df['Transaction Code'].values)
+            df['Fuel'] = self._code_classes['Fuel'][positions]
+            df['Purpose'] = self._code_classes['Purpose'][positions]
+        return df
+    
+    
+    def _country_periods(self, country, transactions, resolution):
+        '''
+        Extracts the history of a country aggregated to periods of years (see extract_country_data), 
+        from the cumulative sums of the cube.
+        '''
+        first, last, values, counts = self._period_values('cube', None, resolution)
+        codes = np.array([code for code in np.atleast_1d(transactions) if code in self._code_index], dtype=object)
+        if country not in self._country_index:
+            codes = codes[:0]
+        country_idx = self._country_index.get(country, 0)
+        
+        # sorted by transaction code, then period
+        cc, pp = np.meshgrid(np.array([self._code_index[code] for code in codes], dtype=int), 
+                             np.arange(len(first)), indexing='ij')
+        cc, pp = cc.ravel(), pp.ravel()
+        keep = counts[pp, cc, country_idx] > 0
+        cc, pp = cc[keep], pp[keep]
+        names = self._code_names
+        
+        return pd.DataFrame({'Year': first[pp].astype(int),
+                             'Period': self.period_labels(first[pp], last[pp]),
+                             'Years': counts[pp, cc, country_idx],
+                             'Transaction Code': self.transaction_codes[cc].astype(object),
+                             'Transaction': [names.get(code) for code in self.transaction_codes[cc]],
+                             QUANTITY: values[pp, cc, country_idx]})
+    
+    
+    @timed('extract')
+    def extract_world_values(self, year, transaction):
+        '''
+        Extracts the values of all countries for a year and a transaction, e.g. to color a map.
+        
+        Parameters
+        ----------
+        year: int
+            The year to extract.
+        transaction: str
+            The transaction code to extract.
+            
+        Returns
+        -------
+        numpy array
+            The value of each country in world_locations (ISO-3 codes), NaN where missing.
+        '''
+        year_idx = self._year_index.get(year)
+        code_idx = self._code_index.get(transaction)
+        if year_idx is None or code_idx is None:
+            return np.full(len(self.world_locations), np.nan)
+        return self._world_values[year_idx, code_idx]
+    
+    
+    @timed('extract')
+    def extract_region_values(self, year, transaction, grouping):
+        '''
+        Extracts the totals of the regions of a grouping for a year and a transaction.
+        
+        Parameters
+        ----------
+        year: int
+            The year to extract.
+        transaction: str
+            The transaction code to extract.
+        grouping: str
+            One of REGION_GROUPINGS, e.g. 'Continent'.
+            
+        Returns
+        -------
+        pandas.DataFrame object
+            The region, number of its countries with a value, and total quantity of each region 
+            that has at least one value, sorted by region.
+        '''
+        if grouping not in self._regions:
+            raise ValueError('Unknown grouping {}, expected one of {}'.format(grouping, list(REGION_GROUPINGS)))
+        region = self._regions[grouping]
+        year_idx = self._year_index.get(year)
+        code_idx = self._code_index.get(transaction)
+        if year_idx is None or code_idx is None:
+            values = np.full(len(self.countries), np.nan)
+        else:
+            values = self.cube[year_idx, code_idx]
+        present = ~np.isnan(values)
+        totals = np.where(present, values, 0) @ region['membership']
+        counts = present @ region['membership']
+        keep = counts > 0
+        return pd.DataFrame({'Region': region['names'][keep],
+                             'Countries': counts[keep].astype(int),
+                             QUANTITY: totals[keep]})
+    
+    
+    def region_locations(self, grouping):
+        '''
+        Returns the region of each map location (see world_locations) in a grouping 
+        of REGION_GROUPINGS, None for the locations without a region.
+        '''
+        region = self._regions[grouping]
+        return np.append(region['names'], None)[region['locations']]
+    
+    
+    def derived(self, expression):
+        '''
+        Evaluates a derived metric (e.g. net imports, or the share of a fuel in production) on 
+        the year x country values of the transactions, as whole-array operations. The result 
+        is computed once per expression and cached.
+        
+        Parameters
+        ----------
+        expression: str
+            An expression over transaction codes, see derived.parse (e.g. "'03' - '04'").
+            
+        Returns
+        -------
+        numpy array
+            The year x country (years, countries) values of the metric, NaN where missing.
+        '''
+        tree, codes = parse(expression)
+        # expressions that only differ in their formatting share an entry
+        key = ast.dump(tree)
+        if key not in self._derived:
+            unknown = [code for code in codes if code not in self._code_index]
+            if unknown:
+                raise ValueError('Unknown transaction codes {} in {!r}'.format(unknown, expression))
+            self._derived[key] = evaluate(tree, lambda code: self.cube[:, self._code_index[code], :])
+        return self._derived[key]
+    
+    
+    @timed('extract')
+    def extract_world_metric(self, year, expression):
+        '''
+        Extracts the values of a derived metric (see derived) of all countries for a year.
+        
+        Returns
+        -------
+        numpy array
+            The value of each country in world_locations (ISO-3 codes), NaN where missing.
+        '''
+        values = self.derived(expression)
+        year_idx = self._year_index.get(year)
+        if year_idx is None:
+            return np.full(len(self.world_locations), np.nan)
+        return values[year_idx, self._world_columns]
+    
+    
+    def _ranking(self, idx, values, extra):
+        '''
+        Builds a ranking frame from sorted country indices and their values.
+        '''
+        iso3 = {country: code for code, country in self._iso3_countries.items()}
+        countries = self.countries[idx]
+        df = pd.DataFrame({'Rank': np.arange(1, len(idx) + 1),
+                           'Country or Area': countries,
+                           'ISO-3': [iso3.get(country) for country in countries]})
+        for column, value in extra.items():
+            df[column] = value
+        df[QUANTITY] = values
+        return df
+    
+    
+    @timed('extract')
+    def top_n(self, year, transaction, n=10):
+        '''
+        Returns the countries with the largest values of a transaction in a year, 
+        from the sorted index (no sorting per call).
+        
+        Parameters
+        ----------
+        year: int
+            The year to rank.
+        transaction: str
+            The transaction code to rank.
+        n: int
+            Number of countries returned.
+            
+        Returns
+        -------
+        pandas.DataFrame object
+            The rank, country, ISO-3 code and value of the (up to) n first countries.
+        '''
+        year_idx = self._year_index.get(year)
+        code_idx = self._code_index.get(transaction)
+        if year_idx is None or code_idx is None:
+            return self._ranking(np.array([], dtype=int), [], {})
+        
+        count = min(n, self._rank_counts[year_idx, code_idx])
+        idx = self._rank_order[year_idx, code_idx, :count]
+        return self._ranking(idx, self.cube[year_idx, code_idx, idx], {})
+    
+    
+    @timed('extract')
+    def top_movers(self, transaction, start, end, n=10, largest=True):
+        '''
+        Returns the countries whose value of a transaction changed the most between two years. 
+        The changes of all transactions between the two years are sorted once, on the first 
+        call for the pair of years, and later calls are slices of that index.
+        
+        Parameters
+        ----------
+        transaction: str
+            The transaction code to rank.
+        start, end: int
+            The years to compare.
+        n: int
+            Number of countries returned.
+        largest: bool
+            If True, the largest rises come first, else the largest falls.
+            
+        Returns
+        -------
+        pandas.DataFrame object
+            The rank, country, ISO-3 code, values in both years and change (in the quantity 
+            column) of the (up to) n first countries that have a value in both years.
+        '''
+        start_idx, end_idx = self._year_index.get(start), self._year_index.get(end)
+        code_idx = self._code_index.get(transaction)
+        if start_idx is None or end_idx is None or code_idx is None:
+            return self._ranking(np.array([], dtype=int), [], {start: [], end: []})
+        
+        key = (start_idx, end_idx)
+        if key not in self._mover_index:
+            # countries with an ISO-3 code only, as for top_n
+            delta = self._world_values[end_idx] - self._world_values[start_idx]
+            order = np.argsort(-delta, axis=1, kind='stable')
+            self._mover_index[key] = (self._world_columns[order].astype(np.int32), 
+                                      (~np.isnan(delta)).sum(axis=1))
+        order, counts = self._mover_index[key]
+        
+        count = counts[code_idx]
+        idx = order[code_idx, :count]
+        if not largest:
+            idx = idx[::-1]
+        idx = idx[:n]
+        before, after = self.cube[start_idx, code_idx, idx], self.cube[end_idx, code_idx, idx]
+        return self._ranking(idx, after - before, {start: before, end: after})
+    
+    
+    def trends(self, method='linear', min_points=5):
+        '''
+        Fits the trend of every (transaction code, country) series over all years in one pass 
+        (see forecast.fit_trends). The trends are fitted once per method and cached.
+        
+        Parameters
+        ----------
+        method: str
+            'linear' or 'log-linear' (constant rate of change).
+        min_points: int
+            Series with fewer years of data get no trend.
+            
+        Returns
+        -------
+        dict
+            The coefficients of forecast.fit_trends as transaction code x country arrays, plus 
+            the last year with a value of each series ('last_year', 0 if none) and that value 
+            ('last_value').
+        '''
+        key = (method, min_points)
+        if key not in self._trends:
+            shape = self.cube.shape[1:]
+            trends = fit_trends(self.years, self.cube.reshape(len(self.years), -1), method, min_points)
+            trends = {name: value.reshape(shape) if isinstance(value, np.ndarray) else value 
+                      for name, value in trends.items()}
+            
+            present = ~np.isnan(self.cube)
+            last = len(self.years) - 1 - np.argmax(present[::-1], axis=0)
+            has_value = present.any(axis=0)
+            trends['last_year'] = np.where(has_value, self.years[last], 0)
+            trends['last_value'] = np.where(has_value, np.take_along_axis(self.cube, last[None], axis=0)[0], np.nan)
+            self._trends[key] = trends
+        return self._trends[key]
+    
+    
+    @timed('extract')
+    def forecast(self, transaction, year, method='linear', min_points=5):
+        '''
+        Projects the trend of every country for a transaction to a year.
+        
+        Parameters
+        ----------
+        transaction: str
+            The transaction code to project.
+        year: int
+            The year to project to.
+        method: str
+            'linear' or 'log-linear' (see trends).
+        min_points: int
+            Countries with fewer years of data are left out.
+            
+        Returns
+        -------
+        pandas.DataFrame object
+            One row per country with a trend and an ISO-3 code: its ISO-3 code, last year with data 
+            and value in that year, the projected value and the relative change between the two.
+        '''
+        columns = ['Country or Area', 'ISO-3', 'Last year', 'Last value', 'Projected', 'Change']
+        code_idx = self._code_index.get(transaction)
+        if code_idx is None:
+            return pd.DataFrame(columns=columns)
+        
+        trends = self.trends(method, min_points)
+        series = {name: value[code_idx] if isinstance(value, np.ndarray) else value 
+                  for name, value in trends.items()}
+        # quantities of electricity cannot be negative, unlike a falling straight line
+        projected = np.maximum(predict(series, year), 0)
+        # regional totals and former countries (without ISO-3 code) are left out
+        keep = np.zeros(len(self.countries), dtype=bool)
+        keep[self._world_columns] = True
+        keep &= ~np.isnan(projected)
+        last_value = series['last_value'][keep]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = np.where(last_value != 0, (projected[keep] - last_value) / np.abs(last_value), np.nan)
+        
+        iso3 = {country: code for code, country in self._iso3_countries.items()}
+        countries = self.countries[keep]
+        return pd.DataFrame({'Country or Area': countries,
+                             'ISO-3': [iso3.get(country) for country in countries],
+                             'Last year': series['last_year'][keep],
+                             'Last value': last_value,
+                             'Projected': projected[keep],
+                             'Change': change}, columns=columns)
+    
+    
+    def memory_usage(self):
+        '''
+        Returns the memory held by the data set, by attribute.
+        
+        Returns
+        -------
+        dict
+            The size in bytes of each attribute holding arrays or data frames (including 
+            the arrays nested in dictionaries). Memory-mapped arrays count at their full size.
+        '''
+        def size(value):
+            if isinstance(value, np.ndarray):
+                return value.nbytes
+            if isinstance(value, pd.DataFrame):
+                return int(value.memory_usage(index=True, deep=True).sum())
+            if isinstance(value, dict):
+                return sum(size(item) for item in value.values())
+            return 0
+        
+        sizes = {name: size(value) for name, value in self.__dict__.items()}
+        return {name: n for name, n in sizes.items() if n > 0}
+    
     
     @staticmethod
     def map_code_to_fuel(codes):
@@ -155,31 +1466,8 @@ class EnergyData:
         fuel_map: dict
             A mapping between the codes and fuels.
         '''
-        
-        fuel_map = {}
-        for code in codes:
-            if code in ['EP', 'SP']:
-                fuel_map[code] = 'Total'
-            elif code == '01':
-                fuel_map[code] = 'Gross'
-            elif code == '019':
-                fuel_map[code] = 'Net'
-            elif code[-1] == 'C':
-                fuel_map[code] = 'Combustible Fuels'
-            elif code[-1] == 'S':
-                fuel_map[code] = 'Solar'
-            elif code[-1] == 'N':
-                fuel_map[code] = 'Nuclear'
-            elif code[-1] == 'H':
-                fuel_map[code] = 'Chemical Heat'
-            elif code[-1] == 'W':
-                fuel_map[code] = 'Wind'
-            elif code[-1] == 'Y':
-                fuel_map[code] = 'Hydro'
-            else:
-                fuel_map[code] = 'Other'
-                
-        return fuel_map
+        codes = pd.unique(pd.Series(codes, dtype=object))
+        return dict(zip(codes, classify_codes(codes, FUEL_RULES)))
             
     
     @staticmethod
@@ -198,13 +1486,5 @@ class EnergyData:
         purpose_map: dict
             A mapping between the codes and purposes (main activity vs autoproducer).
         '''
-        purpose_map = {}
-        for code in codes:
-            if code[1:3] == '15' or code == 'EP':
-                purpose_map[code] = 'Main activity'
-            elif code[1:3] == '16' or code == 'SP':
-                purpose_map[code] = 'Autoproducer'
-            else:
-                purpose_map[code] = 'Other'
-                
-        return purpose_map
\ No newline at end of file
+        codes = pd.unique(pd.Series(codes, dtype=object))
+        return dict(zip(codes, classify_codes(codes, PURPOSE_RULES)))
@@ -0,0 +1,77 @@
+import ast
+import numpy as np
+
+# Metrics derived from the transactions, as expressions over transaction codes (see parse)
+METRICS = {'Net imports': "'03' - '04'",
+           'Imports / gross production (%)': "100 * '03' / '01'",
+           'Self-sufficiency: net production / final consumption (%)': "100 * '019' / '12'",
+           'Share of combustible fuels in main activity production (%)': "100 * '015C' / 'EP'",
+           'Share of hydro in main activity production (%)': "100 * '015HY' / 'EP'",
+           'Share of nuclear in main activity production (%)': "100 * '015N' / 'EP'",
+           'Losses / gross production (%)': "100 * '07' / '01'"}
+
+_OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+
+
+def parse(expression):
+    '''
+    Parses the expression of a derived metric: transaction codes (as quoted strings, e.g. '03'),
+    numbers, the operators + - * / and parentheses, e.g. "100 * '03' / '01'".
+
+    Parameters
+    ----------
+    expression: str
+        The expression to parse.
+
+    Returns
+    -------
+    tree: ast.Expression object
+        The parsed expression.
+    codes: list
+        The transaction codes the expression uses.
+    '''
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as error:
+        raise ValueError('Invalid expression {!r}: {}'.format(expression, error.msg))
+
+    codes = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            codes.append(node.value)
+        elif isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            continue
+        elif not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.USub, ast.UAdd) +
+                                  tuple(_OPERATORS)):
+            raise ValueError('Invalid expression {!r}: {} is not supported'.format(
+                expression, type(node).__name__))
+    return tree, list(dict.fromkeys(codes))
+
+
+def evaluate(tree, values):
+    '''
+    Evaluates a parsed expression on whole arrays.
+
+    Parameters
+    ----------
+    tree: ast.Expression object
+        The expression, parsed with parse.
+    values: callable
+        Returns the array of values of a transaction code.
+
+    Returns
+    -------
+    numpy array
+        The values of the expression, NaN where an operand is missing or for divisions by zero.
+    '''
+    def visit(node):
+        if isinstance(node, ast.Constant):
+            return values(node.value) if isinstance(node.value, str) else node.value
+        if isinstance(node, ast.UnaryOp):
+            operand = visit(node.operand)
+            return -operand if isinstance(node.op, ast.USub) else operand
+        return _OPERATORS[type(node.op)](visit(node.left), visit(node.right))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.asarray(visit(tree.body), dtype=np.float64)
+    return np.where(np.isfinite(result), result, np.nan)
@@ -0,0 +1,70 @@
+import numpy as np
+
+# Trends that can be fitted: a straight line, or an exponential (a straight line on the logarithm)
+METHODS = ['linear', 'log-linear']
+
+
+def fit_trends(x, values, method='linear', min_points=3):
+    '''
+    Fits a trend to many series at once by least squares, with closed-form sums over
+    the year axis instead of a loop over the series. Missing values are left out of the fit
+    of their series.
+
+    Parameters
+    ----------
+    x: list, numpy array
+        The years, of length n.
+    values: numpy array
+        The series as the columns of an n x m array, NaN where missing.
+    method: str
+        'linear' fits value = a + b * year; 'log-linear' fits log(value) = a + b * year,
+        i.e. a constant rate of change, leaving out values that are not positive.
+    min_points: int
+        Series with fewer values than this get no trend (NaN coefficients).
+
+    Returns
+    -------
+    dict
+        The coefficients of the series: 'slope' and 'intercept' (at year 'origin'),
+        'points' (number of values fitted), and the 'method'.
+    '''
+    if method not in METHODS:
+        raise ValueError('Unknown trend method {}, expected one of {}'.format(method, METHODS))
+
+    y = np.asarray(values, dtype=np.float64)
+    if method == 'log-linear':
+        positive = y > 0
+        y = np.where(positive, np.log(np.where(positive, y, 1)), np.nan)
+    mask = ~np.isnan(y)
+
+    # years are centered, which keeps the sums well conditioned
+    x = np.asarray(x, dtype=np.float64)
+    origin = x.mean() if len(x) else 0.0
+    xc = np.where(mask, (x - origin)[:, None], 0)
+    yc = np.where(mask, y, 0)
+
+    n = mask.sum(axis=0)
+    sx, sy = xc.sum(axis=0), yc.sum(axis=0)
+    sxx, sxy = (xc * xc).sum(axis=0), (xc * yc).sum(axis=0)
+    denominator = n * sxx - sx * sx
+    valid = (n >= max(min_points, 2)) & (denominator > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(valid, (n * sxy - sx * sy) / denominator, np.nan)
+        intercept = np.where(valid, (sy - slope * sx) / n, np.nan)
+    return {'slope': slope, 'intercept': intercept, 'origin': origin, 'points': n, 'method': method}
+
+
+def predict(trends, year):
+    '''
+    Evaluates fitted trends (see fit_trends) at a year.
+
+    Returns
+    -------
+    numpy array
+        The value of each series' trend at the year, NaN for the series without a trend.
+    '''
+    value = trends['intercept'] + trends['slope'] * (year - trends['origin'])
+    if trends['method'] == 'log-linear':
+        return np.exp(value)
+    return value
@@ -0,0 +1,167 @@
+import concurrent.futures
+import threading
+import time
+
+from . import metrics
+from .cache import FigureCache
+
+
+def placeholder(text='Rendering...'):
+    '''
+    Returns an empty figure showing a message, displayed while the figures of a job are rendered.
+    '''
+    return {'data': [],
+            'layout': {'xaxis': {'visible': False}, 'yaxis': {'visible': False},
+                       'annotations': [{'text': text, 'showarrow': False, 'font': {'size': 16},
+                                        'xref': 'paper', 'yref': 'paper', 'x': 0.5, 'y': 0.5}]}}
+
+
+@metrics.timed('wait')
+def _result(future, timeout):
+    '''
+    Returns the result of a job, or None if it is not done within the timeout.
+    '''
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        return None
+
+
+class JobExecutor:
+
+    def __init__(self, figure_cache, max_workers=2, wait=0.5, claim_timeout=120):
+        '''
+        Renders the figures of memoized callbacks in background threads, so that a slow
+        render does not hold the request (and the worker serving it): callbacks wait for
+        their figures for a short time, then return a placeholder and poll for the result.
+        Identical jobs share one computation: within a process through the running jobs,
+        and between processes sharing the on-disk figure cache through claims on the entries.
+
+        Parameters
+        ----------
+        figure_cache: cache.FigureCache object
+            The cache the rendering functions are memoized with, which holds the results.
+        max_workers: int
+            Number of jobs rendered at the same time.
+        wait: float
+            Time a request waits for its job before returning a placeholder, in s.
+        claim_timeout: float
+            Time after which the claim of another process on an entry is considered
+            abandoned (e.g. the process was killed), in s.
+
+        Attributes
+        ----------
+        submitted: int
+            Number of jobs started.
+        deduplicated: int
+            Number of requests that joined a job already running.
+        '''
+        self.figure_cache = figure_cache
+        self.wait = wait
+        self.claim_timeout = claim_timeout
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='figure-job')
+        self._running = {}
+        # jobs that failed after the requests waiting for them returned, until their error is 
+        # reported to the next request for the same inputs
+        self._failed = {}
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.deduplicated = 0
+
+
+    def _render(self, func, args, key):
+        '''
+        Renders the figures of a job (runs in a pool thread). If another process claimed the
+        entry, its result is waited for rather than computed again.
+        '''
+        claimed = self.figure_cache.claim(key, self.claim_timeout)
+        try:
+            while not claimed and not self.figure_cache.contains(key):
+                time.sleep(0.1)
+                claimed = self.figure_cache.claim(key, self.claim_timeout)
+            # the stages of the render are timed under the name of the rendering function
+            return metrics.instrument(func)(*args)
+        finally:
+            if claimed:
+                self.figure_cache.release(key)
+
+
+    def submit(self, func, args):
+        '''
+        Starts rendering the figures of a memoized function for some inputs, unless
+        the same job is already running.
+
+        Returns
+        -------
+        concurrent.futures.Future object
+            The future result of the job.
+        '''
+        key = FigureCache.key(func, args)
+        with self._lock:
+            future = self._running.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                return future
+            future = self._pool.submit(self._render, func, args, key)
+            self._running[key] = future
+            self.submitted += 1
+
+        def done(future):
+            with self._lock:
+                if self._running.get(key) is future:
+                    del self._running[key]
+                    if future.exception() is not None and not getattr(future, '_reported', False):
+                        self._failed[key] = future
+
+        future.add_done_callback(done)
+        return future
+
+
+    def run(self, func, args, wait=None):
+        '''
+        Returns the figures of a memoized function for some inputs, rendering them in
+        the background if they are not cached.
+
+        Parameters
+        ----------
+        func: callable
+            A function decorated with FigureCache.memoize.
+        args: tuple
+            The inputs of the function.
+        wait: float, optional
+            Time to wait for the figures, in s. Defaults to the wait of the executor.
+
+        Returns
+        -------
+        figures or None
+            The figures returned by the function, or None if they are still being rendered.
+            Errors of the function are raised, also to the next request for the same inputs 
+            if the job failed after the request returned.
+        '''
+        key = FigureCache.key(func, args)
+        if self.figure_cache.contains(key):
+            return func(*args)
+        with self._lock:
+            future = self._failed.pop(key, None)
+        if future is None:
+            future = self.submit(func, tuple(args))
+        try:
+            return _result(future, self.wait if wait is None else wait)
+        except Exception:
+            with self._lock:
+                # the error is reported to this request, the next one renders the figures again
+                future._reported = True
+                if self._failed.get(key) is future:
+                    del self._failed[key]
+            raise
+
+
+    def stats(self):
+        '''
+        Returns the job counters and the number of jobs running or queued.
+        '''
+        with self._lock:
+            return {'submitted': self.submitted,
+                    'deduplicated': self.deduplicated,
+                    'running': len(self._running)}
@@ -0,0 +1,284 @@
+import bisect
+import collections
+import contextlib
+import cProfile
+import functools
+import os
+import re
+import resource
+import threading
+import time
+
+# Upper bounds of the buckets of the latency histograms, in s
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Number of recent timings the quantiles are computed on
+WINDOW = 1024
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+class _Timings:
+    '''
+    Histogram of the timings of one stage of one callback, plus a window of the recent ones.
+    '''
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = collections.deque(maxlen=WINDOW)
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        if i < len(BUCKETS):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+
+# duration of the phases of the start of the process, in order
+_startup = collections.OrderedDict()
+_start = time.perf_counter()
+
+# timings of the stages, by (callback, stage), and of the requests, by path
+_timings = collections.defaultdict(_Timings)
+_requests = collections.defaultdict(_Timings)
+_lock = threading.Lock()
+# the callback being run and the stages being timed, per thread
+_local = threading.local()
+
+
+def observe(callback, stage, seconds):
+    '''
+    Records the time spent in a stage of a callback.
+    '''
+    with _lock:
+        _timings[callback, stage].observe(seconds)
+
+
+def timed(stage):
+    '''
+    Decorator timing a function as a stage of the callback it runs in (see instrument).
+    Stages can be nested: the time of a stage excludes the time of the stages it calls,
+    so that the stages of a callback add up to its total time. Calls outside of
+    a callback are not recorded.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            callback = getattr(_local, 'callback', None)
+            if callback is None:
+                return func(*args, **kwargs)
+
+            _local.nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = _local.nested.pop()
+                _local.nested[-1] += elapsed
+                observe(callback, stage, elapsed - nested)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument(func):
+    '''
+    Decorator timing a Dash callback: its total time and, through the timed stages it runs,
+    where the time goes. The time not spent in any stage is recorded as the 'other' stage.
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _local.callback = func.__name__
+        _local.nested = [0.0]
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            observe(func.__name__, 'other', elapsed - _local.nested.pop())
+            observe(func.__name__, 'total', elapsed)
+            _local.callback = None
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def startup_phase(name):
+    '''
+    Context manager timing a phase of the start of the process (e.g. imports, data loading), 
+    for the startup report and the metrics.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _startup[name] = _startup.get(name, 0.0) + time.perf_counter() - start
+
+
+def startup_report():
+    '''
+    Returns a one-line summary of the durations of the startup phases, and of the time since 
+    this module was imported (which happens first, so it is the total startup time).
+    '''
+    with _lock:
+        phases = ', '.join('%s %.2f s' % item for item in _startup.items())
+    return 'Startup: %s (total %.2f s)' % (phases, time.perf_counter() - _start)
+
+
+def _labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels.items())
+
+
+def format_metric(name, kind, description, samples):
+    '''
+    Formats a metric in the Prometheus text format.
+
+    Parameters
+    ----------
+    name: str
+        Name of the metric.
+    kind: str
+        Type of the metric: counter, gauge, histogram or summary.
+    description: str
+        Help text of the metric.
+    samples: list
+        (suffix, labels, value) tuples, where the suffix is appended to the name (e.g. '_bucket')
+        and labels is a dict.
+
+    Returns
+    -------
+    str
+    '''
+    lines = ['# HELP %s %s' % (name, description), '# TYPE %s %s' % (name, kind)]
+    for suffix, labels, value in samples:
+        lines.append('%s%s%s %s' % (name, suffix, _labels(labels) if labels else '', repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+
+def _samples(timings, names):
+    '''
+    Returns the samples of a histogram and of a summary of the timings, labelled by their keys.
+    '''
+    with _lock:
+        items = [(key, list(t.counts), t.count, t.sum, sorted(t.recent)) for key, t in sorted(timings.items())]
+    histogram, summary = [], []
+    for key, counts, count, total, recent in items:
+        labels = dict(zip(names, key))
+        cumulative = 0
+        for bound, n in zip(BUCKETS, counts):
+            cumulative += n
+            histogram.append(('_bucket', dict(labels, le=repr(float(bound))), cumulative))
+        histogram += [('_bucket', dict(labels, le='+Inf'), count),
+                      ('_sum', labels, total),
+                      ('_count', labels, count)]
+        for q in QUANTILES:
+            summary.append(('', dict(labels, quantile=repr(q)), recent[min(len(recent) - 1, int(q * len(recent)))]))
+        summary += [('_sum', labels, sum(recent)), ('_count', labels, len(recent))]
+    return histogram, summary
+
+
+def render():
+    '''
+    Returns the timings of the callback stages and of the requests in the Prometheus text format: 
+    histograms since the start of the process, and quantiles of the recent timings.
+    '''
+    stage_histogram, stage_summary = _samples(_timings, ['callback', 'stage'])
+    request_histogram, request_summary = _samples(_requests, ['path'])
+    return (format_metric('dashboard_stage_seconds', 'histogram',
+                          'Time spent in each stage of the callbacks, excluding nested stages.', 
+                          stage_histogram) +
+            format_metric('dashboard_stage_recent_seconds', 'summary',
+                          'Quantiles of the last %d timings of each stage of the callbacks.' % WINDOW, 
+                          stage_summary) +
+            format_metric('dashboard_request_seconds', 'histogram',
+                          'Time spent serving the requests, including the serialization of the responses.', 
+                          request_histogram) +
+            format_metric('dashboard_request_recent_seconds', 'summary',
+                          'Quantiles of the last %d timings of the requests.' % WINDOW, 
+                          request_summary) +
+            format_metric('dashboard_startup_seconds', 'gauge',
+                          'Duration of the phases of the start of the process.',
+                          [('', {'phase': name}, seconds) for name, seconds in list(_startup.items())]) +
+            format_metric('process_max_resident_memory_bytes', 'gauge',
+                          'Peak resident memory of the process.',
+                          [('', {}, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)]))
+
+
+def serve(server, collect=None, path='/metrics'):
+    '''
+    Adds an endpoint serving the metrics in the Prometheus text format to a Flask server.
+    Every process (e.g. gunicorn worker) serves its own metrics.
+
+    Parameters
+    ----------
+    server: flask.Flask object
+        The server of the Dash app.
+    collect: callable, optional
+        Returns additional metrics, formatted with format_metric.
+    path: str
+        URL of the endpoint.
+    '''
+    import flask
+
+    def metrics():
+        text = render() + (collect() if collect is not None else '')
+        return flask.Response(text, mimetype='text/plain; version=0.0.4')
+
+    @server.before_request
+    def start_timer():
+        flask.g.request_start = time.perf_counter()
+
+    @server.teardown_request
+    def stop_timer(exception=None):
+        start = flask.g.pop('request_start', None)
+        if start is not None and flask.request.path != path:
+            elapsed = time.perf_counter() - start
+            # requests are labelled by route, not by raw path, so that the number of series is 
+            # bounded (e.g. probes of random paths all count as unmatched)
+            rule = flask.request.url_rule
+            with _lock:
+                _requests[rule.rule if rule is not None else 'unmatched', ].observe(elapsed)
+
+    server.add_url_rule(path, 'metrics', metrics)
+
+
+def profile_requests(server, directory):
+    '''
+    Profiles every request to a Flask server with cProfile and dumps the statistics
+    to a file per request in a directory (named after the time, the path and, for Dash
+    callbacks, the updated outputs). The files can be read with pstats or snakeviz.
+    Profiling slows requests down, so it is only meant for debugging sessions.
+    '''
+    import flask
+
+    os.makedirs(directory, exist_ok=True)
+
+    @server.before_request
+    def start_profile():
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another request of this process is being profiled
+            return
+        flask.g.profile = profile
+
+    @server.teardown_request
+    def dump_profile(exception=None):
+        profile = flask.g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        name = flask.request.path
+        if flask.request.is_json:
+            name += '-' + str((flask.request.get_json(silent=True) or {}).get('output', ''))
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_')[:100] or 'index'
+        profile.dump_stats(os.path.join(directory, '%.6f-%s-%d.prof' % (time.time(), name, os.getpid())))
@@ -0,0 +1,53 @@
+import os
+
+# Settings of the dashboard, read from environment variables.
+
+# csv export of the "Total Electricity" table
+DATA_FILE = os.environ.get('DATA_FILE', 'static/UNdata_Export_20211018_063214641.csv')
+
+# options of the loading of the export: set DATA_CHUNKSIZE (rows) to stream it in chunks, e.g. an 
+# export of several commodities or too large to load at once (see dataset.EnergyData), optionally 
+# keeping only DATA_COMMODITY (Electricity by default) and DATA_YEARS (separated by ',')
+DATA_OPTIONS = {}
+if os.environ.get('DATA_CHUNKSIZE'):
+    DATA_OPTIONS['chunksize'] = int(os.environ['DATA_CHUNKSIZE'])
+if os.environ.get('DATA_COMMODITY'):
+    DATA_OPTIONS['commodities'] = os.environ['DATA_COMMODITY']
+if os.environ.get('DATA_YEARS'):
+    DATA_OPTIONS['years'] = [int(year) for year in os.environ['DATA_YEARS'].split(',')]
+
+# csv exports of the commodities of the commodity explorer (e.g. coal, natural gas, oil tables), 
+# separated by the path separator (':'). If unset, the export of the other panels is used 
+# (DATA_FILE or the latest export of DATA_DIR), and refreshed with them
+COMMODITY_FILES = [path for path in os.environ.get('COMMODITY_FILES', '').split(os.pathsep) if path]
+
+# directory watched for new exports (UNdata_Export_*.csv), if set the latest one is loaded
+# instead of DATA_FILE and the data are refreshed without restarting when a newer one appears
+DATA_DIR = os.environ.get('DATA_DIR')
+
+# time between two checks of DATA_DIR for new exports, in s
+RELOAD_INTERVAL = float(os.environ.get('RELOAD_INTERVAL', 60))
+
+# directory of the data set shared by the gunicorn workers (e.g. /dev/shm/energy-dash),
+# if unset every worker loads its own copy
+SHARED_DATA_DIR = os.environ.get('SHARED_DATA_DIR')
+
+# directory of the figure cache shared by the gunicorn workers, if unset every worker
+# only caches figures in memory
+FIGURE_CACHE_DIR = os.environ.get('FIGURE_CACHE_DIR')
+
+# number of figures rendered at the same time in the background by each process
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+
+# time a request waits for its figures before the page shows a placeholder and polls, in s
+JOB_WAIT = float(os.environ.get('JOB_WAIT', 0.5))
+
+# maximum number of points of a history figure (consumption, country drilldown), longer 
+# histories are drawn per 5 or 10-year periods
+POINT_BUDGET = int(os.environ.get('POINT_BUDGET', 200))
+
+# pre-render the production figures for all years in the background at start
+WARM_UP = bool(os.environ.get('WARM_UP'))
+
+# directory the requests are profiled to (one cProfile file per request), for debugging only
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
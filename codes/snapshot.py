@@ -0,0 +1,300 @@
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# Bump whenever the cleaning of the raw data changes, so that stale snapshots are rebuilt.
+SNAPSHOT_VERSION = 4
+
+
+# SHA-1 of the content of the files hashed by this process, by path, with the size and 
+# modification time they had, so that a file is only read again once it has changed
+_content_hashes = {}
+
+
+def file_hash(filename, options=None):
+    '''
+    Computes the fingerprint used to tie a snapshot to its source file.
+
+    Parameters
+    ----------
+    filename: str
+        Path to the source file. It is read in blocks, so large files are not loaded in memory, 
+        and only once as long as its size and modification time do not change.
+    options: optional
+        Options the data set was read with (e.g. filters). Their representation is 
+        included in the fingerprint, so that different options do not share a snapshot.
+
+    Returns
+    -------
+    str
+        The SHA-1 hex digest of the content (and options).
+    '''
+    stat = os.stat(filename)
+    key, version = os.path.abspath(filename), (stat.st_size, stat.st_mtime_ns)
+    cached = _content_hashes.get(key)
+    if cached is None or cached[0] != version:
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                sha1.update(block)
+        cached = _content_hashes[key] = (version, sha1)
+    sha1 = cached[1].copy()
+    if options is not None:
+        sha1.update(repr(options).encode())
+    return sha1.hexdigest()
+
+
+def code_hash(filenames):
+    '''
+    Computes a fingerprint of source files, e.g. the modules that build a stored state, 
+    so that states stored by another version of the code are not reused.
+
+    Parameters
+    ----------
+    filenames: list
+        Paths to the files.
+
+    Returns
+    -------
+    str
+        The first 12 characters of the SHA-1 hex digest of their contents.
+    '''
+    sha1 = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()[:12]
+
+
+def snapshot_path(filename):
+    '''
+    Returns the default location of the snapshot for a source file (next to the file itself).
+    '''
+    return filename + '.npz'
+
+
+def save_snapshot(df, path, source_hash):
+    '''
+    Stores a cleaned data set as a columnar NumPy archive. String columns are stored as
+    categorical codes plus their categories, so the archive can be loaded without pickling. 
+    Categorical columns are restored as categoricals, other string columns as objects.
+    The archive is written to a temporary file and moved into place, so concurrently
+    booting workers never read a partially written snapshot.
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+        The cleaned data set.
+    path: str
+        Where to write the snapshot.
+    source_hash: str
+        Fingerprint of the source file the data set was read from.
+    '''
+    arrays = {'version': np.array(SNAPSHOT_VERSION),
+              'source_hash': np.array(source_hash),
+              'columns': np.array(df.columns, dtype=str)}
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        if values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype):
+            categorical = pd.Categorical(values)
+            arrays['codes_%d' % i] = categorical.codes
+            arrays['categories_%d' % i] = np.asarray(categorical.categories, dtype=str)
+            arrays['categorical_%d' % i] = np.array(isinstance(values.dtype, pd.CategoricalDtype))
+        else:
+            arrays['values_%d' % i] = values.values
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_snapshot(path, source_hash):
+    '''
+    Loads a data set stored with save_snapshot.
+
+    Parameters
+    ----------
+    path: str
+        Location of the snapshot.
+    source_hash: str
+        Fingerprint of the current source file.
+
+    Returns
+    -------
+    pandas DataFrame or None
+        The data set, or None if there is no snapshot, or it was written by a different
+        version of the code or from a different source file.
+    '''
+    if not os.path.exists(path):
+        return None
+
+    try:
+        arrays = np.load(path, allow_pickle=False)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        # a corrupt snapshot is simply rebuilt from the source file
+        return None
+
+    with arrays:
+        if int(arrays['version']) != SNAPSHOT_VERSION or str(arrays['source_hash']) != source_hash:
+            return None
+
+        columns = {}
+        for i, column in enumerate(arrays['columns']):
+            if 'codes_%d' % i in arrays.files:
+                codes = arrays['codes_%d' % i]
+                categories = arrays['categories_%d' % i].astype(object)
+                if arrays['categorical_%d' % i]:
+                    columns[column] = pd.Categorical.from_codes(codes, categories)
+                else:
+                    values = categories[codes]
+                    values[codes < 0] = np.nan
+                    columns[column] = values
+            else:
+                columns[column] = arrays['values_%d' % i]
+
+    return pd.DataFrame(columns)
+
+
+class _Shared:
+    '''
+    Placeholder of a shared array, data frame or categorical in a stored state.
+    '''
+
+    def __init__(self, kind, *content):
+        self.kind = kind
+        self.content = content
+
+
+def _split_state(value, arrays):
+    '''
+    Replaces the numeric arrays in a (nested) object by references to entries of `arrays`.
+    Data frames and string columns are split into numeric arrays (values, categorical codes)
+    and small dictionaries (column names, categories).
+    '''
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        name = 'array_%d' % len(arrays)
+        arrays[name] = value
+        return _Shared('array', name)
+    if isinstance(value, pd.DataFrame):
+        return _Shared('frame', [(column, _split_state(value[column], arrays)) for column in value.columns])
+    if isinstance(value, pd.Series):
+        if value.dtype == object or isinstance(value.dtype, pd.CategoricalDtype):
+            categorical = pd.Categorical(value)
+            return _Shared('categorical', _split_state(categorical.codes, arrays), list(categorical.categories))
+        return _split_state(value.values, arrays)
+    if isinstance(value, dict):
+        return {key: _split_state(item, arrays) for key, item in value.items()}
+    return value
+
+
+def _join_state(value, directory):
+    '''
+    Inverse of _split_state: restores the arrays as read-only memory maps of the files in `directory`.
+    '''
+    if isinstance(value, _Shared):
+        if value.kind == 'array':
+            return np.load(os.path.join(directory, value.content[0] + '.npy'), mmap_mode='r')
+        if value.kind == 'frame':
+            # copy=False keeps the columns as views of the memory maps (no consolidation)
+            return pd.DataFrame({column: _join_state(item, directory) for column, item in value.content[0]},
+                                copy=False)
+        if value.kind == 'categorical':
+            codes, categories = value.content
+            return pd.Categorical.from_codes(_join_state(codes, directory), categories)
+    if isinstance(value, dict):
+        return {key: _join_state(item, directory) for key, item in value.items()}
+    return value
+
+
+def save_shared(state, directory):
+    '''
+    Stores the state of an object so that several processes can attach to it: every numeric
+    array is written as an .npy file, to be memory-mapped read-only (the operating system then
+    keeps a single copy in memory), and the remaining small objects are pickled alongside.
+    The files are written to a temporary directory that is moved into place, so processes
+    never attach to a partially written state. If the directory already exists, it is kept.
+
+    Parameters
+    ----------
+    state: dict
+        The attributes of the object (e.g. its __dict__).
+    directory: str
+        Where to store the state.
+    '''
+    arrays = {}
+    split = _split_state(state, arrays)
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(dir=parent, suffix='.tmp')
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_directory, name + '.npy'), np.ascontiguousarray(array))
+        with open(os.path.join(tmp_directory, 'state.pickle'), 'wb') as f:
+            pickle.dump(split, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmp_directory, 0o755)
+        os.rename(tmp_directory, directory)
+    except OSError:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        # another process stored the same state first
+        if not os.path.exists(os.path.join(directory, 'state.pickle')):
+            raise
+
+
+def load_shared(directory):
+    '''
+    Attaches to a state stored with save_shared.
+
+    Returns
+    -------
+    dict
+        The attributes of the object, with numeric arrays memory-mapped read-only.
+    '''
+    with open(os.path.join(directory, 'state.pickle'), 'rb') as f:
+        split = pickle.load(f)
+    return _join_state(split, directory)
+
+
+def prune_shared(directory, current, pattern, keep=1):
+    '''
+    Removes the states stored in a shared directory by earlier exports or versions of the code,
+    except the current one and the `keep` most recent others, which workers that have not
+    refreshed yet may still attach to. Processes already attached to a removed state are
+    not affected: its memory-mapped files are freed when they are unmapped.
+
+    Parameters
+    ----------
+    directory: str
+        The shared directory.
+    current: str
+        The path of the current state.
+    pattern: str
+        Regular expression matching the names of the states of the same kind as the current one.
+    keep: int
+        Number of other states kept.
+    '''
+    pattern = re.compile(pattern)
+    others = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if pattern.match(name) and os.path.abspath(path) != os.path.abspath(current):
+            try:
+                others.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    for _, path in sorted(others, reverse=True)[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,226 @@
+'''
+Exports the figures of the dashboard for every combination of its inputs (e.g. every year and
+transaction of the world explorer) as static reports, in JSON, HTML or PNG.
+
+Run from the root of the repository with
+
+    python -m codes.sweep --output reports --formats json html
+
+The combinations are rendered by a pool of processes forked after the data set is loaded,
+so that they share it (copy-on-write) instead of loading or pickling it. Every report is written
+to its own file as soon as it is rendered, and reports that already exist are skipped, so an
+interrupted sweep resumes where it stopped when run again.
+'''
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+
+from . import callbacks, compact, dataset, derived, settings
+
+FORMATS = ['json', 'html', 'png']
+
+# the data set and the reports being rendered. Worker processes are forked after they are set,
+# so they inherit them without pickling.
+_energy_data = None
+_tasks = []
+_formats = []
+_output = None
+
+
+def _slug(value):
+    return re.sub(r'[^A-Za-z0-9]+', '-', str(value)).strip('-').lower()
+
+
+def world_figure(energyData, year, transaction):
+    '''
+    Renders the world map of a transaction, or derived metric (see derived.METRICS), in a year.
+    '''
+    import pandas as pd
+    import plotly.express as px
+    if transaction in derived.METRICS:
+        values = callbacks.build_world_values(energyData, year, derived.METRICS[transaction], derived=True)
+        title = transaction
+    else:
+        values = callbacks.build_world_values(energyData, year, energyData.transaction_map[transaction])
+        title = dataset.QUANTITY
+    df_world = pd.DataFrame({'ISO-3': values['locations'], title: values['z']})
+    return px.choropleth(data_frame=df_world, locations='ISO-3', locationmode='ISO-3', color=title,
+                         color_continuous_scale='jet', title='{} - {}'.format(transaction, year))
+
+
+def production_figure(energyData, year):
+    '''
+    Renders the electricity generation by fuel and purpose in a year.
+    '''
+    import plotly.express as px
+    df_gen = callbacks.build_production_dataset(energyData, year, callbacks.PRODUCTION_TRANSACTIONS, codes=True)
+    df_gen = df_gen[(df_gen['Purpose'] != 'Other') & (df_gen['Fuel'] != 'Total')]
+    return px.bar(df_gen, x='Fuel', y=dataset.QUANTITY, color='Purpose',
+                  title='Generation by fuel - {}'.format(year))
+
+
+# Reports: the function rendering the figure and the combinations of its inputs
+REPORTS = {'world': (world_figure, lambda energyData: [(int(year), transaction)
+                                                       for year in energyData.years
+                                                       for transaction in list(energyData.transaction_map) +
+                                                                          list(derived.METRICS)]),
+           'production': (production_figure, lambda energyData: [(int(year),) for year in energyData.years])}
+
+
+def report_path(output, report, args, fmt):
+    '''
+    Returns the path of the file of a report, e.g. <output>/world/2018/final-energy-consumption.json.
+    '''
+    name = '-'.join(_slug(arg) for arg in args[1:]) or 'figure'
+    return os.path.join(output, report, str(args[0]), '%s.%s' % (name, fmt))
+
+
+def _write(path, content):
+    '''
+    Writes a file atomically, so that an interrupted sweep never leaves a partial report behind.
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content if isinstance(content, bytes) else content.encode())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _render(i):
+    '''
+    Renders one report and writes it in all the formats (runs in a worker process).
+
+    Returns
+    -------
+    tuple
+        The index of the task, the time spent in s, and the error message if it failed.
+    '''
+    import plotly.io as pio
+    report, args = _tasks[i]
+    start = time.perf_counter()
+    try:
+        fig = REPORTS[report][0](_energy_data, *args)
+        for fmt in _formats:
+            if fmt == 'json':
+                content = compact.to_json(fig)
+            elif fmt == 'html':
+                content = pio.to_html(fig, include_plotlyjs='cdn', full_html=True)
+            else:
+                content = pio.to_image(fig, format=fmt)
+            _write(report_path(_output, report, args, fmt), content)
+    except Exception as error:
+        return i, time.perf_counter() - start, '%s: %s' % (type(error).__name__, error)
+    return i, time.perf_counter() - start, None
+
+
+def sweep(energyData, output, reports=None, formats=('json',), processes=None, years=None):
+    '''
+    Renders reports for all the combinations of their inputs over a pool of forked processes,
+    skipping the reports that were already written. Each completed report is appended to
+    <output>/manifest.jsonl.
+
+    Parameters
+    ----------
+    energyData: dataset.EnergyData object
+        The data set, shared with the worker processes.
+    output: str
+        Directory of the reports.
+    reports: list, optional
+        Keys of REPORTS to render, defaults to all.
+    formats: list
+        Formats of the files, among FORMATS (png needs the kaleido package).
+    processes: int, optional
+        Number of worker processes, defaults to the number of CPUs. With 1 (or without fork),
+        the reports are rendered in this process.
+    years: list, optional
+        Only render the reports of these years.
+
+    Returns
+    -------
+    dict
+        The number of reports rendered, skipped (already written) and failed.
+    '''
+    global _energy_data, _tasks, _formats, _output
+    _energy_data, _formats, _output = energyData, list(formats), output
+
+    tasks = [(report, args) for report in (reports or REPORTS)
+             for args in REPORTS[report][1](energyData)
+             if years is None or args[0] in years]
+    _tasks = [(report, args) for report, args in tasks
+              if not all(os.path.exists(report_path(output, report, args, fmt)) for fmt in _formats)]
+    counts = {'rendered': 0, 'skipped': len(tasks) - len(_tasks), 'failed': 0}
+    os.makedirs(output, exist_ok=True)
+    # files being written when a previous sweep was interrupted
+    for directory, _, filenames in os.walk(output):
+        for filename in filenames:
+            if filename.endswith('.tmp'):
+                os.remove(os.path.join(directory, filename))
+
+    # plotly is imported before the fork, so that the workers do not import it each
+    # (plotly.express imports plotly.io, used by _render)
+    importlib.import_module('plotly.express')
+    pool = None
+    if processes != 1 and len(_tasks) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        pool = multiprocessing.get_context('fork').Pool(processes)
+    start = time.perf_counter()
+    try:
+        if pool is not None:
+            # small chunks keep the workers busy until the end and the manifest up to date
+            results = pool.imap_unordered(_render, range(len(_tasks)), chunksize=4)
+        else:
+            results = map(_render, range(len(_tasks)))
+        with open(os.path.join(output, 'manifest.jsonl'), 'a') as manifest:
+            for i, seconds, error in results:
+                report, args = _tasks[i]
+                if error is not None:
+                    counts['failed'] += 1
+                    print('Failed %s %s: %s' % (report, args, error))
+                    continue
+                counts['rendered'] += 1
+                manifest.write(json.dumps({'report': report, 'args': list(args), 'seconds': round(seconds, 4),
+                                           'files': [report_path(output, report, args, fmt)
+                                                     for fmt in _formats]}) + '\n')
+                manifest.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    elapsed = time.perf_counter() - start
+    print('Rendered %d reports in %.1f s (%.1f/s), %d already written, %d failed' % (
+        counts['rendered'], elapsed, counts['rendered'] / elapsed if elapsed else 0,
+        counts['skipped'], counts['failed']))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data', default=settings.DATA_FILE, help='csv export to load')
+    parser.add_argument('--output', default='reports', help='directory of the reports')
+    parser.add_argument('--reports', nargs='+', choices=sorted(REPORTS), help='reports to render (default: all)')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=['json'])
+    parser.add_argument('--processes', type=int, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--years', type=int, nargs='+', help='only render these years')
+    args = parser.parse_args()
+
+    if 'png' in args.formats:
+        if importlib.util.find_spec('kaleido') is None:
+            parser.error('png reports need the kaleido package (pip install kaleido)')
+
+    energyData = dataset.EnergyData(args.data, **settings.DATA_OPTIONS)
+    counts = sweep(energyData, args.output, args.reports, args.formats, args.processes, args.years)
+    if counts['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import inspect
+import multiprocessing
+import threading
+import time
+
+from .cache import FigureCache
+
+# (callback, inputs) pairs being warmed up, and the figure cache. Worker processes are forked 
+# after they are set, so they inherit the callbacks and the loaded data set without pickling them.
+_tasks = []
+_figure_cache = None
+
+
+def _render(i):
+    '''
+    Renders and serializes the figures of one task (runs in a worker process), unless they 
+    are cached or claimed by another process sharing the on-disk store (e.g. the warm-up of 
+    another gunicorn worker). Inputs the callback fails on are skipped; they fail the same 
+    way when requested.
+    
+    Returns
+    -------
+    tuple
+        The index of the task, the serialized figures (None if skipped) and whether 
+        the task was claimed, in which case the caller releases it once the figures are stored.
+    '''
+    func, args = _tasks[i]
+    key = FigureCache.key(func, args)
+    if _figure_cache.contains(key) or not _figure_cache.claim(key):
+        return i, None, False
+    try:
+        return i, FigureCache.serialize(inspect.unwrap(func)(*args)), True
+    except Exception:
+        return i, None, True
+
+
+def warm_up(figure_cache, tasks, processes=None, background=True):
+    '''
+    Pre-renders the figures of memoized callbacks for a list of inputs and stores them
+    in the figure cache. Callbacks keep working while the warm-up runs: inputs that are
+    not rendered yet are computed on request, as without the warm-up.
+
+    Parameters
+    ----------
+    figure_cache: cache.FigureCache object
+        The cache the callbacks are memoized with.
+    tasks: list
+        Pairs of (callback, inputs), where callback was decorated with figure_cache.memoize
+        and inputs is a tuple of the values of its inputs.
+    processes: int, optional
+        Number of worker processes, defaults to the number of CPUs.
+    background: bool
+        If True, the warm-up runs in a daemon thread and the function returns immediately.
+
+    Returns
+    -------
+    threading.Thread or None
+        The thread running the warm-up, if it runs in the background.
+    '''
+    global _tasks, _figure_cache
+    # skip figures that are already cached, e.g. by another worker sharing the on-disk store. 
+    # The workers warming up at the same time share the remaining ones through claims (see _render)
+    _tasks = [(func, tuple(args)) for func, args in tasks
+              if not figure_cache.contains(FigureCache.key(func, args))]
+    _figure_cache = figure_cache
+
+    # the pool is created (and the worker processes forked) right away, before the server
+    # starts any threads. Without fork, the figures are rendered one by one instead.
+    pool = None
+    if _tasks and 'fork' in multiprocessing.get_all_start_methods():
+        pool = multiprocessing.get_context('fork').Pool(processes)
+
+    def run():
+        start = time.perf_counter()
+        if pool is not None:
+            results = pool.imap_unordered(_render, range(len(_tasks)))
+        else:
+            results = map(_render, range(len(_tasks)))
+        rendered = 0
+        for i, value, claimed in results:
+            func, args = _tasks[i]
+            key = FigureCache.key(func, args)
+            if value is not None:
+                figure_cache.set(key, value)
+                rendered += 1
+            if claimed:
+                figure_cache.release(key)
+        if pool is not None:
+            pool.close()
+            pool.join()
+        print('Warm-up: rendered %d of %d figures in %.2f s' % (rendered, len(_tasks), 
+                                                              time.perf_counter() - start))
+
+    if not background:
+        run()
+        return None
+
+    thread = threading.Thread(target=run, name='figure-warm-up', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,120 @@
+import glob
+import os
+import threading
+import time
+import traceback
+
+
+def latest_export(directory, pattern='UNdata_Export_*.csv'):
+    '''
+    Returns the latest export in a directory. Exports are named after the time they were
+    downloaded (e.g. UNdata_Export_20211018_063214641.csv), so the latest one sorts last.
+
+    Parameters
+    ----------
+    directory: str
+        The directory holding the exports.
+    pattern: str
+        Glob pattern of the export file names.
+
+    Returns
+    -------
+    str or None
+        The path of the latest export, or None if there is none.
+    '''
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    return paths[-1] if paths else None
+
+
+def _signature(path):
+    '''
+    Identifies a version of a file by its path, size and modification time.
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def watch(directory, on_change, interval=60, pattern='UNdata_Export_*.csv'):
+    '''
+    Polls a directory for a new export, or a change of the latest one, in a daemon thread.
+
+    Parameters
+    ----------
+    directory: str
+        The directory holding the exports.
+    on_change: callable
+        Called with the path of the latest export when it changes. Errors are printed
+        and the previous data are kept, so a partially copied file is retried on the next poll.
+    interval: float
+        Time between two polls, in s.
+    pattern: str
+        Glob pattern of the export file names.
+
+    Returns
+    -------
+    threading.Thread
+        The thread polling the directory.
+    '''
+    def run(current):
+        while True:
+            time.sleep(interval)
+            path = latest_export(directory, pattern)
+            signature = _signature(path) if path is not None else None
+            if signature is None or signature == current:
+                continue
+            try:
+                on_change(path)
+            except Exception:
+                traceback.print_exc()
+                continue
+            current = signature
+
+    # the export loaded at the time of the call is the current one
+    path = latest_export(directory, pattern)
+    current = _signature(path) if path is not None else None
+    thread = threading.Thread(target=run, args=(current,), name='data-watcher', daemon=True)
+    thread.start()
+    return thread
+
+
+def watch_files(paths, on_change, interval=60):
+    '''
+    Polls files for a change (of their size or modification time) in a daemon thread.
+
+    Parameters
+    ----------
+    paths: list
+        The paths of the files.
+    on_change: callable
+        Called with the paths when any of the files changes. Errors are printed and the 
+        previous data are kept, so a partially copied file is retried on the next poll.
+    interval: float
+        Time between two polls, in s.
+
+    Returns
+    -------
+    threading.Thread
+        The thread polling the files.
+    '''
+    paths = list(paths)
+
+    def run(current):
+        while True:
+            time.sleep(interval)
+            signatures = [_signature(path) for path in paths]
+            if None in signatures or signatures == current:
+                continue
+            try:
+                on_change(paths)
+            except Exception:
+                traceback.print_exc()
+                continue
+            current = signatures
+
+    thread = threading.Thread(target=run, args=([_signature(path) for path in paths],), 
+                              name='commodity-watcher', daemon=True)
+    thread.start()
+    return thread
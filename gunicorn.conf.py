@@ -0,0 +1,10 @@
+from codes import settings
+
+
+def on_starting(server):
+    # load the shared data sets once in the master process, the workers then attach to them
+    if settings.SHARED_DATA_DIR:
+        from codes import commodities, dataset, watcher
+        filename = (settings.DATA_DIR and watcher.latest_export(settings.DATA_DIR)) or settings.DATA_FILE
+        dataset.EnergyData.shared(filename, settings.SHARED_DATA_DIR, **settings.DATA_OPTIONS)
+        commodities.CommodityData.shared(settings.COMMODITY_FILES or [filename], settings.SHARED_DATA_DIR)
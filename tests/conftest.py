@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import TRANSACTIONS
+from codes import dataset
+
+COUNTRIES = ['France', 'Germany', 'Kenya', 'Japan', 'Brazil', 'Other Asia', 'USSR (former)']
+YEARS = list(range(2004, 2020))
+COAL_TRANSACTIONS = ['Production', 'Imports', 'Consumption by households']
+
+FOOTNOTES = '"fnSeqID","Footnote"\n1,"Estimate"\n'
+
+
+def write_export(path, rows, columns):
+    '''
+    Writes rows as a csv export of the UN energy statistics, with its two lines of footnotes.
+    '''
+    with open(path, 'w') as f:
+        f.write(pd.DataFrame(rows, columns=columns).to_csv(index=False))
+        f.write(FOOTNOTES)
+
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+    '''
+    A small electricity export (with zeros and missing values) and a hard coal export
+    (without transaction codes, with units).
+    '''
+    directory = tmp_path_factory.mktemp('exports')
+    rng = np.random.default_rng(0)
+
+    rows = []
+    for i, country in enumerate(COUNTRIES):
+        for code, name in TRANSACTIONS.items():
+            for year in YEARS:
+                if rng.random() < 0.8:
+                    quantity = 0.0 if rng.random() < 0.05 else round(rng.uniform(0, 1000), 1)
+                    rows.append((i + 1, country, code, 'Electricity - ' + name, year, quantity, ''))
+    electricity = str(directory / 'electricity.csv')
+    write_export(electricity, rows, ['Country or Area Code', 'Country or Area', 'Transaction Code',
+                                     'Commodity - Transaction', 'Year', 'Quantity', 'Quantity Footnotes'])
+
+    rows = [(country, 'Hard coal - ' + name, year, 'Metric tons, thousand', round(rng.uniform(0, 100), 1), '')
+            for country in COUNTRIES[:5] for name in COAL_TRANSACTIONS for year in YEARS if rng.random() < 0.8]
+    coal = str(directory / 'coal.csv')
+    write_export(coal, rows, ['Country or Area', 'Commodity - Transaction', 'Year', 'Unit', 'Quantity',
+                              'Quantity Footnotes'])
+    return {'electricity': electricity, 'coal': coal}
+
+
+@pytest.fixture(scope='module')
+def energy_data(exports):
+    return dataset.EnergyData(exports['electricity'], snapshot=False)
+
+
+def raw_export(path):
+    '''
+    Reads an export with plain pandas: the values by commodity, transaction, country and year.
+    '''
+    df = pd.read_csv(path, skipfooter=2, engine='python', dtype={'Transaction Code': str})
+    split = df['Commodity - Transaction'].str.split(' - ')
+    df['Commodity'] = split.str[0]
+    df['Transaction'] = split.str[-1]
+    if 'Transaction Code' not in df:
+        df['Transaction Code'] = df['Transaction']
+    return df[df['Year'] != 2019]
+
+
+def normalize(df):
+    '''
+    Returns a table with a plain index, plain column types and sorted rows, for comparisons.
+    '''
+    df = df.reset_index()
+    df = df.astype({column: str for column in df.columns
+                   if column not in ['Year', 'Quantity', dataset.QUANTITY]})
+    return df.sort_values(list(df.columns[:-1])).reset_index(drop=True)
+
+
@@ -0,0 +1,39 @@
+import re
+
+import numpy as np
+
+from codes import callbacks, dataset
+
+
+def classify(code, rules):
+    # the first rule whose expression matches the whole code
+    return next(label for pattern, label in rules if re.fullmatch(pattern, code))
+
+
+def test_classify_codes(energy_data):
+    codes = list(energy_data.data['Transaction Code'])
+    for rules in [dataset.FUEL_RULES, dataset.PURPOSE_RULES]:
+        expected = [classify(code, rules) for code in codes]
+        assert list(dataset.classify_codes(codes, rules)) == expected
+    assert list(energy_data.data['Fuel']) == [classify(code, dataset.FUEL_RULES) for code in codes]
+    assert list(energy_data.data['Purpose']) == [classify(code, dataset.PURPOSE_RULES) for code in codes]
+
+
+def test_extract_classes(energy_data):
+    df = energy_data.extract_generation_data(years=[2008, 2010], codes=True, classes=True).reset_index()
+    assert list(df['Fuel']) == [classify(code, dataset.FUEL_RULES) for code in df['Transaction Code']]
+    assert list(df['Purpose']) == [classify(code, dataset.PURPOSE_RULES) for code in df['Transaction Code']]
+
+    df_country = energy_data.extract_country_data('France', classes=True)
+    assert list(df_country['Fuel']) == [classify(code, dataset.FUEL_RULES)
+                                        for code in df_country['Transaction Code']]
+
+    hydro = energy_data.extract_generation_data(codes=True, fuels='Hydro', purposes='Autoproducer')
+    assert set(hydro.index.get_level_values('Transaction Code')) == {'016HY'}
+
+
+def test_production_dataset_classes(energy_data):
+    df = callbacks.build_production_dataset(energy_data, 2010, callbacks.PRODUCTION_TRANSACTIONS, True)
+    for column, rules in [('Fuel', dataset.FUEL_RULES), ('Purpose', dataset.PURPOSE_RULES)]:
+        np.testing.assert_array_equal(df[column].values, 
+                                      [classify(code, rules) for code in df['Transaction Code']])
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from codes import commodities
+from .conftest import FOOTNOTES, normalize, raw_export
+
+
+@pytest.fixture(scope='module')
+def commodity_data(exports):
+    return commodities.CommodityData([exports['electricity'], exports['coal']], snapshot=False)
+
+
+@pytest.fixture(scope='module')
+def raw_commodities(exports):
+    return pd.concat([raw_export(exports['electricity']), raw_export(exports['coal'])], ignore_index=True)
+
+
+@pytest.mark.parametrize('query, by, agg', [
+    (dict(commodity='Electricity', transactions='12', years=2010), ['Country or Area'], 'sum'),
+    (dict(commodity='Hard coal', transactions=['Production', 'Imports']), ['Year', 'Transaction Code'], 'mean'),
+    (dict(commodity=['Electricity', 'Hard coal'], countries=['France', 'KEN']), ['Commodity', 'Year'], 'max'),
+    (dict(commodity='Electricity', years=[2008, 2009]), ['Transaction Code'], 'count'),
+])
+def test_commodity_query(commodity_data, raw_commodities, query, by, agg):
+    df = raw_commodities[raw_commodities['Commodity'].isin(np.atleast_1d(query['commodity']))]
+    if 'transactions' in query:
+        df = df[df['Transaction Code'].isin(np.atleast_1d(query['transactions']))]
+    if 'years' in query:
+        df = df[df['Year'].isin(np.atleast_1d(query['years']))]
+    if 'countries' in query:
+        df = df[df['Country or Area'].isin(['France', 'Kenya'])]
+    reference = df.groupby(by)['Quantity'].agg(agg).astype(np.float64).reset_index()
+
+    result = commodity_data.query(agg=agg, by=by, **query)
+    pd.testing.assert_frame_equal(normalize(result.set_index(by)), normalize(reference.set_index(by)),
+                                  check_exact=False)
+
+
+def test_commodity_query_units(commodity_data):
+    with pytest.raises(ValueError):
+        commodity_data.query(['Electricity', 'Hard coal'], by='Year')
+    with pytest.raises(ValueError):
+        commodity_data.query('Electricity', agg='median')
+
+
+def test_shared(exports, commodity_data, tmp_path):
+    filenames = [exports['electricity'], exports['coal']]
+    shared = commodities.CommodityData.shared(filenames, str(tmp_path), snapshot=False)
+    attached = commodities.CommodityData.shared(filenames, str(tmp_path), snapshot=False)
+    assert len(list(tmp_path.iterdir())) == 1
+    for commodityData in [shared, attached]:
+        pd.testing.assert_frame_equal(commodityData.query(agg=None), commodity_data.query(agg=None))
+        assert commodityData.units == commodity_data.units
+    assert isinstance(attached._values['Hard coal'], np.memmap)
+
+
+def test_refresh(exports, commodity_data, tmp_path):
+    same, delta = commodity_data.refresh([exports['electricity'], exports['coal']], snapshot=False)
+    assert same is commodity_data and delta.empty
+    
+    # a changed value and a removed one
+    df = pd.read_csv(exports['coal'], skipfooter=2, engine='python')
+    df.loc[0, 'Quantity'] = 1000.5
+    path = str(tmp_path / 'coal.csv')
+    with open(path, 'w') as f:
+        f.write(df.drop(index=1).to_csv(index=False))
+        f.write(FOOTNOTES)
+    refreshed, delta = commodity_data.refresh([exports['electricity'], path], snapshot=False)
+    
+    split = df['Commodity - Transaction'].str.split(' - ')
+    expected = {(split[i][0], split[i][1], df.loc[i, 'Country or Area'], df.loc[i, 'Year']) for i in [0, 1]}
+    assert set(map(tuple, delta[['Commodity', 'Transaction Code', 'Country or Area', 'Year']].values)) == expected
+    assert refreshed.query('Hard coal', transactions=split[0][1], countries=df.loc[0, 'Country or Area'], 
+                           years=df.loc[0, 'Year'])['Quantity'].tolist() == [1000.5]
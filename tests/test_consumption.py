@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import TRANSACTIONS
+from codes import dataset
+from .conftest import COUNTRIES, YEARS, write_export
+
+COLUMNS = ['Country or Area Code', 'Country or Area', 'Transaction Code', 'Commodity - Transaction', 'Year', 
+           'Quantity', 'Quantity Footnotes']
+
+# the consumption codes under each code
+CHILDREN = {'12': ['121', '122', '123'], 
+            '121': ['1211', '1214'], 
+            '122': ['1221'], 
+            '123': ['1231', '1232', '1235']}
+
+
+def load(path, rows):
+    write_export(path, [(COUNTRIES.index(country) + 1, country, code, 'Electricity - ' + TRANSACTIONS[code], 
+                         year, quantity, '') for country, code, year, quantity in rows], COLUMNS)
+    return dataset.EnergyData(path, snapshot=False)
+
+
+@pytest.fixture(scope='module')
+def consumption(tmp_path_factory):
+    '''
+    A data set where each country reports some of the nodes of consistent consumption 
+    hierarchies (a sector is at least the sum of its subsectors), with the values reported.
+    '''
+    rng = np.random.default_rng(1)
+    rows = []
+    
+    def fill(values, code):
+        children = CHILDREN.get(code, [])
+        values[code] = sum(fill(values, child) for child in children) + round(rng.uniform(0, 100), 1)
+        return values[code]
+    
+    for country in COUNTRIES[:5]:
+        for year in YEARS:
+            values = {}
+            fill(values, '12')
+            rows += [(country, code, year, value) for code, value in values.items() if rng.random() < 0.6]
+            rows.append((country, '01', year, 1000.0))
+    path = str(tmp_path_factory.mktemp('consumption') / 'export.csv')
+    return load(path, rows), pd.DataFrame(rows, columns=['Country', 'Code', 'Year', 'Quantity'])
+
+
+def rollup(reported, code):
+    '''
+    The value of a node for a country and year: the reported one, or the sum of its children.
+    '''
+    if code in reported:
+        return reported[code]
+    values = [rollup(reported, child) for child in CHILDREN.get(code, [])]
+    values = [value for value in values if value is not None]
+    return sum(values) if values else None
+
+
+def test_hierarchy_matches_rollup_per_country(consumption):
+    energy_data, rows = consumption
+    rows = rows[rows['Year'] != 2019]
+    expected = {}
+    for (country, year), group in rows.groupby(['Country', 'Year']):
+        reported = dict(zip(group['Code'], group['Quantity']))
+        for code in set(CHILDREN).union(*CHILDREN.values()):
+            value = rollup(reported, code)
+            if value is not None:
+                expected[year, code] = expected.get((year, code), 0) + value
+    
+    df = energy_data.extract_consumption_hierarchy()
+    result = dict(zip(zip(df['Year'], df['Transaction Code']), df[dataset.QUANTITY]))
+    assert set(result) == set(expected)
+    np.testing.assert_allclose([result[key] for key in expected], list(expected.values()))
+
+
+def test_parents_at_least_children(consumption):
+    energy_data, _ = consumption
+    df = energy_data.extract_consumption_hierarchy()
+    values = df.set_index(['Year', 'Transaction Code'])[dataset.QUANTITY]
+    children = df[df['Parent'].notna()].groupby(['Year', 'Parent'])[dataset.QUANTITY].sum()
+    parents = values.reindex(children.index.rename(['Year', 'Transaction Code']))
+    assert (parents.values >= children.values - 1e-6).all()
+
+
+def test_sector_reported_by_some_countries(tmp_path):
+    # France reports other consumption, Germany only its households
+    energy_data = load(str(tmp_path / 'export.csv'), [('France', '123', 2010, 10.0), 
+                                                      ('Germany', '1231', 2010, 15.0), 
+                                                      ('France', '01', 2010, 100.0)])
+    df = energy_data.extract_consumption_hierarchy(years=2010).set_index('Transaction Code')
+    assert df.loc['1231', dataset.QUANTITY] == 15
+    assert df.loc['123', dataset.QUANTITY] == 25
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from codes import dataset
+from .conftest import raw_export
+
+
+@pytest.mark.parametrize('country, name', [('France', 'France'), ('KEN', 'Kenya'), ('Other Asia', 'Other Asia')])
+def test_country_data_matches_filter(energy_data, exports, country, name):
+    df = raw_export(exports['electricity'])
+    expected = df[df['Country or Area'] == name].sort_values(['Transaction Code', 'Year'])
+    result = energy_data.extract_country_data(country)
+    
+    np.testing.assert_array_equal(result['Year'].values, expected['Year'].values)
+    np.testing.assert_array_equal(result['Transaction Code'].values, expected['Transaction Code'].values)
+    np.testing.assert_array_equal(result['Transaction'].values, expected['Transaction'].values)
+    np.testing.assert_allclose(result[dataset.QUANTITY].values, expected['Quantity'].values)
+
+
+def test_country_data_transactions(energy_data, exports):
+    df = raw_export(exports['electricity'])
+    expected = df[(df['Country or Area'] == 'Germany') & df['Transaction Code'].isin(['12', 'EP'])]
+    result = energy_data.extract_country_data('DEU', transactions=['EP', '12', 'XX'])
+    
+    assert list(pd.unique(result['Transaction Code'])) == ['EP', '12']
+    assert len(result) == len(expected)
+    assert energy_data.extract_country_data('Atlantis').empty
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from codes import derived
+from .conftest import raw_export
+
+
+def test_derived_parse():
+    tree, codes = derived.parse("100 * ('03' - '04') / -'01'")
+    assert sorted(codes) == ['01', '03', '04']
+    for expression in derived.METRICS.values():
+        derived.parse(expression)
+
+    for expression in ["__import__('os')", "'03'.upper()", "x + 1", "'03' ** 2", "'03' < '04'",
+                       "['03']", "lambda: 1", "'03' +"]:
+        with pytest.raises(ValueError):
+            derived.parse(expression)
+
+
+def test_derived_values(energy_data, exports):
+    df = raw_export(exports['electricity'])
+    values = df.pivot_table(index='Year', columns=['Transaction Code', 'Country or Area'], values='Quantity',
+                            aggfunc='sum')
+
+    def series(code):
+        return values[code].reindex(index=energy_data.years, columns=energy_data.countries).values
+
+    np.testing.assert_allclose(energy_data.derived("'03' - '04'"), series('03') - series('04'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = 100 * series('07') / series('01')
+    expected = np.where(np.isfinite(share), share, np.nan)
+    np.testing.assert_allclose(energy_data.derived("100 * '07' / '01'"), expected)
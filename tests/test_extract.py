@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+
+from codes import dataset
+from .conftest import normalize, raw_export
+
+
+@pytest.mark.parametrize('subset, pattern', [('generation', '^01.*?|EP|SP'), ('consumption', '^12.*?')])
+@pytest.mark.parametrize('codes', [True, False])
+def test_extract_matches_groupby(energy_data, exports, subset, pattern, codes):
+    df = raw_export(exports['electricity'])
+    column = 'Transaction Code' if codes else 'Transaction'
+    reference = df[df['Transaction Code'].str.contains(pattern)].groupby(['Year', column])[['Quantity']].sum()
+    reference = reference.rename(columns={'Quantity': dataset.QUANTITY})
+    extract = getattr(energy_data, 'extract_%s_data' % subset)
+
+    pd.testing.assert_frame_equal(normalize(extract(codes=codes)), normalize(reference))
+
+    years = [2008, 2012]
+    transactions = list(reference.index.get_level_values(column).unique()[:3])
+    selected = reference[reference.index.get_level_values('Year').isin(years) &
+                         reference.index.get_level_values(column).isin(transactions)]
+    pd.testing.assert_frame_equal(normalize(extract(years=years, transactions=transactions, codes=codes)),
+                                  normalize(selected))
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from codes import dataset, forecast
+
+
+@pytest.mark.parametrize('method', forecast.METHODS)
+def test_fit_trends_matches_polyfit(energy_data, method):
+    values = energy_data.cube.reshape(len(energy_data.years), -1)
+    trends = forecast.fit_trends(energy_data.years, values, method, min_points=5)
+    
+    for j in range(values.shape[1]):
+        y = values[:, j]
+        keep = ~np.isnan(y) & (y > 0 if method == 'log-linear' else True)
+        if keep.sum() < 5:
+            assert np.isnan(trends['slope'][j])
+            continue
+        slope, intercept = np.polyfit(energy_data.years[keep], 
+                                      np.log(y[keep]) if method == 'log-linear' else y[keep], 1)
+        np.testing.assert_allclose(trends['slope'][j], slope, rtol=1e-6, atol=1e-9)
+        np.testing.assert_allclose(trends['intercept'][j] - trends['slope'][j] * trends['origin'], intercept, 
+                                   rtol=1e-6)
+
+
+def test_forecast(energy_data):
+    df = energy_data.forecast('12', 2028)
+    # regional totals and former countries are left out
+    assert len(df) > 0 and set(df['Country or Area']) <= {'France', 'Germany', 'Kenya', 'Japan', 'Brazil'}
+    assert df['ISO-3'].notna().all()
+    
+    for _, row in df.iterrows():
+        values = energy_data.extract_country_data(row['Country or Area'], transactions='12')
+        slope, intercept = np.polyfit(values['Year'], values[dataset.QUANTITY], 1)
+        assert row['Projected'] == pytest.approx(max(slope * 2028 + intercept, 0), rel=1e-6)
+        assert row['Last year'] == values['Year'].max()
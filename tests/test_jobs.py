@@ -0,0 +1,51 @@
+import concurrent.futures
+import threading
+
+import pytest
+
+from codes import jobs
+from codes.cache import FigureCache
+
+
+@pytest.fixture
+def renders():
+    '''
+    A memoized rendering function that fails on its first call, and its executor.
+    '''
+    figure_cache = FigureCache()
+    calls = []
+    release = threading.Event()
+
+    @figure_cache.memoize
+    def figures(year):
+        calls.append(year)
+        release.wait(5)
+        if len(calls) == 1:
+            raise RuntimeError('render failed')
+        return {'data': [], 'layout': {'title': str(year)}}
+
+    executor = jobs.JobExecutor(figure_cache, wait=5)
+    return executor, figures, calls, release
+
+
+def test_failure_reported_once(renders):
+    executor, figures, calls, release = renders
+    release.set()
+    with pytest.raises(RuntimeError):
+        executor.run(figures, (2010,))
+    # the request that waited got the error: the next one renders again
+    assert executor.run(figures, (2010,)) == {'data': [], 'layout': {'title': '2010'}}
+    assert calls == [2010, 2010]
+
+
+def test_failure_after_timeout(renders):
+    executor, figures, calls, release = renders
+    assert executor.run(figures, (2010,), wait=0.05) is None
+    future = executor.submit(figures, (2010,))
+    release.set()
+    concurrent.futures.wait([future])
+    # the failure happened after the request returned: it is reported to the next request, once
+    with pytest.raises(RuntimeError):
+        executor.run(figures, (2010,))
+    assert executor.run(figures, (2010,)) == {'data': [], 'layout': {'title': '2010'}}
+    assert calls == [2010, 2010]
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import TRANSACTIONS
+from codes import callbacks, dataset
+from .conftest import write_export
+
+# the years without a value of each series of France, within 2005-2009
+GAPS = {'EP': [], '015HY': [2007], '016HY': [2008], '015W': [2007, 2008, 2009], '1231': [2007], '121': []}
+
+
+@pytest.fixture(scope='module')
+def gap_data(tmp_path_factory):
+    '''
+    The history of a country over a single 5-year period, with gap years in the series.
+    '''
+    rng = np.random.default_rng(1)
+    rows = [(1, 'France', code, 'Electricity - ' + TRANSACTIONS[code], year, round(rng.uniform(0, 1000), 1), '')
+            for code, gaps in GAPS.items() for year in range(2005, 2010) if year not in gaps]
+    path = str(tmp_path_factory.mktemp('periods') / 'electricity.csv')
+    write_export(path, rows, ['Country or Area Code', 'Country or Area', 'Transaction Code',
+                              'Commodity - Transaction', 'Year', 'Quantity', 'Quantity Footnotes'])
+    df = pd.DataFrame(rows, columns=['Code', 'Country', 'Transaction Code', 'Transaction', 'Year', 'Quantity', 'Notes'])
+    return dataset.EnergyData(path, snapshot=False), df
+
+
+def test_country_periods_mean_over_years_with_value(gap_data):
+    energy_data, df = gap_data
+    # 2 fuels and 2 consumers over 5 years only fit in a budget of 2 points per series as one period
+    df_gen, df_cons = callbacks.build_country_data(energy_data, 'France', budget=2)
+
+    fuels = df[df['Transaction Code'].isin(['015HY', '016HY', '015W'])].copy()
+    fuels['Fuel'] = fuels['Transaction Code'].str[3:].map({'HY': 'Hydro', 'W': 'Wind'})
+    yearly = fuels.groupby(['Fuel', 'Year'])['Quantity'].sum()
+    expected = yearly.groupby('Fuel').agg(['mean', 'count'])
+
+    assert list(df_gen['Period'].unique()) == ['2005-2009']
+    df_gen = df_gen.set_index('Fuel').loc[expected.index]
+    np.testing.assert_allclose(df_gen[dataset.QUANTITY].values, expected['mean'].values)
+    # hydro has a value each year from either purpose, wind only in 2 years
+    assert list(df_gen['Years']) == [5, 2]
+
+    consumers = df[df['Transaction Code'].isin(['1231', '121'])]
+    expected = consumers.groupby('Transaction Code')['Quantity'].agg(['mean', 'count'])
+    df_cons = df_cons.set_index('Transaction Code').loc[expected.index]
+    np.testing.assert_allclose(df_cons[dataset.QUANTITY].values, expected['mean'].values)
+    assert list(df_cons['Years']) == list(expected['count'])
+    assert list(df_cons['Consumer']) == ['Industry', 'Households']
+
+
+def test_country_periods_match_years(gap_data):
+    energy_data, df = gap_data
+    # a large budget keeps the yearly history
+    df_gen, df_cons = callbacks.build_country_data(energy_data, 'France', budget=100)
+
+    assert 'Period' not in df_gen and 'Period' not in df_cons
+    assert sorted(df_gen['Year'].unique()) == list(range(2005, 2010))
+    assert len(df_cons) == len(df[df['Transaction Code'].isin(['1231', '121'])])
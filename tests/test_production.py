@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from codes import callbacks, dataset
+from .conftest import raw_export
+
+YEARS = [2006, 2012, 2016]
+
+
+def test_production_dataset_years(energy_data):
+    df = callbacks.build_production_dataset(energy_data, YEARS, callbacks.PRODUCTION_TRANSACTIONS, True)
+    single = pd.concat([callbacks.build_production_dataset(energy_data, year,
+                                                           callbacks.PRODUCTION_TRANSACTIONS, True)
+                        for year in YEARS])
+    keys = ['Year', 'Transaction Code']
+    pd.testing.assert_frame_equal(df.sort_values(keys).reset_index(drop=True),
+                                  single.sort_values(keys).reset_index(drop=True))
+
+
+def test_production_dataset_other(energy_data, exports):
+    df = raw_export(exports['electricity'])
+    df = df[df['Year'].isin(YEARS) & df['Transaction Code'].isin(callbacks.PRODUCTION_TRANSACTIONS)]
+    totals = df.groupby(['Year', 'Transaction Code'])['Quantity'].sum().unstack()
+    expected = {'015O': totals['EP'] - totals.filter(regex='^015').sum(axis=1),
+                '016O': totals['SP'] - totals.filter(regex='^016').sum(axis=1)}
+
+    df_plot = callbacks.build_production_dataset(energy_data, YEARS, callbacks.PRODUCTION_TRANSACTIONS, True)
+    for code, values in expected.items():
+        other = df_plot[df_plot['Transaction Code'] == code].set_index('Year')[dataset.QUANTITY]
+        np.testing.assert_allclose(other.reindex(YEARS).values, values.reindex(YEARS).values)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from codes import dataset
+from .conftest import raw_export
+
+# regional totals and former countries of the UN data are not ranked
+RANKED = ['France', 'Germany', 'Kenya', 'Japan', 'Brazil']
+
+
+@pytest.fixture(scope='module')
+def values(exports):
+    df = raw_export(exports['electricity'])
+    df = df[df['Country or Area'].isin(RANKED)]
+    return df.groupby(['Transaction Code', 'Year', 'Country or Area'])['Quantity'].sum()
+
+
+@pytest.mark.parametrize('code, year', [('12', 2010), ('EP', 2016), ('03', 2004)])
+def test_top_n(energy_data, values, code, year):
+    expected = values.loc[code, year].sort_values(ascending=False, kind='stable')
+    for n in [3, 10]:
+        df = energy_data.top_n(year, code, n)
+        assert list(df['Rank']) == list(range(1, min(n, len(expected)) + 1))
+        np.testing.assert_allclose(df[dataset.QUANTITY], expected.values[:n])
+        assert set(df['Country or Area']) <= set(RANKED) and df['ISO-3'].notna().all()
+
+
+@pytest.mark.parametrize('largest', [True, False])
+def test_top_movers(energy_data, values, largest):
+    change = (values.loc['12', 2016] - values.loc['12', 2008]).dropna()
+    expected = change.sort_values(ascending=not largest)
+    df = energy_data.top_movers('12', 2008, 2016, n=10, largest=largest)
+    np.testing.assert_allclose(df[dataset.QUANTITY], expected.values)
+    assert set(df['Country or Area']) <= set(RANKED)
+    assert energy_data.top_movers('12', 2008, 2030).empty
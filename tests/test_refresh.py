@@ -0,0 +1,47 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from codes import dataset
+from codes.snapshot import prune_shared
+from .conftest import FOOTNOTES
+
+
+def test_refresh_delta(energy_data, exports, tmp_path):
+    path = str(tmp_path / 'export.csv')
+    shutil.copy(exports['electricity'], path)
+    same, delta = energy_data.refresh(path, snapshot=False)
+    assert same is energy_data and delta.empty
+
+    df = pd.read_csv(path, skipfooter=2, engine='python', dtype={'Transaction Code': str})
+    df = df[df['Year'] != 2019]
+    changed = df.index[(df['Country or Area'] == 'France') & (df['Transaction Code'] == '12')][0]
+    removed = df.index[df['Country or Area'] == 'Kenya'][0]
+    df.loc[changed, 'Quantity'] += 1
+    with open(path, 'w') as f:
+        f.write(df.drop(index=removed).to_csv(index=False))
+        f.write(FOOTNOTES)
+
+    refreshed, delta = energy_data.refresh(path, snapshot=False)
+    assert refreshed is not energy_data
+    keys = ['Country or Area', 'Transaction Code', 'Year']
+    expected = [tuple(df.loc[i, keys]) + (iso3,) for i, iso3 in [(changed, 'FRA'), (removed, 'KEN')]]
+    assert sorted(map(tuple, delta[keys + ['ISO-3']].values)) == sorted(expected)
+    
+    year = df.loc[changed, 'Year']
+    france = list(energy_data.world_locations).index('FRA')
+    np.testing.assert_allclose(refreshed.extract_world_values(year, '12')[france], 
+                               energy_data.extract_world_values(year, '12')[france] + 1)
+
+def test_prune_shared(tmp_path):
+    names = ['%040x-v%d-%s' % (i, dataset.SNAPSHOT_VERSION, 'abcdef123456') for i in range(4)]
+    for i, name in enumerate(names):
+        os.mkdir(str(tmp_path / name))
+        os.utime(str(tmp_path / name), (i, i))
+    os.mkdir(str(tmp_path / 'tmp-state'))
+
+    prune_shared(str(tmp_path), str(tmp_path / names[0]), r'^[0-9a-f]{40}-v\d+(-[0-9a-f]+)?$')
+    # the current data set, the most recent other one and the directories not stored by shared
+    assert sorted(os.listdir(str(tmp_path))) == sorted([names[0], names[3], 'tmp-state'])
@@ -0,0 +1,39 @@
+import country_converter as coco
+import numpy as np
+import pytest
+
+from codes import dataset
+from .conftest import raw_export
+
+# regional totals and former countries of the UN data belong to no region
+MEMBERS = ['France', 'Germany', 'Kenya', 'Japan', 'Brazil']
+
+
+@pytest.mark.parametrize('grouping', ['Continent', 'UN region'])
+@pytest.mark.parametrize('code, year', [('12', 2010), ('EP', 2016), ('03', 2004)])
+def test_region_values(energy_data, exports, grouping, code, year):
+    df = raw_export(exports['electricity'])
+    df = df[(df['Transaction Code'] == code) & (df['Year'] == year) & df['Country or Area'].isin(MEMBERS)]
+    regions = coco.convert(MEMBERS, to=dataset.REGION_GROUPINGS[grouping])
+    expected = (df.assign(Region=df['Country or Area'].map(dict(zip(MEMBERS, regions))))
+                  .groupby('Region')['Quantity'].agg(['sum', 'count']))
+
+    result = energy_data.extract_region_values(year, code, grouping)
+    assert list(result['Region']) == list(expected.index)
+    assert list(result['Countries']) == list(expected['count'])
+    np.testing.assert_allclose(result[dataset.QUANTITY], expected['sum'])
+
+
+def test_region_values_missing(energy_data):
+    assert energy_data.extract_region_values(1950, '12', 'Continent').empty
+    assert energy_data.extract_region_values(2010, 'XX', 'OECD').empty
+    with pytest.raises(ValueError):
+        energy_data.extract_region_values(2010, '12', 'Galaxy')
+
+
+def test_region_locations(energy_data):
+    locations = energy_data.region_locations('OECD')
+    assert len(locations) == len(energy_data.world_locations)
+    members = dict(zip(energy_data.world_locations, locations))
+    assert members['FRA'] == members['JPN'] == 'OECD'
+    assert members['KEN'] == members['BRA'] == 'Non-OECD'
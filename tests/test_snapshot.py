@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from codes import dataset
+from codes.snapshot import file_hash, load_snapshot, save_snapshot
+
+
+def test_snapshot_round_trip(exports, tmp_path):
+    df = dataset.EnergyData._read_csv(exports['electricity'])
+    path = str(tmp_path / 'snapshot.npz')
+    save_snapshot(df, path, 'hash')
+
+    pd.testing.assert_frame_equal(load_snapshot(path, 'hash'), df)
+    assert load_snapshot(path, 'other hash') is None
+
+    parsed = dataset.EnergyData(exports['electricity'], snapshot=path)
+    loaded = dataset.EnergyData(exports['electricity'], snapshot=path)
+    np.testing.assert_array_equal(loaded.cube, parsed.cube)
+    assert loaded.transaction_map == parsed.transaction_map
+
+
+def test_file_hash_reads_changed_files_only(tmp_path):
+    path = str(tmp_path / 'export.csv')
+    with open(path, 'wb') as f:
+        f.write(b'first')
+    digest = file_hash(path)
+    assert digest == hashlib.sha1(b'first').hexdigest()
+    assert file_hash(path, 'options') == hashlib.sha1(b'first' + repr('options').encode()).hexdigest()
+
+    # same size and modification time: the content is not read again
+    stat = os.stat(path)
+    with open(path, 'wb') as f:
+        f.write(b'other')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert file_hash(path) == digest
+
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert file_hash(path) == hashlib.sha1(b'other').hexdigest()
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from codes import dataset
+from .conftest import FOOTNOTES
+
+
+@pytest.fixture(scope='module')
+def two_commodities(exports, tmp_path_factory):
+    '''
+    The electricity export with the same rows for a second commodity, with other quantities 
+    under the same transaction codes.
+    '''
+    with open(exports['electricity']) as f:
+        df = pd.read_csv(f, skipfooter=2, engine='python', dtype={'Transaction Code': str})
+    coal = df.assign(**{'Commodity - Transaction': df['Commodity - Transaction'].str.replace('Electricity', 
+                                                                                            'Hard coal'),
+                        'Quantity': df['Quantity'] * 2 + 1})
+    path = str(tmp_path_factory.mktemp('commodities') / 'export.csv')
+    with open(path, 'w') as f:
+        f.write(pd.concat([coal, df]).to_csv(index=False))
+        f.write(FOOTNOTES)
+    return path
+
+
+@pytest.mark.parametrize('options', [{}, {'chunksize': 500}, {'commodities': 'Electricity'}, 
+                                     {'chunksize': 500, 'years': list(range(2004, 2019))}])
+def test_load_single_commodity(energy_data, two_commodities, options):
+    loaded = dataset.EnergyData(two_commodities, snapshot=False, **options)
+    np.testing.assert_array_equal(loaded.transaction_codes, energy_data.transaction_codes)
+    np.testing.assert_array_equal(loaded.countries, energy_data.countries)
+    np.testing.assert_allclose(loaded.cube, energy_data.cube, rtol=1e-6)
+
+
+def test_load_other_commodity(energy_data, two_commodities):
+    coal = dataset.EnergyData(two_commodities, snapshot=False, commodities='Hard coal')
+    np.testing.assert_allclose(coal.cube, energy_data.cube * 2 + 1, rtol=1e-6)
+    with pytest.raises(ValueError):
+        dataset.EnergyData(two_commodities, snapshot=False, commodities=['Electricity', 'Hard coal'])